@@ -0,0 +1,242 @@
+# Stage-level benchmarks of the portfolio pipeline on a synthetic CRSP-like panel.
+#
+#   python benchmarks/run.py --permnos 5000 --months 240
+#
+# Each run is appended to benchmarks/results.jsonl with the commit it ran on, and
+# compared with the latest stored run of another commit on the same parameters.
+# Before timing, the outputs of the family kernels, the spec evaluator and the
+# process pool are checked against per-date reference loops on a sample of dates.
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+# Make the shared `market_cap` modules importable when running from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from market_cap.buckets import assign_buckets
+from market_cap.compact import CompactPanel
+from market_cap.ingest import build_panel, clean_crsp, read_crsp
+from market_cap.instrument import enable
+from market_cap.parallel import default_tasks, run_families
+from market_cap.prices import cumulative_prices
+from market_cap.returns import annual_topx_returns, bucket_returns, topx_returns
+from market_cap.specs import default_specs, evaluate
+from market_cap.synthetic import write_crsp
+
+# =============================================================================
+# Stages
+# =============================================================================
+
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.jsonl')
+
+PORTFOLIO_SIZES = [50, 100, 500, 1000]
+
+# Function to run every pipeline stage once, returning the seconds taken by each and the outputs
+def run_stages(path, workers=2):
+    timings = {}
+    data = {}
+
+    def timed(name, func):
+        start = time.perf_counter()
+        result = func()
+        timings[name] = time.perf_counter() - start
+        return result
+
+    data['crsp'] = timed('ingest', lambda: read_crsp(path))
+    data['crsp'] = timed('clean', lambda: clean_crsp(data['crsp']))
+    panels, _ = timed('pivot', lambda: build_panel(data['crsp'], ['RET', 'MKTCAP']))
+    ret_df, mktcap_df = panels['RET'], panels['MKTCAP']
+    deciles_df = timed('deciles', lambda: assign_buckets(mktcap_df, 10))
+    ew_df, vw_df = timed('decile_returns', lambda: bucket_returns(deciles_df, ret_df, mktcap_df, 10))
+    topxm_ew_df, topxm_vw_df = timed('topx_monthly', lambda: topx_returns(ret_df, mktcap_df, PORTFOLIO_SIZES))
+    topxy_ew_df, topxy_vw_df = timed('topx_yearly', lambda: annual_topx_returns(ret_df, mktcap_df, PORTFOLIO_SIZES))
+    kernels = pd.concat([ew_df.add_prefix('dec_ew_'), vw_df.add_prefix('dec_vw_'),
+                         topxm_ew_df.add_prefix('topx_m_ew_'), topxm_vw_df.add_prefix('topx_m_vw_'),
+                         topxy_ew_df.add_prefix('topx_y_ew_'), topxy_vw_df.add_prefix('topx_y_vw_')], axis=1)
+    outputs = {
+        'kernels': kernels,
+        'evaluate': timed('evaluate', lambda: evaluate(default_specs(PORTFOLIO_SIZES), panels)),
+        'evaluate_compact': timed('evaluate_compact', lambda: evaluate(
+            default_specs(PORTFOLIO_SIZES), CompactPanel.from_long(data['crsp'], ['RET', 'MKTCAP']))),
+        'run_families': timed('run_families', lambda: run_families(ret_df, mktcap_df,
+                                                                   default_tasks(sizes=PORTFOLIO_SIZES), workers)),
+    }
+    timed('cumulative_prices', lambda: cumulative_prices(outputs['evaluate']))
+    return timings, outputs, (deciles_df, ret_df, mktcap_df)
+
+# =============================================================================
+# Equivalence with reference loops
+# =============================================================================
+
+# Function to compute EW and VW bucket returns of one date the way the original loops did
+def reference_bucket_returns(prev_buckets, curr_returns, prev_caps, n_buckets=10):
+    ew, vw = {}, {}
+    for bucket in range(1, n_buckets + 1):
+        stocks = prev_buckets[prev_buckets == bucket].index.intersection(curr_returns.dropna().index)
+        ew[bucket] = curr_returns[stocks].mean() if len(stocks) > 0 else np.nan
+        vw[bucket] = ((curr_returns[stocks] * prev_caps[stocks]).sum() / prev_caps[stocks].sum()
+                      if len(stocks) > 0 else np.nan)
+    return ew, vw
+
+# Function to compute EW and VW returns of one date's largest stocks the way the original loops did
+def reference_top_returns(members, curr_returns, prev_caps):
+    stocks = members.intersection(curr_returns.dropna().index)
+    if len(stocks) == 0:
+        return np.nan, np.nan
+    weights = prev_caps[stocks]
+    return curr_returns[stocks].mean(), (curr_returns[stocks] * weights).sum() / weights.sum()
+
+# Function to compute the reference returns of every default family on a sample of dates
+def reference_returns(deciles_df, ret_df, mktcap_df, n_dates=24):
+    """Return a date x column frame on ``n_dates`` evenly spaced dates after the first."""
+    # The kernels compute in float64 whatever the stored dtypes
+    ret_df, mktcap_df = ret_df.astype(float), mktcap_df.astype(float)
+    rows = np.unique(np.linspace(1, len(ret_df) - 1, min(n_dates, len(ret_df) - 1)).astype(int))
+    year_ends = mktcap_df.groupby(mktcap_df.index.year).apply(lambda x: x.index[x.index.month == 12].max())
+    reference = {}
+    for i in rows:
+        prev_date, curr_date = ret_df.index[i - 1], ret_df.index[i]
+        curr_returns, prev_caps = ret_df.loc[curr_date], mktcap_df.loc[prev_date]
+        row = {}
+
+        ew, vw = reference_bucket_returns(deciles_df.loc[prev_date], curr_returns, prev_caps)
+        row.update({f'dec_ew_{bucket}': value for bucket, value in ew.items()})
+        row.update({f'dec_vw_{bucket}': value for bucket, value in vw.items()})
+
+        year_end = year_ends.get(curr_date.year - 1)
+        year_caps = mktcap_df.loc[year_end] if isinstance(year_end, pd.Timestamp) else None
+        for size in PORTFOLIO_SIZES:
+            members = prev_caps.nlargest(min(size, prev_caps.dropna().size)).index
+            row[f'topx_m_ew_{size}'], row[f'topx_m_vw_{size}'] = reference_top_returns(members, curr_returns,
+                                                                                       prev_caps)
+            if year_caps is None:
+                row[f'topx_y_ew_{size}'] = row[f'topx_y_vw_{size}'] = np.nan
+                continue
+            # Year-end ranks break ties by column order, like the first-ranked nlargest
+            members = year_caps.nlargest(min(size, year_caps.dropna().size)).index
+            row[f'topx_y_ew_{size}'], row[f'topx_y_vw_{size}'] = reference_top_returns(members, curr_returns,
+                                                                                       prev_caps)
+        reference[curr_date] = row
+    return pd.DataFrame.from_dict(reference, orient='index')
+
+# Function to assert that every timed implementation matches the reference loops
+def check_equivalence(outputs, reference, rtol=1e-10):
+    for name, portfolios in outputs.items():
+        actual = portfolios.loc[reference.index, reference.columns]
+        try:
+            np.testing.assert_allclose(actual.to_numpy(dtype=float), reference.to_numpy(dtype=float), rtol=rtol,
+                                       atol=1e-12)
+        except AssertionError as error:
+            raise AssertionError(f'{name} does not match the reference loops:\n{error}') from None
+
+# =============================================================================
+# Results
+# =============================================================================
+
+# Function to describe the checked-out commit
+def git_revision():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(dirty)
+
+# Function to find the latest stored result with the same parameters from another commit
+def previous_result(results_path, params, commit):
+    if not os.path.exists(results_path):
+        return None
+    previous = None
+    with open(results_path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record['params'] == params and record['commit'] != commit:
+                previous = record
+    return previous
+
+# Function to print the stage timings next to a previous run
+def report(record, previous=None):
+    print(f"commit {record['commit']}{' (dirty)' if record['dirty'] else ''}, {record['rows']:,} rows")
+    if previous is not None:
+        print(f"compared with commit {previous['commit']}")
+    for stage, seconds in record['stages'].items():
+        line = f'  {stage:<18} {seconds * 1000:10.1f} ms'
+        if previous is not None and stage in previous['stages']:
+            change = seconds / previous['stages'][stage] - 1
+            line += f'  {change:+7.1%}'
+        print(line)
+
+# =============================================================================
+# Main
+# =============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the portfolio pipeline on a synthetic CRSP-like panel.')
+    parser.add_argument('--permnos', type=int, default=5000, help='number of securities')
+    parser.add_argument('--months', type=int, default=240, help='number of monthly dates')
+    parser.add_argument('--churn', type=float, default=0.01, help='monthly delisting probability')
+    parser.add_argument('--letter-share', type=float, default=0.01, help='share of RET values that are letter codes')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage; the fastest is kept')
+    parser.add_argument('--results', default=RESULTS_PATH, help='JSON lines file the results are appended to')
+    parser.add_argument('--no-save', action='store_true', help='print the timings without storing them')
+    parser.add_argument('--profile', metavar='PATH', help='also write per-stage JSON records to PATH')
+    parser.add_argument('--workers', type=int, default=2, help='processes used by the run_families stage')
+    parser.add_argument('--check-dates', type=int, default=24,
+                        help='dates compared with the reference loops (0 to skip the check)')
+    args = parser.parse_args(argv)
+
+    # Profiled runs trace memory, so their timings are not stored
+    if args.profile:
+        enable(args.profile)
+        args.no_save = True
+
+    params = {'permnos': args.permnos, 'months': args.months, 'churn': args.churn,
+              'letter_share': args.letter_share, 'seed': args.seed}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'crspm.csv')
+        crsp = write_crsp(path, n_permnos=args.permnos, n_months=args.months, churn=args.churn,
+                          letter_share=args.letter_share, seed=args.seed)
+        runs = []
+        for _ in range(args.repeat):
+            timings, outputs, inputs = run_stages(path, args.workers)
+            runs.append(timings)
+        if args.check_dates:
+            check_equivalence(outputs, reference_returns(*inputs, n_dates=args.check_dates))
+            print(f'{len(outputs)} implementations match the reference loops on {args.check_dates} dates')
+
+    commit, dirty = git_revision()
+    record = {
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'params': params,
+        'rows': len(crsp),
+        'repeat': args.repeat,
+        'stages': {stage: min(run[stage] for run in runs) for stage in runs[0]},
+    }
+
+    report(record, previous_result(args.results, params, commit))
+    if not args.no_save:
+        with open(args.results, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+if __name__ == '__main__':
+    main()
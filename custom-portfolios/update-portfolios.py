@@ -0,0 +1,50 @@
+import os
+import sys
+
+# =============================================================================
+# Incremental monthly update of the portfolio series
+# =============================================================================
+
+# Usage, from the repository root after a full run of portfolios.py:
+#     python custom-portfolios/update-portfolios.py path/to/new_months.csv
+# The new file has the same columns as crspm.csv and only the new months.
+
+# Get the current working directory
+cwd = os.getcwd()
+
+# Make the shared `market_cap` modules importable when running from the repository root
+sys.path.insert(0, cwd)
+
+from market_cap.incremental import load_state, save_state, update_many
+from market_cap.ingest import clean_crsp, read_crsp
+from market_cap.pipeline import save_state_results
+
+# Path to the state written by portfolios.py
+state_path = os.path.join(cwd, 'custom-portfolios/.state/portfolios.pkl')
+
+# =============================================================================
+# Import data
+# =============================================================================
+
+# Import and clean the new months with the same filters as portfolios.py
+new_rows = clean_crsp(read_crsp(sys.argv[1], exchcd=[1, 2, 3], shrcd=[10, 11, 12]), ret_floor=-60)
+
+# Load the state of the last full or incremental run
+state = load_state(state_path)
+
+# Skip months that are already in the state
+new_rows = new_rows[new_rows['date'] > state['last_date']]
+
+# =============================================================================
+# Update and save
+# =============================================================================
+
+# Compute the new portfolio returns and append them to the stored series
+state, new_returns = update_many(state, new_rows)
+save_state(state, state_path)
+
+# Replace the stored results of portfolios.py, so that its cached runs and `plot` show the new months
+save_state_results(state)
+
+print(f"Appended {len(new_returns)} month(s); series now end on {state['last_date']:%Y-%m-%d}")
+print(new_returns.T)
@@ -1,9 +1,5 @@
-import pandas as pd
 import os
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import tkinter as tk
-from tkinter import ttk
+import sys
 
 # =============================================================================
 # Import data
@@ -12,115 +8,35 @@ from tkinter import ttk
 # Get the current working directory
 cwd = os.getcwd()
 
-# Import data
-indexes = pd.read_csv(os.path.join(cwd, 'indexes.csv'))
-portfolios = pd.read_csv(os.path.join(cwd, 'portfolios.csv'))
-# =============================================================================
-# Prepare data
-# =============================================================================
-
-# Convert `caldt` to datetime
-indexes['caldt'] = pd.to_datetime(indexes['caldt'], format='%Y%m%d')
-
-# Set `caldt` as the index
-indexes.set_index('caldt', inplace=True)
-
-# Drop the first row and the `sprtrn` column
-indexes = indexes.drop(indexes.index[0])
-indexes = indexes.drop(columns=['sprtrn'])
+# Make the shared `market_cap` modules importable when running from the repository root
+sys.path.insert(0, cwd)
 
-# Compute compounded price for each column starting from 1
-index_prices = (1 + indexes).cumprod()
+from market_cap.indexes import analysis_prices
+from market_cap.plotter import show_prices
 
 # =============================================================================
-
-# Convert `caldt` to datetime
-portfolios['caldt'] = pd.to_datetime(portfolios['caldt'], format='%Y%m%d')
-
-# Preserve the order of 'prtnam' values
-prtnam_order = portfolios['prtnam'].unique()
-
-# Pivot the DataFrame
-portfolios = portfolios.pivot(index='caldt', columns='prtnam', values='totret')
-
-# Reorder the columns based on the preserved order
-portfolios = portfolios[prtnam_order]
-
-# Drop the first row and the `sprtrn` column
-portfolios = portfolios.drop(portfolios.index[0])
-
-# Compute compounded price for each column starting from 1
-portfolio_prices = (1 + portfolios).cumprod()
-
+# Calculate prices
 # =============================================================================
 
-# Reset the index for merging
-index_prices_reset = index_prices.reset_index()
-portfolio_prices_reset = portfolio_prices.reset_index()
-
-# Merge the DataFrames on the index
-prices = pd.merge(index_prices_reset, portfolio_prices_reset, on='caldt')
+# Compound the index returns (without `sprtrn`) and the portfolio returns, each
+# after dropping its first date, and merge them on their common dates
+# (stored in index-analysis/.results and reloaded while the files are unchanged)
+prices = analysis_prices('both', os.path.join(cwd, 'index-analysis'),
+                         os.path.join(cwd, 'index-analysis/.results'))
 
 # =============================================================================
-# Define date range for subsetting
+# Define the initial date range of the plot
 # =============================================================================
 
+# Prices are rebased to 1 on the first date of the range; it can be changed in
+# the plotter's Start and End fields without rerunning the script
 start_date = '1990-01-01'
 end_date = '2023-12-31'
 
-# Subset the prices DataFrame based on the date range
-prices = prices.loc[start_date:end_date]
-
-# Set 'caldt' as the index
-prices.set_index('caldt', inplace=True)
-
 # =============================================================================
 # Create interactive plot
 # =============================================================================
 
-# Predefined colors for each series
-colors = plt.cm.tab10.colors
-color_map = {series: colors[i % len(colors)] for i, series in enumerate(prices.columns)}
-
-# Function to plot selected series
-def plot_series(selected_series):
-    ax.clear()  # Clear the previous plot
-    for series in selected_series:
-        ax.plot(prices.index, prices[series], label=series, color=color_map[series])
-    ax.set_xlabel('Date')
-    ax.set_ylabel('Compounded Price')
-    ax.set_title('Compounded Price Series')
-    ax.legend()
-    ax.grid(True)
-    canvas.draw()
-
-# Create the main window
-window = tk.Tk()
-window.title("Compounded Prices Plotter")
-
-# Create a frame for the controls
-frame = tk.Frame(window)
-frame.pack(side=tk.TOP, fill=tk.X)
-
-# Create a listbox for series selection with multiple selection enabled
-series_listbox = tk.Listbox(frame, selectmode=tk.MULTIPLE, exportselection=0)
-for col in prices.columns:
-    series_listbox.insert(tk.END, col)
-series_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=1)
-
-# Create a button to update the plot
-def on_plot_button_click():
-    selected_indices = series_listbox.curselection()
-    selected_series = [prices.columns[i] for i in selected_indices]
-    plot_series(selected_series)
-
-plot_button = tk.Button(frame, text="Plot", command=on_plot_button_click)
-plot_button.pack(side=tk.LEFT, padx=10)
-
-# Create the initial plot
-fig, ax = plt.subplots(figsize=(10, 6))
-canvas = FigureCanvasTkAgg(fig, master=window)
-canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=1)
-
-# Start the Tkinter event loop
-window.mainloop()
+# Open the plotter; the batch equivalent without a window is
+#     python -m market_cap index-prices both --start 1990-01-01 --end 2023-12-31
+show_prices(prices, start_date, end_date)
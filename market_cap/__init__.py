@@ -0,0 +1 @@
+"""Shared building blocks for the market-cap portfolio and index scripts."""
@@ -0,0 +1,4 @@
+from market_cap.cli import main
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+
+from market_cap.instrument import instrumented
+
+# =============================================================================
+# Cross-sectional ranks
+# =============================================================================
+
+# Function to rank every row of a date x PERMNO matrix in one array-level sort
+def rank_rows(values):
+    """Return 1-based ranks per row (ties broken by column order, like
+    ``rank(method='first')``) and the number of non-NaN values per row."""
+    values = np.asarray(values, dtype=float)
+    n_rows, n_cols = values.shape
+
+    # A stable sort keeps tied values in column order and puts NaNs last
+    order = np.argsort(values, axis=1, kind='stable')
+
+    # Scatter the positions back so that ranks line up with the input columns
+    ranks = np.empty((n_rows, n_cols), dtype=np.int32)
+    positions = np.broadcast_to(np.arange(1, n_cols + 1, dtype=np.int32), (n_rows, n_cols))
+    np.put_along_axis(ranks, order, positions, axis=1)
+
+    counts = (~np.isnan(values)).sum(axis=1)
+    return ranks, counts
+
+# =============================================================================
+# Quantile buckets
+# =============================================================================
+
+# Function to turn per-row ranks into quantile buckets 1..n_buckets
+def ranks_to_buckets(ranks, counts, n_buckets=10):
+    """Map ranks to the same bucket ``pd.qcut(ranks, n_buckets)`` would pick.
+
+    qcut's edges on ranks 1..n sit at ``1 + j * (n - 1) / n_buckets`` and bins are
+    closed on the right, so the bucket of rank r is
+    ``ceil(n_buckets * (r - 1) / (n - 1))`` clipped to 1..n_buckets. The ceiling is
+    done in integer arithmetic to avoid rounding at the bin edges.
+    """
+    ranks = np.asarray(ranks, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)[:, None]
+    buckets = bucket_of_rank(ranks, counts, n_buckets)
+
+    # Ranks beyond the row count belong to missing values
+    buckets[ranks > counts] = np.nan
+    return buckets
+
+# Function to compute the qcut bucket of each rank given its cross-section size
+def bucket_of_rank(ranks, counts, n_buckets):
+    """Elementwise ``ceil(n_buckets * (rank - 1) / (count - 1))`` clipped to 1..n_buckets."""
+    # Cross-sections with a single stock put it in the first bucket
+    numerator = n_buckets * (np.asarray(ranks, dtype=np.int64) - 1)
+    denominator = np.maximum(np.asarray(counts, dtype=np.int64) - 1, 1)
+    return np.clip(-(-numerator // denominator), 1, n_buckets).astype(float)
+
+# Function to assign quantile buckets for all dates at once
+@instrumented
+def assign_buckets(mktcap_df, n_buckets=10):
+    """Vectorised replacement for ``mktcap_df.apply(rank_to_deciles, axis=1)``.
+
+    Every row is ranked with ``method='first'`` semantics and cut into
+    ``n_buckets`` equal-count buckets labelled 1..n_buckets; missing values stay NaN.
+    """
+    ranks, counts = rank_rows(mktcap_df.to_numpy(dtype=float))
+    buckets = ranks_to_buckets(ranks, counts, n_buckets)
+    return pd.DataFrame(buckets, index=mktcap_df.index, columns=mktcap_df.columns)
+
+# =============================================================================
+# Breakpoint buckets
+# =============================================================================
+
+# Exchange codes of the sub-universes breakpoints can be computed on
+BREAKPOINT_UNIVERSES = {
+    'nyse': (1,),
+    'nyse_amex': (1, 2),
+    'all': (1, 2, 3),
+}
+
+# Function to compute per-date breakpoints on a sub-universe
+def breakpoint_table(values_df, universe_df, n_buckets=10):
+    """Return a date x (n_buckets - 1) frame of quantile breakpoints.
+
+    Breakpoints are the ``j / n_buckets`` quantiles of ``values_df`` over the
+    stocks where ``universe_df`` is True, e.g. NYSE stocks (EXCHCD == 1).
+    Dates without any stock in the universe get NaN breakpoints.
+    """
+    values = values_df.to_numpy(dtype=float)
+    universe = np.asarray(universe_df, dtype=bool)
+    masked = np.where(universe, values, np.nan)
+
+    quantiles = np.arange(1, n_buckets) / n_buckets
+    has_universe = (~np.isnan(masked)).any(axis=1)
+    table = np.full((len(values), n_buckets - 1), np.nan)
+    if has_universe.any():
+        table[has_universe] = np.nanquantile(masked[has_universe], quantiles, axis=1).T
+    return pd.DataFrame(table, index=values_df.index, columns=range(1, n_buckets))
+
+# Function to assign every stock to a bucket from per-date breakpoints
+@instrumented
+def assign_by_breakpoints(values_df, table):
+    """Return buckets 1..n_buckets: a stock at or below the j-th breakpoint (and
+    above the previous one) is in bucket j, above the last one in the top bucket.
+
+    A stock's bucket is one plus the number of its date's breakpoints strictly
+    below it, counted for the whole panel with one comparison per breakpoint.
+    """
+    values = values_df.to_numpy(dtype=float)
+    breakpoints = np.asarray(table, dtype=float)
+    # Counts follow the memory layout of the values (frames are column-major)
+    counts = np.zeros_like(values, dtype=np.min_scalar_type(breakpoints.shape[1]))
+    for j in range(breakpoints.shape[1]):
+        counts += values > breakpoints[:, j, None]
+
+    # Dates with a missing breakpoint are left unassigned
+    buckets = np.where(np.isnan(values), np.nan, counts + 1.0)
+    buckets[np.isnan(breakpoints).any(axis=1)] = np.nan
+    return pd.DataFrame(buckets, index=values_df.index, columns=values_df.columns)
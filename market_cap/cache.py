@@ -0,0 +1,223 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+
+# =============================================================================
+# Fingerprints
+# =============================================================================
+
+# Size of the blocks read while hashing source files
+HASH_BLOCK_SIZE = 1 << 20
+
+# Name of the file that remembers the content hash of each source file
+HASHES_FILE = 'hashes.json'
+
+# Function to hash the content of a file without loading it at once
+def hash_file(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Function to fingerprint a source file by size, mtime and content hash
+def file_fingerprint(path, cache_dir):
+    """Return ``{'size', 'mtime', 'sha1'}`` for ``path``.
+
+    The content hash is remembered in ``cache_dir`` and only recomputed when the
+    size or mtime change, so warm starts do not re-read large files.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    hashes_path = os.path.join(cache_dir, HASHES_FILE)
+
+    hashes = {}
+    if os.path.exists(hashes_path):
+        with open(hashes_path) as f:
+            hashes = json.load(f)
+
+    known = hashes.get(path)
+    if known is not None and known['size'] == stat.st_size and known['mtime'] == stat.st_mtime_ns:
+        return known
+
+    fingerprint = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha1': hash_file(path)}
+    hashes[path] = fingerprint
+    os.makedirs(cache_dir, exist_ok=True)
+    _write_json(hashes, hashes_path)
+    return fingerprint
+
+# Function to derive a cache key from a source file and the parameters used on it
+def cache_key(path, cache_dir, **params):
+    """Return a short key combining the file fingerprint and ``params``.
+
+    The mtime is left out of the key itself: a file that was only touched has
+    the same content hash and keeps its cache entry.
+    """
+    fingerprint = file_fingerprint(path, cache_dir)
+    payload = json.dumps({'size': fingerprint['size'], 'sha1': fingerprint['sha1'], 'params': params},
+                         sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+# Function to name the entries built from a source file with given parameters
+def cache_source(path, **params):
+    """Return the source an entry is pruned by: ``path`` and ``params``.
+
+    A new entry replaces those of the same file and parameters (built from its
+    older content), while entries built with other parameters are kept.
+    """
+    payload = json.dumps(params, sort_keys=True, default=str)
+    return f'{os.path.abspath(path)}#{hashlib.sha1(payload.encode()).hexdigest()[:16]}'
+
+# =============================================================================
+# Columnar storage
+# =============================================================================
+
+# Function to write JSON atomically
+def _write_json(obj, path):
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(obj, f, default=str)
+    os.replace(tmp_path, path)
+
+# Function to save one array, encoding datetimes and categories as numbers
+def _save_array(values, directory, name):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        np.save(os.path.join(directory, f'{name}.npy'), values.cat.codes.to_numpy())
+        return {'kind': 'category', 'categories': values.cat.categories.tolist()}
+    values = np.asarray(values)
+    if values.dtype.kind == 'M':
+        np.save(os.path.join(directory, f'{name}.npy'), values.view(np.int64))
+        return {'kind': 'datetime', 'dtype': str(values.dtype)}
+    if values.dtype == object:
+        codes, uniques = pd.factorize(values.ravel())
+        np.save(os.path.join(directory, f'{name}.npy'), codes.astype(np.int32).reshape(values.shape))
+        return {'kind': 'object', 'categories': uniques.tolist()}
+    np.save(os.path.join(directory, f'{name}.npy'), values)
+    return {'kind': 'numeric'}
+
+# Function to load one array saved by _save_array
+def _load_array(directory, name, meta, mmap):
+    # Copy-on-write maps keep the loaded frames writable without touching the files
+    values = np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='c' if mmap else None)
+    if meta['kind'] == 'category':
+        return pd.Categorical.from_codes(values, categories=meta['categories'])
+    if meta['kind'] == 'datetime':
+        return np.asarray(values).view(meta['dtype'])
+    if meta['kind'] == 'object':
+        # Code -1 marks a missing value
+        lookup = np.array(meta['categories'] + [np.nan], dtype=object)
+        return lookup[values]
+    return values
+
+# Function to save a long DataFrame as one .npy file per column
+def save_frame(df, directory):
+    os.makedirs(directory, exist_ok=True)
+    meta = {'columns': [], 'arrays': {}}
+    for i, col in enumerate(df.columns):
+        meta['columns'].append(col)
+        meta['arrays'][f'col{i}'] = _save_array(df[col], directory, f'col{i}')
+    _write_json(meta, os.path.join(directory, 'meta.json'))
+
+# Function to load a DataFrame saved by save_frame, memory-mapping numeric columns
+def load_frame(directory, mmap=True):
+    with open(os.path.join(directory, 'meta.json')) as f:
+        meta = json.load(f)
+    data = {col: _load_array(directory, f'col{i}', meta['arrays'][f'col{i}'], mmap)
+            for i, col in enumerate(meta['columns'])}
+    return pd.DataFrame(data, copy=False)
+
+# Function to save a date x PERMNO matrix as values, index and columns arrays
+def save_matrix(df, directory):
+    os.makedirs(directory, exist_ok=True)
+    meta = {
+        'index_name': df.index.name,
+        'columns_name': df.columns.name,
+        'values': _save_array(df.to_numpy(), directory, 'values'),
+        'index': _save_array(df.index.to_numpy(), directory, 'index'),
+        'columns': _save_array(df.columns.to_numpy(), directory, 'columns'),
+    }
+    _write_json(meta, os.path.join(directory, 'meta.json'))
+
+# Function to load a matrix saved by save_matrix, memory-mapping the values
+def load_matrix(directory, mmap=True):
+    with open(os.path.join(directory, 'meta.json')) as f:
+        meta = json.load(f)
+    values = _load_array(directory, 'values', meta['values'], mmap)
+    index = pd.Index(_load_array(directory, 'index', meta['index'], False), name=meta['index_name'])
+    columns = pd.Index(_load_array(directory, 'columns', meta['columns'], False), name=meta['columns_name'])
+    return pd.DataFrame(values, index=index, columns=columns, copy=False)
+
+# =============================================================================
+# Cache entries
+# =============================================================================
+
+# Function to locate the entry directory of a cache key
+def entry_dir(cache_dir, key):
+    return os.path.join(cache_dir, key)
+
+# Function to check whether a cache entry was completely written
+def has_entry(cache_dir, key):
+    return os.path.exists(os.path.join(entry_dir(cache_dir, key), 'complete'))
+
+# Function to write a cache entry atomically and drop stale entries of the same source
+def write_entry(cache_dir, key, source, frames=None, matrices=None, meta=None, prune=True):
+    """Store ``frames`` (long) and ``matrices`` (wide) under ``key``.
+
+    Entries are written to a temporary directory and renamed into place, and
+    older entries built from the same ``source`` file are removed. Pruning
+    scans the whole cache directory; callers whose keys never go stale (one
+    fixed key per source) pass ``prune=False`` to skip it.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = os.path.join(cache_dir, f'{key}.{uuid.uuid4().hex}.tmp')
+    for name, df in (frames or {}).items():
+        save_frame(df, os.path.join(tmp_dir, 'frames', name))
+    for name, df in (matrices or {}).items():
+        save_matrix(df, os.path.join(tmp_dir, 'matrices', name))
+    os.makedirs(tmp_dir, exist_ok=True)
+    _write_json({'source': os.path.abspath(source), 'meta': meta or {}}, os.path.join(tmp_dir, 'entry.json'))
+    open(os.path.join(tmp_dir, 'complete'), 'w').close()
+
+    final_dir = entry_dir(cache_dir, key)
+    if os.path.exists(final_dir):
+        shutil.rmtree(final_dir)
+    os.replace(tmp_dir, final_dir)
+    if prune:
+        prune_entries(cache_dir, source, keep=key)
+
+# Function to read a cache entry written by write_entry
+def read_entry(cache_dir, key, mmap=True):
+    """Return ``(frames, matrices, meta)`` for ``key``."""
+    directory = entry_dir(cache_dir, key)
+    with open(os.path.join(directory, 'entry.json')) as f:
+        meta = json.load(f)['meta']
+    frames, matrices = {}, {}
+    for kind, loader, out in (('frames', load_frame, frames), ('matrices', load_matrix, matrices)):
+        kind_dir = os.path.join(directory, kind)
+        if os.path.isdir(kind_dir):
+            for name in sorted(os.listdir(kind_dir)):
+                out[name] = loader(os.path.join(kind_dir, name), mmap=mmap)
+    return frames, matrices, meta
+
+# Function to remove entries of a source file other than the current one
+def prune_entries(cache_dir, source, keep):
+    source = os.path.abspath(source)
+    for name in os.listdir(cache_dir):
+        # Temporary directories belong to writes still in progress
+        if name == keep or name.endswith('.tmp'):
+            continue
+        directory = os.path.join(cache_dir, name)
+        # Entries (and files like hashes.json) can be replaced or removed by
+        # other writers while the directory is scanned
+        try:
+            with open(os.path.join(directory, 'entry.json')) as f:
+                entry_source = json.load(f)['source']
+        except (OSError, ValueError, KeyError):
+            continue
+        if entry_source == source:
+            shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,174 @@
+import argparse
+import os
+
+from market_cap import instrument
+
+# =============================================================================
+# Commands
+# =============================================================================
+
+# Default locations of the stored results of each command
+PORTFOLIO_RESULTS_DIR = 'custom-portfolios/.results'
+INDEX_RESULTS_DIR = 'index-analysis/.results'
+
+# Function to write a frame to CSV, creating the directory if needed
+def _write_csv(df, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    df.to_csv(path)
+    print(f'Wrote {df.shape[0]} rows x {df.shape[1]} columns to {path}')
+
+# Function to run the portfolio pipeline and write its results
+def build_portfolios_command(args):
+    from market_cap.pipeline import build_portfolios, cached_portfolios
+
+    params = dict(start_date=args.start or None, end_date=args.end or None, cache_dir=args.cache_dir or None,
+                  state_path=args.state or None, sizes=args.sizes, workers=args.workers, compact=args.compact)
+    if args.results_dir:
+        portfolios, prices, meta = cached_portfolios(args.results_dir, args.crsp, **params)
+    else:
+        crsp, portfolios, prices = build_portfolios(args.crsp, **params)
+        meta = crsp.attrs
+    print(f"Number of instances where RET < -60: {meta['num_ret_below_floor']}")
+    print(f"Number of duplicate (date, PERMNO) rows: {meta['num_duplicate_keys']}")
+    _write_csv(portfolios, os.path.join(args.output_dir, 'portfolios.csv'))
+    _write_csv(prices, os.path.join(args.output_dir, 'prices.csv'))
+    return prices
+
+# Function to reconcile our market returns with CRSP's vwretd/ewretd and write them
+def market_returns_command(args):
+    from market_cap.market import deviation_summary
+    from market_cap.pipeline import cached_market_returns
+
+    market = cached_market_returns(args.results_dir or None, args.crsp, args.cache_dir or None)
+    print(deviation_summary(market, args.tolerance).to_string())
+    _write_csv(market, args.output)
+
+# Function to compute the prices of one index analysis and write them
+def index_prices_command(args):
+    from market_cap.indexes import analysis_prices
+    from market_cap.prices import PriceStore
+
+    prices = analysis_prices(args.analysis, args.data_dir, args.results_dir or None)
+    if args.start or args.end:
+        prices = PriceStore.from_prices(prices).window(args.start, args.end)
+    _write_csv(prices, args.output or os.path.join(args.data_dir, f'{args.analysis}-prices.csv'))
+    return prices
+
+# Function to stream daily portfolio returns from a daily file to CSV
+def daily_returns_command(args):
+    from market_cap.daily import write_daily_returns
+
+    n_dates = write_daily_returns(args.crsp, args.output, args.buckets, args.sizes, chunksize=args.chunksize)
+    print(f'Wrote {n_dates} dates to {args.output}')
+
+# Function to reconcile vendor prices of many tickers with their Compustat files
+def reconcile_command(args):
+    from market_cap.reconcile import CachedSource, CsvSource, YahooSource, compustat_files, reconcile
+
+    source = YahooSource() if args.source == 'yahoo' else CsvSource(args.vendor_dir)
+    if args.cache_dir:
+        source = CachedSource(source, args.cache_dir, refresh=args.refresh)
+    report = reconcile(args.tickers, source, compustat_files(args.reference_dir), args.tolerance, args.workers)
+    print(report.to_string())
+    _write_csv(report, args.output)
+
+# Function to attach to the latest stored prices of a result
+def plot_command(args):
+    from market_cap.results import latest_results
+
+    results_dir = args.results_dir or (PORTFOLIO_RESULTS_DIR if args.name == 'portfolios' else INDEX_RESULTS_DIR)
+    results = latest_results(results_dir, args.name)
+    if results is None:
+        raise SystemExit(f'No stored results named {args.name!r} in {results_dir}')
+    args.plot = True
+    return results[0]['prices']
+
+# =============================================================================
+# Entry point
+# =============================================================================
+
+def build_parser():
+    from market_cap.indexes import INDEX_ANALYSES
+
+    parser = argparse.ArgumentParser(prog='python -m market_cap',
+                                     description='Build market-cap portfolio and index price series without a display.')
+    parser.add_argument('--profile', metavar='PATH', help="write per-stage JSON records to PATH ('-' for stderr)")
+    parser.add_argument('--flamegraph', metavar='PATH', help='with --profile, also write collapsed stacks to PATH')
+    parser.add_argument('--plot', action='store_true', help='open the interactive plotter on the result')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build-portfolios', help='run the portfolios.py pipeline')
+    build.add_argument('--crsp', default='custom-portfolios/crspm.csv', help='CRSP monthly file')
+    build.add_argument('--cache-dir', default='custom-portfolios/.cache', help="panel cache ('' to disable)")
+    build.add_argument('--results-dir', default=PORTFOLIO_RESULTS_DIR,
+                       help="stored results, reused while the inputs are unchanged ('' to always recompute)")
+    build.add_argument('--state', default='custom-portfolios/.state/portfolios.pkl',
+                       help="state for update-portfolios.py ('' to skip)")
+    build.add_argument('--output-dir', default='custom-portfolios/results')
+    build.add_argument('--start', default='1990-01-01', help="first date ('' for the whole history)")
+    build.add_argument('--end', default='2023-12-31')
+    build.add_argument('--sizes', type=int, nargs='+', default=[50, 100, 500, 1000], help='top-X portfolio sizes')
+    build.add_argument('--workers', type=int, help='evaluate the portfolio families on this many processes')
+    build.add_argument('--compact', action='store_true',
+                       help='evaluate on a panel of the live securities only, to save memory on long histories')
+    build.set_defaults(func=build_portfolios_command)
+
+    market = commands.add_parser('market-returns', help="compare the universe's market returns with vwretd/ewretd")
+    market.add_argument('--crsp', default='custom-portfolios/crspm.csv', help='CRSP monthly file')
+    market.add_argument('--cache-dir', default='custom-portfolios/.cache', help="panel cache ('' to disable)")
+    market.add_argument('--results-dir', default=PORTFOLIO_RESULTS_DIR,
+                        help="stored results, reused while the inputs are unchanged ('' to always recompute)")
+    market.add_argument('--output', default='custom-portfolios/results/market.csv')
+    market.add_argument('--tolerance', type=float, default=1e-3, help='deviation counted as a mismatch')
+    market.set_defaults(func=market_returns_command)
+
+    index = commands.add_parser('index-prices', help='compound the returns of an index-analysis script')
+    index.add_argument('analysis', choices=sorted(INDEX_ANALYSES))
+    index.add_argument('--data-dir', default='index-analysis')
+    index.add_argument('--results-dir', default=INDEX_RESULTS_DIR,
+                       help="stored results, reused while the inputs are unchanged ('' to always recompute)")
+    index.add_argument('--output', help='CSV to write (default: <data-dir>/<analysis>-prices.csv)')
+    index.add_argument('--start', help='first date of the output, on which prices are rebased to 1')
+    index.add_argument('--end')
+    index.set_defaults(func=index_prices_command)
+
+    daily = commands.add_parser('daily-returns', help='stream daily portfolio returns from a date-sorted daily file')
+    daily.add_argument('crsp', help='CRSP daily file, sorted by date')
+    daily.add_argument('--output', default='custom-portfolios/results/daily.csv')
+    daily.add_argument('--buckets', type=int, default=10)
+    daily.add_argument('--sizes', type=int, nargs='+', default=[50, 100, 500, 1000], help='top-X portfolio sizes')
+    daily.add_argument('--chunksize', type=int, default=1_000_000, help='rows read at a time')
+    daily.set_defaults(func=daily_returns_command)
+
+    check = commands.add_parser('reconcile', help='compare vendor prices with Compustat, one ticker per thread')
+    check.add_argument('tickers', nargs='+')
+    check.add_argument('--source', choices=['yahoo', 'csv'], default='yahoo',
+                       help="'csv' reads <vendor-dir>/<ticker>.csv instead of Yahoo Finance")
+    check.add_argument('--vendor-dir', default='yahoo-comparison/vendor')
+    check.add_argument('--reference-dir', default='yahoo-comparison', help='Compustat files named <ticker>.csv')
+    check.add_argument('--cache-dir', default='yahoo-comparison/.cache', help="vendor responses ('' to disable)")
+    check.add_argument('--refresh', action='store_true', help='fetch again instead of using the cache')
+    check.add_argument('--tolerance', type=float, default=1e-3,
+                       help='return or relative price difference counted as a mismatch')
+    check.add_argument('--workers', type=int, default=8)
+    check.add_argument('--output', default='yahoo-comparison/results/reconciliation.csv')
+    check.set_defaults(func=reconcile_command)
+
+    plot = commands.add_parser('plot', help='open the plotter on the latest stored prices')
+    plot.add_argument('name', choices=['portfolios'] + sorted(INDEX_ANALYSES))
+    plot.add_argument('--results-dir', help='where the results are stored (default: the command default)')
+    plot.set_defaults(func=plot_command)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.profile:
+        instrument.enable(args.profile, flamegraph=args.flamegraph)
+
+    prices = args.func(args)
+
+    # The plotting stack is only imported when a window is requested; commands
+    # that stream their output return no prices to plot
+    if args.plot and prices is not None:
+        from market_cap.plotter import show_prices
+        show_prices(prices)
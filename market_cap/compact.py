@@ -0,0 +1,316 @@
+import numpy as np
+import pandas as pd
+
+from market_cap.buckets import bucket_of_rank
+
+# =============================================================================
+# Compact date x PERMNO panel
+# =============================================================================
+
+class CompactPanel:
+    """Ragged date x PERMNO panel that stores only the live securities of each date.
+
+    Entries are sorted by date and then PERMNO. The securities of date ``t`` are
+    ``codes[offsets[t]:offsets[t + 1]]`` (positions in ``permnos``), and every
+    variable is a flat float64 array aligned with ``codes`` (CSR layout). This
+    holds the same information as the dense matrices, without the cells of
+    securities that are not listed on a date, and gives the same results as the
+    dense kernels up to the order of floating-point sums.
+    """
+
+    def __init__(self, dates, permnos, offsets, codes, values):
+        self.dates = dates
+        self.permnos = permnos
+        self.offsets = offsets
+        self.codes = codes
+        self.values = values
+
+        # Date position of every entry, used to key group reductions
+        self.date_codes = np.repeat(np.arange(len(dates), dtype=np.int32), np.diff(offsets))
+
+    # Function to build the panel from the long CRSP frame
+    @classmethod
+    def from_long(cls, crsp, values, dtype=np.float64):
+        """Build a panel holding the columns in ``values`` of the long frame.
+
+        Repeated (date, PERMNO) keys keep their first occurrence, as in
+        ``build_panel``.
+        """
+        date_codes, dates = pd.factorize(crsp['date'], sort=True)
+        permno_codes, permnos = pd.factorize(crsp['PERMNO'], sort=True)
+        keys = date_codes.astype(np.int64) * len(permnos) + permno_codes
+
+        # Keep the first row of each key and order the entries by date, then PERMNO
+        first = ~pd.Index(keys).duplicated(keep='first')
+        rows = np.flatnonzero(first)
+        rows = rows[np.argsort(keys[rows], kind='stable')]
+
+        offsets = np.zeros(len(dates) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(date_codes[rows], minlength=len(dates)))
+        codes = permno_codes[rows].astype(np.int32)
+        arrays = {value: crsp[value].to_numpy(dtype=dtype)[rows] for value in values}
+        return cls(pd.DatetimeIndex(dates, name='date'), pd.Index(permnos, name='PERMNO'), offsets, codes, arrays)
+
+    # Function to build the panel from aligned dense date x PERMNO frames
+    @classmethod
+    def from_dense(cls, panels, dtype=np.float64):
+        """Keep the cells where any of the frames in ``panels`` has a value."""
+        first = next(iter(panels.values()))
+        matrices = {name: df.to_numpy(dtype=dtype) for name, df in panels.items()}
+        present = np.zeros(first.shape, dtype=bool)
+        for matrix in matrices.values():
+            present |= ~np.isnan(matrix)
+        rows, cols = np.nonzero(present)
+        offsets = np.zeros(len(first) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(rows, minlength=len(first)))
+        arrays = {name: matrix[rows, cols] for name, matrix in matrices.items()}
+        return cls(first.index, first.columns, offsets, cols.astype(np.int32), arrays)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, name):
+        return self.values[name]
+
+    def __contains__(self, name):
+        return name in self.values
+
+    @property
+    def nbytes(self):
+        return (self.offsets.nbytes + self.codes.nbytes + self.date_codes.nbytes
+                + sum(v.nbytes for v in self.values.values()))
+
+    # Function to fetch a stored variable by name, or pass an aligned array through
+    def _get(self, values):
+        return self.values[values] if isinstance(values, str) else values
+
+    # Function to expand a variable back to a dense date x PERMNO frame
+    def to_dense(self, values):
+        matrix = np.full((len(self.dates), len(self.permnos)), np.nan)
+        matrix[self.date_codes, self.codes] = self._get(values)
+        return pd.DataFrame(matrix, index=self.dates, columns=self.permnos)
+
+    # =========================================================================
+    # Alignment across dates
+    # =========================================================================
+
+    # Function to find each entry's position on another date
+    def align_positions(self, source):
+        """Return the entry position of the same PERMNO on date ``source[t]``
+        for every entry of date ``t``, or -1 when it has no entry there.
+
+        ``source`` holds one date position per date (-1 for none), e.g.
+        ``t - 1`` for the previous date or the formation date a holding period
+        started on.
+        """
+        source = np.asarray(source, dtype=np.int64)
+        n_permnos = len(self.permnos)
+        keys = self.date_codes.astype(np.int64) * n_permnos + self.codes
+        entry_source = source[self.date_codes]
+        targets = entry_source * n_permnos + self.codes
+        positions = np.minimum(np.searchsorted(keys, targets), max(len(keys) - 1, 0))
+        found = (entry_source >= 0) & (keys[positions] == targets)
+        return np.where(found, positions, -1)
+
+    # Function to find each entry's position ``periods`` dates earlier
+    def lag_positions(self, periods=1):
+        return self.align_positions(np.arange(len(self.dates)) - periods)
+
+    # Function to align a variable with its value on another date of the same PERMNO
+    def align(self, values, source):
+        values = np.asarray(self._get(values), dtype=float)
+        positions = self.align_positions(source)
+        aligned = np.full(len(self.codes), np.nan)
+        found = positions >= 0
+        aligned[found] = values[positions[found]]
+        return aligned
+
+    # Function to align a variable with the previous date's value of the same PERMNO
+    def lag(self, values, periods=1):
+        return self.align(values, np.arange(len(self.dates)) - periods)
+
+    # Function to compound returns per PERMNO from a source date to the previous date
+    def growth_since(self, returns, source):
+        """Return, for every entry of date ``t``, the gross return of its PERMNO
+        over the dates after ``source[t]`` and before ``t`` (NaN where
+        ``source[t]`` is -1): the factor a buy-and-hold weight set on the source
+        date has drifted by, as ``rebalance.drift_factors`` computes it.
+
+        Missing returns count as zero and total losses are floored just above
+        -100%, so the logarithm stays finite.
+        """
+        returns = np.asarray(self._get(returns), dtype=float)
+        log_growth = np.log1p(np.clip(np.nan_to_num(returns, nan=0.0), -1 + 1e-12, None))
+
+        # Cumulative log growth of each PERMNO over its own dates
+        n_dates = len(self.dates)
+        keys = self.codes.astype(np.int64) * n_dates + self.date_codes
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        cumulative = np.cumsum(log_growth[order])
+
+        # Function to look up the cumulative growth up to and including a date
+        def upto(dates):
+            targets = self.codes.astype(np.int64) * n_dates + dates
+            positions = np.searchsorted(sorted_keys, targets, side='right') - 1
+            clipped = np.maximum(positions, 0)
+            same = (positions >= 0) & (sorted_keys[clipped] // n_dates == self.codes)
+            return np.where(same, cumulative[clipped], 0.0)
+
+        entry_source = np.asarray(source, dtype=np.int64)[self.date_codes]
+        factors = np.exp(upto(self.date_codes.astype(np.int64) - 1) - upto(entry_source))
+        factors[entry_source < 0] = np.nan
+        return factors
+
+    # =========================================================================
+    # Ranking
+    # =========================================================================
+
+    # Function to rank a variable within each date
+    def rank(self, values, ascending=True):
+        """Return 1-based ranks within each date (NaN for missing values) and the
+        number of ranked entries per date. Ties keep PERMNO order, like
+        ``rank(method='first')`` on the dense matrix."""
+        values = np.asarray(self._get(values), dtype=float)
+        keys = values if ascending else -values
+
+        # Sort by date, then by value; NaNs go last within each date
+        order = np.lexsort((keys, self.date_codes))
+        positions = np.empty(len(order), dtype=np.int64)
+        positions[order] = np.arange(len(order))
+
+        missing = np.isnan(values)
+        counts = np.bincount(self.date_codes[~missing], minlength=len(self.dates))
+        ranks = (positions - self.offsets[self.date_codes] + 1).astype(float)
+        ranks[missing] = np.nan
+        return ranks, counts
+
+    # Function to assign quantile buckets within each date
+    def buckets(self, values, n_buckets=10):
+        """Equal-count buckets 1..n_buckets per date, matching ``assign_buckets``."""
+        ranks, counts = self.rank(values)
+        return self.rank_buckets(ranks, counts[self.date_codes], n_buckets)
+
+    # Function to turn ranks and cross-section sizes into quantile buckets
+    @staticmethod
+    def rank_buckets(ranks, counts, n_buckets):
+        missing = np.isnan(ranks)
+        buckets = bucket_of_rank(np.where(missing, 1, ranks), np.where(missing, 1, counts), n_buckets)
+        buckets[missing] = np.nan
+        return buckets
+
+    # Function to compute per-date quantile breakpoints on a sub-universe
+    def breakpoints(self, values, in_universe, n_buckets=10):
+        """Return a dates x (n_buckets - 1) array of the ``j / n_buckets``
+        quantiles of ``values`` over the entries where ``in_universe`` is True,
+        interpolated like ``np.nanquantile``; NaN on dates without any."""
+        values = np.asarray(self._get(values), dtype=float)
+        keep = np.asarray(in_universe, dtype=bool) & ~np.isnan(values)
+        dates = self.date_codes[keep]
+        order = np.lexsort((values[keep], dates))
+        sorted_values = values[keep][order]
+        counts = np.bincount(dates, minlength=len(self.dates))
+        starts = np.cumsum(counts) - counts
+
+        quantiles = np.arange(1, n_buckets) / n_buckets
+        table = np.full((len(self.dates), n_buckets - 1), np.nan)
+        has_universe = counts > 0
+        n = counts[has_universe, None]
+
+        # numpy's 'linear' method: the (n - 1) * q-th value, interpolated with
+        # the same two-sided formula so the breakpoints are bit-identical
+        virtual = (n - 1) * quantiles
+        previous = np.floor(virtual)
+        gamma = virtual - previous
+        previous = np.where(virtual >= n - 1, n - 1, previous).astype(np.int64)
+        following = np.where(virtual >= n - 1, n - 1, previous + 1).astype(np.int64)
+        start = starts[has_universe, None]
+        a = sorted_values[start + previous]
+        b = sorted_values[start + following]
+        diff = b - a
+        table[has_universe] = np.where(gamma >= 0.5, b - diff * (1 - gamma), a + diff * gamma)
+        return table
+
+    # Function to assign every entry to a bucket from its date's breakpoints
+    def breakpoint_buckets(self, values, table):
+        """One plus the number of the date's breakpoints strictly below the
+        value, as ``assign_by_breakpoints``; NaN for missing values and dates
+        with a missing breakpoint."""
+        values = np.asarray(self._get(values), dtype=float)
+        entry_table = np.asarray(table, dtype=float)[self.date_codes]
+        buckets = (values[:, None] > entry_table).sum(axis=1) + 1.0
+        buckets[np.isnan(values) | np.isnan(entry_table).any(axis=1)] = np.nan
+        return buckets
+
+    # =========================================================================
+    # Group reductions
+    # =========================================================================
+
+    # Function to sum values per (date, group)
+    def group_sum(self, values, labels, n_groups):
+        """Return a dates x n_groups array of sums over entries with group label
+        1..n_groups; entries with a NaN label or value are skipped."""
+        values = np.asarray(self._get(values), dtype=float)
+        labels = np.asarray(labels, dtype=float)
+        valid = ~np.isnan(values) & ~np.isnan(labels)
+        keys = self.date_codes[valid].astype(np.int64) * n_groups + labels[valid].astype(np.int64) - 1
+        sums = np.bincount(keys, weights=values[valid], minlength=len(self.dates) * n_groups)
+        return sums.reshape(len(self.dates), n_groups)
+
+    # Function to reduce returns by (date, group) label, like returns.grouped_returns
+    def grouped_returns(self, labels, returns, weights, n_groups):
+        """Return dates x n_groups arrays ``(ew, vw)``; ``labels`` and ``weights``
+        are already aligned with the formation and weighting dates."""
+        returns = np.asarray(self._get(returns), dtype=float)
+        weights = np.asarray(weights, dtype=float)
+        has_return = ~np.isnan(returns)
+        has_weight = has_return & ~np.isnan(weights)
+        counts = self.group_sum(np.where(has_return, 1.0, np.nan), labels, n_groups)
+        ret_sums = self.group_sum(returns, labels, n_groups)
+        weight_counts = self.group_sum(np.where(has_weight, 1.0, np.nan), labels, n_groups)
+        weighted_sums = self.group_sum(np.where(has_weight, returns * weights, np.nan), labels, n_groups)
+        weight_sums = self.group_sum(np.where(has_weight, weights, np.nan), labels, n_groups)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ew = np.where(counts > 0, ret_sums / counts, np.nan)
+            vw = np.where(weight_counts > 0, weighted_sums / weight_sums, np.nan)
+        return ew, vw
+
+    # Function to compute top-X returns for many sizes, like returns.ranked_prefix_returns
+    def ranked_prefix_returns(self, ranks, returns, weights, sizes):
+        """Return dates x len(sizes) arrays ``(ew, vw)``. Entries are grouped by
+        the smallest size whose portfolio they enter; running totals over the
+        sorted sizes then give every portfolio."""
+        sizes = np.asarray(list(sizes), dtype=np.int64)
+        ranks = np.asarray(ranks, dtype=float)
+        labels = np.full(len(ranks), np.nan)
+        ranked = ~np.isnan(ranks)
+        labels[ranked] = np.searchsorted(sizes, ranks[ranked], side='left') + 1.0
+        labels[labels > len(sizes)] = np.nan
+
+        returns = np.asarray(self._get(returns), dtype=float)
+        weights = np.asarray(weights, dtype=float)
+        has_return = ~np.isnan(returns)
+        has_weight = has_return & ~np.isnan(weights)
+        n_sizes = len(sizes)
+        counts = np.cumsum(self.group_sum(np.where(has_return, 1.0, np.nan), labels, n_sizes), axis=1)
+        ret_sums = np.cumsum(self.group_sum(returns, labels, n_sizes), axis=1)
+        weight_counts = np.cumsum(self.group_sum(np.where(has_weight, 1.0, np.nan), labels, n_sizes), axis=1)
+        weighted_sums = np.cumsum(self.group_sum(np.where(has_weight, returns * weights, np.nan), labels, n_sizes),
+                                  axis=1)
+        weight_sums = np.cumsum(self.group_sum(np.where(has_weight, weights, np.nan), labels, n_sizes), axis=1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ew = np.where(counts > 0, ret_sums / counts, np.nan)
+            vw = np.where(weight_counts > 0, weighted_sums / weight_sums, np.nan)
+        return ew, vw
+
+    # Function to compute equal- and value-weighted bucket returns
+    def bucket_returns(self, sort='MKTCAP', returns='RET', weights='MKTCAP', n_buckets=10):
+        """Compact counterpart of ``returns.bucket_returns``: stocks are bucketed on
+        the previous date's ``sort`` and weighted by the previous date's ``weights``."""
+        ew, vw = self.grouped_returns(self.lag(self.buckets(sort, n_buckets)), returns, self.lag(weights),
+                                      n_buckets)
+        columns = range(1, n_buckets + 1)
+        return (pd.DataFrame(ew, index=self.dates, columns=columns),
+                pd.DataFrame(vw, index=self.dates, columns=columns))
@@ -0,0 +1,177 @@
+import csv
+import os
+
+import numpy as np
+import pandas as pd
+
+from market_cap.buckets import bucket_of_rank, rank_rows
+from market_cap.ingest import CRSP_READ_DTYPES, EXCHANGE_CODES, SHARE_CODES, _clean_chunk
+from market_cap.returns import descending_ranks
+
+# =============================================================================
+# Streaming cross-sections
+# =============================================================================
+
+# Columns needed from the daily file
+DAILY_COLUMNS = ['date', 'PERMNO', 'EXCHCD', 'SHRCD', 'PRC', 'SHROUT', 'RET']
+
+# Function to split a cleaned, date-sorted block into per-date cross-sections
+def _split_dates(block, ret_floor):
+    dates = block['date'].to_numpy()
+    if len(dates) == 0:
+        return
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(dates)) + 1))
+    ends = np.append(starts[1:], len(dates))
+    permnos = block['PERMNO'].to_numpy()
+    returns = block['RET'].to_numpy(dtype=np.float64)
+    caps = np.abs(block['PRC'].to_numpy(dtype=np.float64)) * block['SHROUT'].to_numpy(dtype=np.float64)
+    returns = np.where(returns < ret_floor, np.nan, returns)
+
+    for start, end in zip(starts, ends):
+        # Sort by PERMNO, keeping the first row of a repeated PERMNO
+        day_permnos, first = np.unique(permnos[start:end], return_index=True)
+        yield int(dates[start]), day_permnos, returns[start:end][first], caps[start:end][first]
+
+# Function to stream a date-ordered CRSP daily file one cross-section at a time
+def iter_cross_sections(path, exchcd=EXCHANGE_CODES, shrcd=SHARE_CODES, ret_floor=-60, chunksize=1_000_000):
+    """Yield ``(date, permnos, returns, caps)`` for every date of ``path``, in order.
+
+    ``date`` is the YYYYMMDD integer and the arrays are sorted by PERMNO. The
+    file is read ``chunksize`` rows at a time with the filters of ``read_crsp``;
+    only one chunk and the rows of the date it ends on are held at once, so
+    memory does not grow with the length of the history. The file must be
+    sorted by date.
+    """
+    dtypes = {column: CRSP_READ_DTYPES[column] for column in DAILY_COLUMNS}
+    reader = pd.read_csv(path, usecols=DAILY_COLUMNS, dtype=dtypes, chunksize=chunksize)
+    pending = None
+    for chunk in reader:
+        chunk = _clean_chunk(chunk, exchcd, shrcd)
+        if pending is not None:
+            chunk = pd.concat([pending, chunk], ignore_index=True)
+        if len(chunk) == 0:
+            continue
+        dates = chunk['date'].to_numpy()
+        if (np.diff(dates) < 0).any():
+            raise ValueError(f'{path} is not sorted by date')
+
+        # The last date may continue in the next chunk
+        is_last = dates == dates[-1]
+        pending = chunk[is_last]
+        yield from _split_dates(chunk[~is_last], ret_floor)
+    if pending is not None and len(pending):
+        yield from _split_dates(pending, ret_floor)
+
+# =============================================================================
+# Buy-and-hold portfolios between monthly rebalances
+# =============================================================================
+
+class DailyPortfolios:
+    """Decile and top-X portfolios formed on month-end market caps and held for a month.
+
+    At each rebalance the stocks with a market cap are ranked (largest first)
+    and bucketed as in ``assign_buckets``. Between rebalances every holding
+    drifts with its realized returns: a stock's EW weight is its gross return
+    since the rebalance and its VW weight its formation cap times that gross
+    return. Stocks with a missing return on a day are left out of that day and
+    keep their weight.
+    """
+
+    def __init__(self, n_buckets=10, sizes=(50, 100, 500, 1000)):
+        self.n_buckets = n_buckets
+        self.sizes = list(sizes)
+        self.columns = ([f'dec_ew_{b}' for b in range(1, n_buckets + 1)]
+                        + [f'dec_vw_{b}' for b in range(1, n_buckets + 1)]
+                        + [f'topx_m_ew_{size}' for size in self.sizes]
+                        + [f'topx_m_vw_{size}' for size in self.sizes])
+        self.permnos = None
+
+    # Function to form new portfolios from a cross-section of market caps
+    def rebalance(self, permnos, caps):
+        has_cap = np.isfinite(caps)
+        permnos, caps = permnos[has_cap], caps[has_cap]
+
+        # Holdings are kept in rank order (largest first) so top-X are prefixes
+        ranks = descending_ranks(caps)[0].astype(np.int64)
+        order = np.argsort(ranks)
+        asc_ranks, counts = rank_rows(caps[None, :])
+        buckets = bucket_of_rank(asc_ranks[0], counts[0], self.n_buckets).astype(np.int64) - 1
+
+        self.permnos = permnos[order]
+        self.caps = caps[order]
+        self.buckets = buckets[order]
+        self.growth = np.ones(len(order))
+        self.lookup = np.argsort(self.permnos)
+
+    # Function to compute one day's portfolio returns and let the weights drift
+    def step(self, permnos, returns):
+        """Return the day's returns in the order of ``columns`` (NaN before the first rebalance)."""
+        row = np.full(len(self.columns), np.nan)
+        if self.permnos is None or len(self.permnos) == 0:
+            return row
+
+        # Align the day's returns with the holdings
+        sorted_permnos = self.permnos[self.lookup]
+        positions = np.minimum(np.searchsorted(permnos, sorted_permnos), max(len(permnos) - 1, 0))
+        held_returns = np.full(len(self.permnos), np.nan)
+        if len(permnos):
+            found = permnos[positions] == sorted_permnos
+            held_returns[self.lookup[found]] = returns[positions[found]]
+
+        valid = np.isfinite(held_returns)
+        r = np.where(valid, held_returns, 0.0)
+        ew_weights = np.where(valid, self.growth, 0.0)
+        vw_weights = ew_weights * self.caps
+        n = self.n_buckets
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Deciles: grouped sums over the bucket labels
+            counts = np.bincount(self.buckets, weights=valid, minlength=n)
+            for offset, weights in ((0, ew_weights), (n, vw_weights)):
+                sums = np.bincount(self.buckets, weights=weights * r, minlength=n)
+                totals = np.bincount(self.buckets, weights=weights, minlength=n)
+                row[offset:offset + n] = np.where(counts > 0, sums / totals, np.nan)
+
+            # Top X: prefix sums along the rank order
+            depth = np.minimum(self.sizes, len(self.permnos)) - 1
+            prefix_counts = np.cumsum(valid)[depth]
+            for offset, weights in ((2 * n, ew_weights), (2 * n + len(self.sizes), vw_weights)):
+                sums = np.cumsum(weights * r)[depth]
+                totals = np.cumsum(weights)[depth]
+                row[offset:offset + len(self.sizes)] = np.where(prefix_counts > 0, sums / totals, np.nan)
+
+        self.growth = self.growth * (1 + r)
+        return row
+
+# Function to stream daily portfolio returns from a daily CRSP file
+def daily_returns(path, n_buckets=10, sizes=(50, 100, 500, 1000), exchcd=EXCHANGE_CODES, shrcd=SHARE_CODES,
+                  ret_floor=-60, chunksize=1_000_000):
+    """Yield ``(date, row)`` for every date, with ``row`` in the order of
+    ``DailyPortfolios.columns``.
+
+    Portfolios are formed on the last date of each month and held, drifting,
+    through the next month. Only the current cross-section, the previous
+    date's market caps and the holdings are kept in memory.
+    """
+    portfolios = DailyPortfolios(n_buckets, sizes)
+    previous = None
+    for date, permnos, returns, caps in iter_cross_sections(path, exchcd, shrcd, ret_floor, chunksize):
+        # A new month: rebalance on the last date of the previous one
+        if previous is not None and date // 100 != previous[0] // 100:
+            portfolios.rebalance(previous[1], previous[2])
+        yield pd.Timestamp(str(date)), portfolios.step(permnos, returns)
+        previous = (date, permnos, caps)
+
+# Function to write the daily portfolio returns to a CSV file as they are computed
+def write_daily_returns(path, output_path, n_buckets=10, sizes=(50, 100, 500, 1000), **params):
+    """Stream ``daily_returns`` into ``output_path`` and return the number of dates written."""
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    columns = DailyPortfolios(n_buckets, sizes).columns
+    n_dates = 0
+    with open(output_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['date'] + columns)
+        for date, row in daily_returns(path, n_buckets, sizes, **params):
+            writer.writerow([f'{date:%Y-%m-%d}'] + [repr(float(value)) if np.isfinite(value) else '' for value in row])
+            n_dates += 1
+    return n_dates
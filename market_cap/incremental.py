@@ -0,0 +1,139 @@
+import os
+import uuid
+from dataclasses import replace
+
+import pandas as pd
+
+from market_cap.buckets import assign_buckets
+from market_cap.returns import annual_topx_returns, bucket_returns, descending_ranks, topx_returns
+from market_cap.specs import default_specs
+
+# =============================================================================
+# State
+# =============================================================================
+
+# Function to list the columns update computes, those of the default families
+def state_columns(n_buckets=10, sizes=(50, 100, 500, 1000)):
+    specs = [replace(spec, buckets=n_buckets) if spec.buckets else spec for spec in default_specs(sizes)]
+    return [column for spec in specs for column in spec.columns]
+
+# Function to keep the year-end ranks still needed after `last_date`
+def _pending_year_ranks(yearly_ranks, last_date, caps):
+    year_ranks = yearly_ranks[yearly_ranks.index >= last_date.year]
+    year_ranks = year_ranks.dropna(axis=1, how='all')
+
+    # A December month sets the ranks used by the following year
+    if last_date.month == 12:
+        next_ranks = pd.DataFrame(descending_ranks(caps.to_numpy(dtype=float)), index=[last_date.year + 1],
+                                  columns=caps.index)
+        year_ranks = pd.concat([year_ranks, next_ranks])
+    return year_ranks
+
+# Function to collect what is needed to extend the portfolio series by one month
+def build_state(mktcap_df, deciles_df, yearly_ranks, portfolios, prices, n_buckets=10,
+                sizes=(50, 100, 500, 1000)):
+    """Return the state after the last date of a full run.
+
+    The state holds the last date's market caps and bucket labels, the
+    year-end ranks in force, and the return and cumulative price series built
+    so far, which ``update`` extends one month at a time. ``update`` only
+    computes the default families, so ``portfolios`` must have exactly the
+    columns of ``state_columns(n_buckets, sizes)``; ValueError otherwise.
+    """
+    _check_columns(portfolios.columns, n_buckets, sizes)
+    last_date = mktcap_df.index[-1]
+    caps = mktcap_df.iloc[-1].dropna()
+    return {
+        'last_date': last_date,
+        'caps': caps,
+        'deciles': deciles_df.iloc[-1].dropna(),
+        'year_ranks': _pending_year_ranks(yearly_ranks, last_date, caps),
+        'n_buckets': n_buckets,
+        'sizes': list(sizes),
+        'portfolios': portfolios,
+        'prices': prices,
+    }
+
+# Function to reject series update cannot extend
+def _check_columns(columns, n_buckets, sizes):
+    expected = state_columns(n_buckets, sizes)
+    if list(columns) != expected:
+        unknown = [column for column in columns if column not in expected]
+        raise ValueError(f'The state extends the default families only (columns {expected[0]}..{expected[-1]}); '
+                         f'got {len(columns)} columns, {len(unknown)} of them not computed by update: {unknown[:5]}')
+
+# Function to write the state atomically
+def save_state(state, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    pd.to_pickle(state, tmp_path)
+    os.replace(tmp_path, path)
+
+# Function to read a state written by save_state
+def load_state(path):
+    return pd.read_pickle(path)
+
+# =============================================================================
+# Monthly update
+# =============================================================================
+
+# Function to compute one new month of portfolio returns and roll the state forward
+def update(state, new_rows):
+    """Append the month in ``new_rows`` (cleaned CRSP rows of a single date).
+
+    Only the new cross-section is ranked and reduced: the kernels run on the
+    two-row frames (previous date, new date). Returns the updated state and the
+    new row of portfolio returns.
+    """
+    new_date = new_rows['date'].iloc[0]
+    if (new_rows['date'] != new_date).any():
+        raise ValueError('update expects the rows of a single date')
+    if new_date <= state['last_date']:
+        raise ValueError(f'{new_date:%Y-%m-%d} is not after the last date in the state ({state["last_date"]:%Y-%m-%d})')
+
+    new_rows = new_rows.drop_duplicates('PERMNO').set_index('PERMNO')
+    new_returns = new_rows['RET'].astype(float)
+    new_caps = new_rows['MKTCAP'].astype(float).dropna()
+
+    # Two-row frames: previous date, new date
+    dates = pd.DatetimeIndex([state['last_date'], new_date], name='date')
+    ret_df = pd.DataFrame([pd.Series(dtype=float), new_returns], index=dates)
+    mktcap_df = pd.DataFrame([state['caps'], new_caps], index=dates)
+    deciles_df = pd.DataFrame([state['deciles'], pd.Series(dtype=float)], index=dates)
+
+    n_buckets, sizes = state['n_buckets'], state['sizes']
+    _check_columns(state['portfolios'].columns, n_buckets, sizes)
+    ewret_df, vwret_df = bucket_returns(deciles_df, ret_df, mktcap_df, n_buckets)
+    topxm_ew_df, topxm_vw_df = topx_returns(ret_df, mktcap_df, sizes)
+    topxy_ew_df, topxy_vw_df = annual_topx_returns(ret_df, mktcap_df, sizes, state['year_ranks'])
+
+    row = pd.concat([
+        ewret_df.iloc[1].add_prefix('dec_ew_'), vwret_df.iloc[1].add_prefix('dec_vw_'),
+        topxm_ew_df.iloc[1].add_prefix('topx_m_ew_'), topxm_vw_df.iloc[1].add_prefix('topx_m_vw_'),
+        topxy_ew_df.iloc[1].add_prefix('topx_y_ew_'), topxy_vw_df.iloc[1].add_prefix('topx_y_vw_'),
+    ])
+    row = row.reindex(state['portfolios'].columns).rename(new_date)
+
+    # Compound from the last available price; NaN returns leave a gap like cumprod
+    last_prices = state['prices'].ffill().iloc[-1].fillna(1.0)
+    price_row = (last_prices * (1 + row)).rename(new_date)
+
+    new_deciles = assign_buckets(new_caps.to_frame().T, n_buckets).iloc[0]
+    state = dict(
+        state,
+        last_date=new_date,
+        caps=new_caps,
+        deciles=new_deciles,
+        year_ranks=_pending_year_ranks(state['year_ranks'], new_date, new_caps),
+        portfolios=pd.concat([state['portfolios'], row.to_frame().T]),
+        prices=pd.concat([state['prices'], price_row.to_frame().T]),
+    )
+    return state, row
+
+# Function to apply every date found in a batch of new rows, in order
+def update_many(state, new_rows):
+    rows = []
+    for _, date_rows in new_rows.groupby('date', sort=True):
+        state, row = update(state, date_rows)
+        rows.append(row)
+    return state, pd.DataFrame(rows)
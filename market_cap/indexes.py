@@ -0,0 +1,94 @@
+import os
+
+import pandas as pd
+
+from market_cap.prices import cumulative_prices
+from market_cap.results import cached_results
+
+# =============================================================================
+# Index and portfolio return files
+# =============================================================================
+
+# Function to read a file of returns keyed by `caldt` (YYYYMMDD)
+def read_index_returns(path):
+    indexes = pd.read_csv(path)
+
+    # Convert `caldt` to datetime and set it as the index
+    indexes['caldt'] = pd.to_datetime(indexes['caldt'], format='%Y%m%d')
+    return indexes.set_index('caldt')
+
+# Function to read the long portfolios file into one return column per portfolio
+def read_portfolio_returns(path):
+    portfolios = pd.read_csv(path)
+    portfolios['caldt'] = pd.to_datetime(portfolios['caldt'], format='%Y%m%d')
+
+    # Pivot, keeping the order in which `prtnam` values first appear
+    prtnam_order = portfolios['prtnam'].unique()
+    portfolios = portfolios.pivot(index='caldt', columns='prtnam', values='totret')
+    return portfolios[prtnam_order]
+
+# =============================================================================
+# Prices of each analysis
+# =============================================================================
+
+# Function to compute the prices of index-analysis.py
+def nasdaq_prices(nasdaq_path):
+    """Prices of every column of ``nasdaq.csv``, based on the last empty row
+    before the returns start."""
+    indexes = read_index_returns(nasdaq_path)
+
+    # Identify the first non-NaN row and the last NaN row before it
+    first_non_nan_idx = indexes.dropna(how='all').index[0]
+    last_nan_idx = indexes.loc[:first_non_nan_idx].index[-2]
+
+    # Keep that last NaN row as the base date, then the rest of the data
+    indexes = pd.concat([indexes.loc[[last_nan_idx]], indexes.loc[first_non_nan_idx:]])
+    return cumulative_prices(indexes)
+
+# Function to compute the prices of nasdaq-vs-market.py
+def nasdaq_vs_market_prices(market_path, nasdaq_path, nasdaq_start='1972-12-14'):
+    """VW and EW prices of the market and of NASDAQ over their common dates."""
+    market = read_index_returns(market_path)
+    nasdaq = read_index_returns(nasdaq_path).loc[nasdaq_start:]
+
+    # Select and rename the required columns
+    market = market[['vwretd', 'ewretd']].rename(columns={'vwretd': 'market_vw', 'ewretd': 'market_ew'})
+    nasdaq = nasdaq[['vwretd', 'ewretd']].rename(columns={'vwretd': 'nasdaq_vw', 'ewretd': 'nasdaq_ew'})
+
+    indexes = pd.merge(market, nasdaq, left_index=True, right_index=True, how='inner')
+    return cumulative_prices(indexes)
+
+# Function to compute the prices of portfolios-analysis.py
+def portfolio_prices(portfolios_path):
+    """Prices of every portfolio, based on the first date of the file."""
+    return cumulative_prices(read_portfolio_returns(portfolios_path)).iloc[1:]
+
+# Function to compute the prices of both-analysis.py
+def combined_prices(indexes_path, portfolios_path):
+    """Index prices (without `sprtrn`) next to portfolio prices, on their common dates."""
+    indexes = read_index_returns(indexes_path)
+    index_prices = cumulative_prices(indexes.drop(columns=['sprtrn'])).iloc[1:]
+    return pd.merge(index_prices, portfolio_prices(portfolios_path), left_index=True, right_index=True)
+
+# =============================================================================
+# Stored results
+# =============================================================================
+
+# Function of each analysis and the files it reads from the data directory
+INDEX_ANALYSES = {
+    'nasdaq': (nasdaq_prices, ('nasdaq.csv',)),
+    'nasdaq-vs-market': (nasdaq_vs_market_prices, ('indexes.csv', 'nasdaq.csv')),
+    'crsp-portfolios': (portfolio_prices, ('portfolios.csv',)),
+    'both': (combined_prices, ('indexes.csv', 'portfolios.csv')),
+}
+
+# Function to compute the prices of an analysis, or load them if its files are unchanged
+def analysis_prices(analysis, data_dir, results_dir=None):
+    """Return the prices of ``analysis`` (a key of ``INDEX_ANALYSES``) on the
+    files in ``data_dir``, stored in ``results_dir`` when it is set."""
+    compute, names = INDEX_ANALYSES[analysis]
+    paths = [os.path.join(data_dir, name) for name in names]
+    if results_dir is None:
+        return compute(*paths)
+    frames, _ = cached_results(results_dir, analysis, paths, lambda: ({'prices': compute(*paths)}, {}))
+    return frames['prices']
@@ -0,0 +1,175 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from market_cap.cache import cache_key, cache_source, has_entry, read_entry, write_entry
+from market_cap.compact import CompactPanel
+from market_cap.instrument import instrumented
+
+# =============================================================================
+# CRSP monthly file layout
+# =============================================================================
+
+# Columns used by the portfolio scripts
+CRSP_COLUMNS = ['date', 'PERMNO', 'EXCHCD', 'SHRCD', 'TICKER', 'PRC', 'SHROUT', 'RET', 'vwretd', 'ewretd']
+
+# Compact dtypes used while parsing; RET and PRC can hold CRSP letter codes, and
+# EXCHCD/SHRCD can be blank, so they are parsed loosely and narrowed per chunk
+CRSP_READ_DTYPES = {
+    'date': np.int32,
+    'PERMNO': np.int32,
+    'EXCHCD': np.float32,
+    'SHRCD': np.float32,
+    'TICKER': object,
+    'PRC': object,
+    'SHROUT': np.float64,
+    'RET': object,
+    'vwretd': np.float64,
+    'ewretd': np.float64,
+}
+
+# Default universe: NYSE, AMEX and NASDAQ ordinary common shares
+EXCHANGE_CODES = (1, 2, 3)
+SHARE_CODES = (10, 11, 12)
+
+# =============================================================================
+# Streaming ingest
+# =============================================================================
+
+# Function to clean one chunk of the CRSP file
+def _clean_chunk(chunk, exchcd, shrcd):
+    # Apply the exchange and share-code filters before anything else
+    chunk = chunk[chunk['EXCHCD'].isin(exchcd) & chunk['SHRCD'].isin(shrcd)]
+
+    # Narrow the codes now that blanks have been filtered out
+    chunk = chunk.astype({'EXCHCD': np.int8, 'SHRCD': np.int8})
+
+    # Convert RET and PRC to numeric, coercing CRSP letter codes to NaN
+    chunk['RET'] = pd.to_numeric(chunk['RET'], errors='coerce').astype(np.float32)
+    chunk['PRC'] = pd.to_numeric(chunk['PRC'], errors='coerce').astype(np.float32)
+    return chunk
+
+# Function to read the CRSP monthly file in chunks with filters applied on read
+@instrumented
+def read_crsp(path, exchcd=EXCHANGE_CODES, shrcd=SHARE_CODES, chunksize=500_000):
+    """Read ``crspm.csv`` keeping only the universe defined by ``exchcd``/``shrcd``.
+
+    The file is parsed ``chunksize`` rows at a time with explicit compact dtypes,
+    so peak memory is bounded by one raw chunk plus the filtered result.
+    """
+    reader = pd.read_csv(path, usecols=CRSP_COLUMNS, dtype=CRSP_READ_DTYPES, chunksize=chunksize)
+    crsp = pd.concat([_clean_chunk(chunk, exchcd, shrcd) for chunk in reader], ignore_index=True)
+
+    # Convert the YYYYMMDD integers to datetime without going through strings
+    dates = crsp['date']
+    crsp['date'] = pd.to_datetime({'year': dates // 10000, 'month': dates // 100 % 100, 'day': dates % 100})
+
+    # Store tickers as categories
+    crsp['TICKER'] = crsp['TICKER'].astype('category')
+    return crsp
+
+# =============================================================================
+# Cleaning and panels
+# =============================================================================
+
+# Function to add MKTCAP and drop CRSP missing-return codes (-66, -77, -88, -99)
+@instrumented
+def clean_crsp(crsp, ret_floor=-60):
+    """Add ``MKTCAP`` and set returns below ``ret_floor`` to NaN.
+
+    The number of returns that were dropped is kept in
+    ``crsp.attrs['num_ret_below_floor']``.
+    """
+    # Create the MKTCAP column as the product of PRC and SHROUT
+    crsp['MKTCAP'] = abs(crsp['PRC']).astype(np.float64) * crsp['SHROUT']
+
+    # Convert values smaller than the floor in RET to NaN
+    below_floor = crsp['RET'] < ret_floor
+    crsp.loc[below_floor, 'RET'] = np.nan
+    crsp.attrs['num_ret_below_floor'] = int(below_floor.sum())
+    return crsp
+
+# Function to reshape the long panel into aligned date x PERMNO matrices in one pass
+@instrumented
+def build_panel(crsp, values):
+    """Return ``(panels, duplicates)`` for the columns in ``values``.
+
+    ``date`` and ``PERMNO`` are factorized once into integer codes and every
+    column is scattered into a dense array over the same dates and PERMNOs.
+    Rows repeating a (date, PERMNO) key are returned in ``duplicates`` and only
+    the first occurrence is kept in the matrices.
+    """
+    date_codes, dates = pd.factorize(crsp['date'], sort=True)
+    permno_codes, permnos = pd.factorize(crsp['PERMNO'], sort=True)
+    n_dates, n_permnos = len(dates), len(permnos)
+    flat = date_codes.astype(np.int64) * n_permnos + permno_codes
+
+    # Find repeated keys; later occurrences are left out of the matrices
+    repeated = pd.Index(flat).duplicated(keep='first')
+    duplicates = crsp[pd.Index(flat).duplicated(keep=False)]
+    keep = ~repeated
+    flat = flat[keep]
+
+    index = pd.DatetimeIndex(dates, name='date')
+    columns = pd.Index(permnos, name='PERMNO')
+    panels = {}
+    for value in values:
+        col = crsp[value]
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            # Scatter category codes, then look the labels up once
+            codes = np.full(n_dates * n_permnos, -1, dtype=np.int32)
+            codes[flat] = col.cat.codes.to_numpy()[keep]
+            lookup = np.append(col.cat.categories.to_numpy(dtype=object), np.nan)
+            matrix = lookup[codes]
+        else:
+            col = col.to_numpy()
+            dtype = col.dtype if col.dtype.kind == 'f' else np.float64
+            matrix = np.full(n_dates * n_permnos, np.nan, dtype=dtype)
+            matrix[flat] = col[keep]
+        panels[value] = pd.DataFrame(matrix.reshape(n_dates, n_permnos), index=index, columns=columns)
+
+    if len(duplicates):
+        warnings.warn(f'{len(duplicates)} rows share a (date, PERMNO) key; keeping the first of each')
+    return panels, duplicates
+
+# Function to load the cleaned CRSP panel and its matrices, using the on-disk cache
+@instrumented
+def load_panel(path, values, exchcd=EXCHANGE_CODES, shrcd=SHARE_CODES, ret_floor=-60, cache_dir=None,
+               compact=False):
+    """Return ``(crsp, panels)``: the cleaned long frame and a dict of matrices.
+
+    With ``cache_dir`` set, both are stored as memory-mapped ``.npy`` files keyed
+    on the source file's size, mtime and content hash plus the cleaning
+    parameters, and reloaded from there until any of them change. A changed
+    file replaces only the entry of the same parameters.
+
+    With ``compact`` set, ``panels`` is a ``CompactPanel`` of ``values`` (only
+    the live securities of each date, in float64) instead of dense matrices;
+    it is rebuilt from the cached long frame, so no matrices are stored.
+    """
+    if cache_dir is not None:
+        params = dict(exchcd=list(exchcd), shrcd=list(shrcd), ret_floor=ret_floor, values=list(values),
+                      compact=compact)
+        key = cache_key(path, cache_dir, **params)
+        if has_entry(cache_dir, key):
+            frames, panels, meta = read_entry(cache_dir, key)
+            crsp = frames['crsp']
+            crsp.attrs.update(meta)
+            return crsp, (CompactPanel.from_long(crsp, values) if compact else panels)
+
+    crsp = clean_crsp(read_crsp(path, exchcd, shrcd), ret_floor)
+    if compact:
+        # Repeated keys keep their first row, as in build_panel
+        panels = CompactPanel.from_long(crsp, values)
+        duplicates = crsp[crsp.duplicated(['date', 'PERMNO'], keep=False)]
+        if len(duplicates):
+            warnings.warn(f'{len(duplicates)} rows share a (date, PERMNO) key; keeping the first of each')
+    else:
+        panels, duplicates = build_panel(crsp, values)
+    crsp.attrs['num_duplicate_keys'] = len(duplicates)
+
+    if cache_dir is not None:
+        write_entry(cache_dir, key, cache_source(path, **params), frames={'crsp': crsp}, matrices={} if compact else panels,
+                    meta=crsp.attrs)
+    return crsp, panels
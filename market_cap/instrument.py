@@ -0,0 +1,180 @@
+import functools
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# =============================================================================
+# Configuration
+# =============================================================================
+
+# Environment variables read at import: MARKET_CAP_PROFILE is the JSON lines
+# file stage records are appended to ('-' for stderr), MARKET_CAP_FLAMEGRAPH a
+# file of collapsed stacks for flamegraph.pl / speedscope
+PROFILE_ENV = 'MARKET_CAP_PROFILE'
+FLAMEGRAPH_ENV = 'MARKET_CAP_FLAMEGRAPH'
+
+_config = {'enabled': False, 'path': None, 'flamegraph': None, 'trace_memory': True}
+
+# Open stages of the current thread of execution, outermost first
+_stack = []
+
+# Function to turn instrumentation on
+def enable(path='-', flamegraph=None, trace_memory=True):
+    """Record every stage from now on.
+
+    Records are appended to ``path`` as JSON lines (``'-'`` writes to stderr).
+    With ``flamegraph`` set, each stage's self time in microseconds is also
+    appended there as a collapsed stack line (``outer;inner 1234``). Memory
+    tracing through ``tracemalloc`` slows allocation-heavy code down; pass
+    ``trace_memory=False`` to time only.
+    """
+    _config.update(enabled=True, path=path, flamegraph=flamegraph, trace_memory=trace_memory)
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+# Function to turn instrumentation off
+def disable():
+    _config['enabled'] = False
+    if _config['trace_memory'] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def is_enabled():
+    return _config['enabled']
+
+# =============================================================================
+# Stages
+# =============================================================================
+
+# Function to describe the shape of a stage input or output
+def describe(obj):
+    shape = getattr(obj, 'shape', None)
+    if shape is not None:
+        return list(shape)
+    if isinstance(obj, dict):
+        return {str(key): describe(value) for key, value in obj.items()}
+    if isinstance(obj, (tuple, list)) and any(hasattr(item, 'shape') for item in obj):
+        return [describe(item) for item in obj]
+    return None
+
+# Function to find the peak RSS of the process so far, in bytes
+def _max_rss():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+class _Stage:
+    """Context manager recording one stage; see ``stage``."""
+
+    def __init__(self, name, inputs):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = None
+        self.child_wall = 0.0
+        self.peak = 0
+
+    # Function to attach the stage's outputs to its record
+    def output(self, *outputs):
+        self.outputs = outputs[0] if len(outputs) == 1 else outputs
+        return outputs[0] if len(outputs) == 1 else outputs
+
+    def __enter__(self):
+        if _config['trace_memory'] and tracemalloc.is_tracing():
+            # Fold the peak seen so far into the enclosing stage before resetting it
+            if _stack:
+                _stack[-1].peak = max(_stack[-1].peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            self.start_memory = tracemalloc.get_traced_memory()[0]
+        _stack.append(self)
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.start_wall
+        cpu = time.process_time() - self.start_cpu
+        _stack.pop()
+
+        record = {'stage': self.name, 'path': ';'.join([s.name for s in _stack] + [self.name]),
+                  'wall_s': wall, 'cpu_s': cpu}
+        if _config['trace_memory'] and tracemalloc.is_tracing():
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            record['peak_traced_bytes'] = self.peak - self.start_memory
+            if _stack:
+                _stack[-1].peak = max(_stack[-1].peak, self.peak)
+        record['max_rss_bytes'] = _max_rss()
+        record['inputs'] = {key: describe(value) for key, value in self.inputs.items()}
+        record['outputs'] = describe(self.outputs)
+        if exc[0] is not None:
+            record['error'] = exc[0].__name__
+        if _stack:
+            _stack[-1].child_wall += wall
+
+        _emit(_config['path'], json.dumps(record))
+        if _config['flamegraph']:
+            _emit(_config['flamegraph'], f"{record['path']} {max(int((wall - self.child_wall) * 1e6), 0)}")
+        return False
+
+class _NullStage:
+    """Stage used while instrumentation is off; every method is a no-op."""
+
+    def output(self, *outputs):
+        return outputs[0] if len(outputs) == 1 else outputs
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+# Function to open a stage
+def stage(name, **inputs):
+    """Return a context manager timing the enclosed block as stage ``name``.
+
+    Keyword arguments are the stage inputs, recorded by shape. Outputs are
+    recorded by passing them through ``output``::
+
+        with stage('deciles', mktcap=mktcap_df) as s:
+            deciles_df = s.output(assign_buckets(mktcap_df))
+
+    Stages nest; the record's ``path`` lists the enclosing stages. While
+    instrumentation is off this returns a shared no-op object.
+    """
+    if not _config['enabled']:
+        return _NULL_STAGE
+    return _Stage(name, inputs)
+
+# Function to decorate a pipeline function as a stage
+def instrumented(func):
+    """Record every call of ``func`` as a stage named after it, with the shapes of
+    its array-like arguments and of its return value."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _config['enabled']:
+            return func(*args, **kwargs)
+        inputs = {f'arg{i}': arg for i, arg in enumerate(args) if describe(arg) is not None}
+        inputs.update((key, value) for key, value in kwargs.items() if describe(value) is not None)
+        with _Stage(func.__name__, inputs) as s:
+            return s.output(func(*args, **kwargs))
+    return wrapper
+
+# Function to write one line to a file or stderr
+def _emit(path, line):
+    if path in (None, '-'):
+        print(line, file=sys.stderr)
+        return
+    with open(path, 'a') as f:
+        f.write(line + '\n')
+
+if os.environ.get(PROFILE_ENV):
+    enable(os.environ[PROFILE_ENV], flamegraph=os.environ.get(FLAMEGRAPH_ENV) or None)
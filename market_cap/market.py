@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+from market_cap.instrument import instrumented
+from market_cap.returns import align_frames, grouped_returns, lag_rows
+
+# =============================================================================
+# Market benchmark
+# =============================================================================
+
+# CRSP's date-level market returns, repeated on every row of the long file
+MARKET_COLUMNS = ['vwretd', 'ewretd']
+
+# Function to take CRSP's market returns straight from the long panel
+def crsp_market_returns(crsp):
+    """Return a date-indexed frame of ``vwretd`` and ``ewretd``.
+
+    Both are the same on every row of a date, so the first non-missing value
+    of each date is taken with one grouped pass over the long frame, instead
+    of pivoting them into date x PERMNO matrices.
+    """
+    market = crsp.groupby('date', sort=True, observed=True)[MARKET_COLUMNS].first()
+    market.index = pd.DatetimeIndex(market.index, name='date')
+    return market.astype(np.float64)
+
+# Function to compute the equal- and value-weighted return of the whole universe
+def universe_market_returns(ret_df, mktcap_df):
+    """Return a date-indexed frame with our ``vw`` and ``ew`` market returns.
+
+    Every stock of the cleaned universe is put in a single group, so this is
+    the decile kernel with one bucket: EW averages the returns of the date and
+    VW weights them by the previous date's market cap.
+    """
+    ret_df, mktcap_df = align_frames(ret_df, mktcap_df)
+    returns = ret_df.to_numpy(dtype=float)
+    labels = np.ones(returns.shape)
+    ew, vw = grouped_returns(labels, returns, lag_rows(mktcap_df.to_numpy(dtype=float)), 1)
+    return pd.DataFrame({'vw': vw[:, 0], 'ew': ew[:, 0]}, index=ret_df.index)
+
+# Function to compare our market returns with CRSP's, month by month
+@instrumented
+def market_returns(crsp, panels):
+    """Return a date-indexed frame of CRSP's and our market returns and their deviations.
+
+    Columns are ``vwretd``/``ewretd`` (CRSP), ``vw``/``ew`` (the cleaned
+    universe, from the ``RET`` and ``MKTCAP`` panels) and ``vw_dev``/``ew_dev``
+    (ours minus CRSP's). Deviations measure how far the exchange and
+    share-code filters move the universe away from CRSP's market.
+    """
+    market = crsp_market_returns(crsp).join(universe_market_returns(panels['RET'], panels['MKTCAP']), how='outer')
+    market['vw_dev'] = market['vw'] - market['vwretd']
+    market['ew_dev'] = market['ew'] - market['ewretd']
+    return market
+
+# Function to summarize the deviations of our market returns from CRSP's
+def deviation_summary(market, tolerance=1e-3):
+    """Return, for ``vw`` and ``ew``, the mean and largest absolute deviation,
+    the correlation with CRSP and the number of months further apart than
+    ``tolerance``."""
+    summary = {}
+    for ours, theirs in (('vw', 'vwretd'), ('ew', 'ewretd')):
+        deviations = market[f'{ours}_dev'].abs()
+        summary[ours] = {
+            'months': int(deviations.notna().sum()),
+            'mean_abs_dev': deviations.mean(),
+            'max_abs_dev': deviations.max(),
+            'max_abs_dev_date': deviations.idxmax() if deviations.notna().any() else pd.NaT,
+            'correlation': market[ours].corr(market[theirs]),
+            'months_above_tolerance': int((deviations > tolerance).sum()),
+        }
+    return pd.DataFrame(summary)
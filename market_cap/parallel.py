@@ -0,0 +1,119 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from market_cap.buckets import assign_buckets
+from market_cap.returns import align_frames, annual_topx_returns, bucket_returns, topx_returns
+
+# =============================================================================
+# Portfolio families
+# =============================================================================
+
+# Column prefixes of each family, as used in portfolios.py
+FAMILY_PREFIXES = {
+    'deciles': ('dec_ew_', 'dec_vw_'),
+    'topx_monthly': ('topx_m_ew_', 'topx_m_vw_'),
+    'topx_yearly': ('topx_y_ew_', 'topx_y_vw_'),
+}
+
+# Function to get the EW and VW column prefixes of a task
+def task_prefixes(task):
+    family, param = task
+    # Bucket schemes other than deciles are labelled by their bucket count
+    if family == 'deciles' and param != 10:
+        return f'q{param}_ew_', f'q{param}_vw_'
+    return FAMILY_PREFIXES[family]
+
+# Function to list one task per bucket scheme and per portfolio size
+def default_tasks(bucket_counts=(10,), sizes=(50, 100, 500, 1000)):
+    """Return ``(family, parameter)`` tasks covering the families of portfolios.py."""
+    tasks = [('deciles', n_buckets) for n_buckets in bucket_counts]
+    tasks += [('topx_monthly', size) for size in sizes]
+    tasks += [('topx_yearly', size) for size in sizes]
+    return tasks
+
+# Function to evaluate one task on date x PERMNO frames
+def run_task(task, ret_df, mktcap_df):
+    """Return the ``(ew_df, vw_df)`` of a single task."""
+    family, param = task
+    if family == 'deciles':
+        return bucket_returns(assign_buckets(mktcap_df, param), ret_df, mktcap_df, param)
+    if family == 'topx_monthly':
+        return topx_returns(ret_df, mktcap_df, [param])
+    if family == 'topx_yearly':
+        return annual_topx_returns(ret_df, mktcap_df, [param])
+    raise ValueError(f'Unknown portfolio family: {family}')
+
+# =============================================================================
+# Shared inputs
+# =============================================================================
+
+# Frames attached by each worker process
+_shared = {}
+
+# Function to copy an array into a new shared memory block
+def _share_array(array):
+    array = np.ascontiguousarray(array, dtype=np.float64)
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return shm, (shm.name, array.shape)
+
+# Function run once in every worker to map the shared matrices read-only
+def _init_worker(specs, index, columns):
+    for name, (shm_name, shape) in specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        values = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        values.flags.writeable = False
+        _shared[name] = (shm, pd.DataFrame(values, index=index, columns=columns, copy=False))
+
+# Function run in a worker for one task
+def _run_shared_task(task):
+    return task, run_task(task, _shared['ret'][1], _shared['mktcap'][1])
+
+# =============================================================================
+# Runner
+# =============================================================================
+
+# Function to evaluate independent portfolio families on a pool of worker processes
+def run_families(ret_df, mktcap_df, tasks=None, max_workers=None):
+    """Evaluate ``tasks`` in parallel and merge them into one portfolios frame.
+
+    ``ret_df`` and ``mktcap_df`` are copied once into shared memory, and every
+    worker maps them read-only instead of receiving pickled copies. Columns
+    come out in the order of portfolios.py: per family, EW then VW.
+
+    Call this under ``if __name__ == '__main__':`` on platforms that spawn
+    workers, since they re-import the main module.
+    """
+    ret_df, mktcap_df = align_frames(ret_df, mktcap_df)
+    tasks = default_tasks() if tasks is None else list(tasks)
+    max_workers = max_workers or min(len(tasks), os.cpu_count() or 1)
+
+    blocks = {}
+    specs = {}
+    try:
+        for name, df in (('ret', ret_df), ('mktcap', mktcap_df)):
+            blocks[name], specs[name] = _share_array(df.to_numpy(dtype=float))
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                 initargs=(specs, ret_df.index, ret_df.columns)) as pool:
+            results = dict(pool.map(_run_shared_task, tasks))
+    finally:
+        for shm in blocks.values():
+            shm.close()
+            shm.unlink()
+
+    return merge_results(tasks, results, ret_df.index)
+
+# Function to assemble task results in family order
+def merge_results(tasks, results, index):
+    portfolios = pd.DataFrame(index=index)
+    for family in dict.fromkeys(family for family, _ in tasks):
+        family_tasks = [task for task in tasks if task[0] == family]
+        for side in (0, 1):
+            for task in family_tasks:
+                prefix = task_prefixes(task)[side]
+                portfolios = portfolios.join(results[task][side].add_prefix(prefix), how='outer')
+    return portfolios
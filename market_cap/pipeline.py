@@ -0,0 +1,160 @@
+import os
+import warnings
+
+from market_cap.buckets import assign_buckets
+from market_cap.incremental import build_state, save_state
+from market_cap.ingest import load_panel
+from market_cap.instrument import stage
+from market_cap.market import market_returns
+from market_cap.prices import cumulative_prices
+from market_cap.results import cached_results, load_results, results_key, results_source, save_results
+from market_cap.returns import year_end_ranks
+from market_cap.specs import default_specs, evaluate
+
+# =============================================================================
+# Portfolio pipeline
+# =============================================================================
+
+# Default portfolio sizes of the top-X families
+PORTFOLIO_SIZES = [50, 100, 500, 1000]
+
+# Matrices built from the cleaned panel; the market returns use the same ones,
+# so both share a single panel cache entry
+PANEL_VALUES = ['RET', 'MKTCAP', 'EXCHCD']
+
+# Function to collect the cleaning counts stored with the results of a run
+def _portfolio_meta(crsp):
+    return {key: crsp.attrs[key] for key in ('num_ret_below_floor', 'num_duplicate_keys')}
+
+# Function to write the state for update-portfolios.py at the last date of a series
+def save_portfolio_state(mktcap_df, portfolios, prices, state_path, sizes=PORTFOLIO_SIZES, results=None):
+    """Write the state that extends ``portfolios``/``prices`` from their last date.
+
+    The market caps, bucket labels and year-end ranks are taken from
+    ``mktcap_df`` cut to that date, so a series ending before the panel does
+    is resumed from its own end. ``results`` (``{'dir', 'key', 'meta',
+    'source'}``) names the stored result the state extends, which
+    ``save_state_results`` updates after each incremental run. Returns
+    False, writing nothing, when the panel does not reach the last date of the
+    series.
+    """
+    if len(portfolios) == 0:
+        return False
+    last_date = portfolios.index[-1]
+    mktcap_df = mktcap_df.loc[:last_date]
+    if len(mktcap_df) == 0 or mktcap_df.index[-1] != last_date:
+        warnings.warn(f'The panel does not reach {last_date:%Y-%m-%d}; no state written to {state_path}')
+        return False
+
+    state = build_state(mktcap_df, assign_buckets(mktcap_df, 10), year_end_ranks(mktcap_df), portfolios, prices, 10,
+                        sizes)
+    state['results'] = results
+    save_state(state, state_path)
+    return True
+
+# Function to store the series of an updated state under the result it extends
+def save_state_results(state):
+    """Replace the stored result a state was built from with the state's
+    series, so that ``cached_portfolios`` and ``plot`` serve the months added
+    by ``update``. Returns False when the state names no stored result."""
+    results = state.get('results')
+    if results is None:
+        return False
+    save_results(results['dir'], 'portfolios', results['key'],
+                 {'portfolios': state['portfolios'], 'prices': state['prices']}, results['meta'],
+                 results.get('source'))
+    return True
+
+# Function to run portfolios.py without the plot
+def build_portfolios(crsp_path, specs=None, start_date='1990-01-01', end_date='2023-12-31', cache_dir=None,
+                     state_path=None, sizes=PORTFOLIO_SIZES, workers=None, results=None, compact=False):
+    """Return ``(crsp, portfolios, prices)`` for ``specs`` (the six default families by default).
+
+    With ``workers`` set, the default families are evaluated on a process pool
+    through ``run_families``; the caller must then be under a
+    ``if __name__ == '__main__':`` guard. With ``state_path`` set, the state
+    for ``update-portfolios.py`` is written there (see ``save_portfolio_state``).
+
+    With ``compact`` set, the specs are evaluated on a ``CompactPanel`` that
+    holds only the live securities of each date; results match the dense
+    panels up to the order of floating-point sums (about 1e-15).
+    """
+    crsp, panels = load_panel(
+        crsp_path,
+        values=PANEL_VALUES,
+        exchcd=[1, 2, 3],
+        shrcd=[10, 11, 12],
+        ret_floor=-60,
+        cache_dir=cache_dir,
+        compact=compact,
+    )
+
+    if workers:
+        if specs is not None or compact:
+            raise ValueError('`workers` evaluates the default families on dense panels only; leave `specs` and '
+                             '`compact` unset')
+        from market_cap.parallel import default_tasks, run_families
+        portfolios = run_families(panels['RET'], panels['MKTCAP'], default_tasks(sizes=sizes), workers)
+    else:
+        portfolios = evaluate(default_specs(sizes) if specs is None else specs, panels)
+
+    portfolios = portfolios.loc[start_date:end_date]
+    with stage('cumulative_prices', portfolios=portfolios) as s:
+        prices = s.output(cumulative_prices(portfolios))
+
+    if state_path is not None:
+        if results is not None:
+            results = dict(results, meta=_portfolio_meta(crsp))
+        mktcap_df = panels.to_dense('MKTCAP') if compact else panels['MKTCAP']
+        save_portfolio_state(mktcap_df, portfolios, prices, state_path, sizes, results)
+    return crsp, portfolios, prices
+
+# Function to run the pipeline, or load its results if the CRSP file and parameters are unchanged
+def cached_portfolios(results_dir, crsp_path, specs=None, start_date='1990-01-01', end_date='2023-12-31',
+                      cache_dir=None, state_path=None, sizes=PORTFOLIO_SIZES, workers=None, compact=False):
+    """Return ``(portfolios, prices, meta)``, computed by ``build_portfolios`` only
+    when ``results_dir`` holds no result for the current inputs. ``meta`` has the
+    cleaning counts of the run that produced the result.
+
+    With ``state_path`` set, the state is written whenever the result is
+    computed, and also on a stored result when no state file exists.
+    """
+    specs = None if specs is None else list(specs)
+    key_specs = default_specs(sizes) if specs is None else specs
+    params = dict(specs=[repr(s) for s in key_specs], start_date=start_date, end_date=end_date)
+    key = results_key('portfolios', [crsp_path], results_dir, **params)
+    source = results_source(results_dir, 'portfolios', **params)
+
+    results = load_results(results_dir, key)
+    if results is not None:
+        frames, meta = results
+        if state_path is not None and not os.path.exists(state_path):
+            _, panels = load_panel(crsp_path, values=PANEL_VALUES, exchcd=[1, 2, 3], shrcd=[10, 11, 12],
+                                   ret_floor=-60, cache_dir=cache_dir, compact=compact)
+            mktcap_df = panels.to_dense('MKTCAP') if compact else panels['MKTCAP']
+            save_portfolio_state(mktcap_df, frames['portfolios'], frames['prices'], state_path, sizes,
+                                 {'dir': results_dir, 'key': key, 'meta': meta, 'source': source})
+        return frames['portfolios'], frames['prices'], meta
+
+    crsp, portfolios, prices = build_portfolios(crsp_path, specs, start_date, end_date, cache_dir, state_path, sizes,
+                                                workers, results={'dir': results_dir, 'key': key, 'source': source},
+                                                compact=compact)
+    meta = dict(_portfolio_meta(crsp), name='portfolios')
+    save_results(results_dir, 'portfolios', key, {'portfolios': portfolios, 'prices': prices}, meta, source)
+    return portfolios, prices, meta
+
+# Function to compute CRSP's and our market returns, or load them if the CRSP file is unchanged
+def cached_market_returns(results_dir, crsp_path, cache_dir=None):
+    """Return the ``market_returns`` frame of ``crsp_path`` over the default universe.
+
+    With ``results_dir`` set to None the frame is always recomputed.
+    """
+    def compute():
+        crsp, panels = load_panel(crsp_path, values=PANEL_VALUES, exchcd=[1, 2, 3], shrcd=[10, 11, 12],
+                                  ret_floor=-60, cache_dir=cache_dir)
+        return {'market': market_returns(crsp, panels)}, {}
+
+    if results_dir is None:
+        return compute()[0]['market']
+    frames, _ = cached_results(results_dir, 'market', [crsp_path], compute)
+    return frames['market']
@@ -0,0 +1,289 @@
+import numpy as np
+import pandas as pd
+
+from market_cap.prices import PriceStore
+
+# =============================================================================
+# View-dependent decimation
+# =============================================================================
+
+# Function to reduce a sorted series to the extremes of each pixel column in a view
+def minmax_decimate(x, y, x0, x1, n_pixels):
+    """Return the positions of ``x`` to draw for the view ``[x0, x1]`` at ``n_pixels`` wide.
+
+    ``x`` is sorted. Points of the view (plus one on each side, so lines run
+    to the edges) are binned by pixel column, and each column keeps its first,
+    last, lowest and highest point, which draws the same picture as the full
+    series. Views with fewer than four points per column are returned whole.
+    """
+    start = max(np.searchsorted(x, x0, side='left') - 1, 0)
+    stop = min(np.searchsorted(x, x1, side='right') + 1, len(x))
+    positions = np.arange(start, stop)
+    n_pixels = max(int(n_pixels), 1)
+    if len(positions) <= 4 * n_pixels:
+        return positions
+
+    # NaN gaps are dropped from decimated views
+    positions = positions[np.isfinite(y[start:stop])]
+    if len(positions) == 0:
+        return positions
+    bins = np.clip(((x[positions] - x0) / (x1 - x0) * n_pixels).astype(np.int64), -1, n_pixels)
+
+    # x is sorted, so every pixel column is a contiguous run of points
+    values = y[positions]
+    leftmost = np.concatenate(([0], np.flatnonzero(np.diff(bins)) + 1))
+    rightmost = np.concatenate((leftmost[1:], [len(bins)])) - 1
+    counts = rightmost - leftmost + 1
+    lowest = values == np.repeat(np.minimum.reduceat(values, leftmost), counts)
+    highest = values == np.repeat(np.maximum.reduceat(values, leftmost), counts)
+
+    keep = lowest | highest
+    keep[leftmost] = True
+    keep[rightmost] = True
+    return positions[keep]
+
+# =============================================================================
+# Interactive price plotter
+# =============================================================================
+
+# matplotlib and tkinter are imported when a plotter is created, so that
+# importing this module (and running the compute stages) works on machines
+# without a display
+
+# Legends and the cursor readout list at most this many series; laying out a
+# legend of hundreds of entries costs more than drawing the lines
+MAX_LABELLED_SERIES = 20
+
+class PricePlotter:
+    """Tk window with a list of the columns of ``prices``, a Plot button and a date range.
+
+    Each series gets one persistent ``Line2D`` the first time it is selected;
+    Plot only toggles visibility. Lines hold a min-max decimated copy of their
+    data for the current view and width, recomputed when the x-limits change
+    (zoom and pan through the toolbar), so redraws cost the same whatever the
+    length of the series. The date cursor is drawn by blitting over a cached
+    background.
+
+    The Start and End fields set the view and rebase every visible series to
+    1 on the first date of the range. Prices are kept as log-return prefix
+    sums (``PriceStore``), so rebasing a series is one subtraction over its
+    column; hidden series are only rebased when they are shown again.
+    """
+
+    def __init__(self, prices, title='Compounded Prices Plotter', start=None, end=None):
+        import matplotlib
+        matplotlib.use('TkAgg')
+        import matplotlib.dates as mdates
+        import matplotlib.pyplot as plt
+        import tkinter as tk
+        from tkinter import messagebox
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+
+        self.prices = prices
+        self.plt = plt
+        self.x = mdates.date2num(prices.index.to_pydatetime())
+        self.store = PriceStore.from_prices(prices)
+        self.log_prices = self.store.log_prices.to_numpy()
+        self.columns = list(prices.columns)
+        self.positions = {series: j for j, series in enumerate(self.columns)}
+        self.lines = {}
+        self.background = None
+        self.messagebox = messagebox
+
+        # Rows of the selected date range and the rebased prices of the series shown in it
+        self.rows = slice(0, len(prices))
+        self.rebased = {}
+
+        # Predefined colors for each series
+        colors = plt.cm.tab10.colors
+        self.color_map = {series: colors[i % len(colors)] for i, series in enumerate(self.columns)}
+
+        # Create the main window
+        self.window = tk.Tk()
+        self.window.title(title)
+
+        # Create a frame for the controls
+        frame = tk.Frame(self.window)
+        frame.pack(side=tk.TOP, fill=tk.X)
+
+        # Create a listbox for series selection with multiple selection enabled
+        self.series_listbox = tk.Listbox(frame, selectmode=tk.MULTIPLE, exportselection=0)
+        for col in self.columns:
+            self.series_listbox.insert(tk.END, col)
+        self.series_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=1)
+
+        # Create a button to update the plot
+        plot_button = tk.Button(frame, text="Plot", command=self.on_plot_button_click)
+        plot_button.pack(side=tk.LEFT, padx=10)
+
+        # Create the date range fields; Enter or Apply rebases the visible series
+        range_frame = tk.Frame(frame)
+        range_frame.pack(side=tk.LEFT, padx=10)
+        self.range_entries = {}
+        for row, (label, value) in enumerate((('Start', start), ('End', end))):
+            tk.Label(range_frame, text=label).grid(row=row, column=0, sticky=tk.W)
+            entry = tk.Entry(range_frame, width=12)
+            entry.insert(0, '' if value is None else f'{pd.Timestamp(value):%Y-%m-%d}')
+            entry.bind('<Return>', lambda event: self.on_range_change())
+            entry.grid(row=row, column=1)
+            self.range_entries[label] = entry
+        tk.Button(range_frame, text='Apply', command=self.on_range_change).grid(row=0, column=2, padx=5)
+        tk.Button(range_frame, text='Full range', command=self.on_full_range).grid(row=1, column=2, padx=5)
+
+        # Create the initial plot, with a toolbar for zooming and panning
+        self.fig, self.ax = plt.subplots(figsize=(10, 6))
+        self.canvas = FigureCanvasTkAgg(self.fig, master=self.window)
+        NavigationToolbar2Tk(self.canvas, self.window).update()
+        self.canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=1)
+
+        ax = self.ax
+        ax.xaxis_date()
+        self.set_range(start, end)
+
+        ax.set_xlabel('Date')
+        ax.set_ylabel('Compounded Price')
+        ax.set_title('Compounded Price Series')
+        ax.grid(True)
+
+        # Date cursor and readout, left out of normal draws and blitted on mouse moves
+        self.cursor = ax.axvline(self.x[0] if len(self.x) else 0, color='0.5', lw=0.8, animated=True)
+        self.readout = ax.text(0.01, 0.99, '', transform=ax.transAxes, va='top', ha='left', fontsize=8,
+                               animated=True, bbox={'facecolor': 'white', 'alpha': 0.8, 'edgecolor': 'none'})
+
+        ax.callbacks.connect('xlim_changed', lambda ax: self.refresh_lines())
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+        self.canvas.mpl_connect('motion_notify_event', self.on_motion)
+        self.canvas.mpl_connect('resize_event', lambda event: self.refresh_lines())
+
+    # Function to get the line of a series, creating it on first use
+    def line(self, series):
+        if series not in self.lines:
+            (self.lines[series],) = self.ax.plot([], [], label=series, color=self.color_map[series])
+        return self.lines[series]
+
+    # Function to get the prices of a series rebased to 1 on the first date of the range
+    def series_values(self, series):
+        if series not in self.rebased:
+            j = self.positions[series]
+            base = self.rows.start
+            with np.errstate(invalid='ignore'):
+                y = np.exp(self.log_prices[:, j] - self.log_prices[base, j])
+            y[~self.store.observed[:, j]] = np.nan
+            y[base] = 1.0
+            self.rebased[series] = y
+        return self.rebased[series]
+
+    # Function to give every visible line the decimated data of the current view
+    def refresh_lines(self):
+        x0, x1 = self.ax.get_xlim()
+        n_pixels = self.ax.bbox.width
+        for series, line in self.lines.items():
+            if line.get_visible():
+                y = self.series_values(series)
+                positions = minmax_decimate(self.x, y, x0, x1, n_pixels)
+                line.set_data(self.x[positions], y[positions])
+
+    # Function to select the date range the series are shown and rebased over
+    def set_range(self, start=None, end=None):
+        """Return False, leaving the range unchanged, if no date falls in ``[start, end]``."""
+        rows = slice(*self.store.rows(start, end).indices(len(self.x))[:2])
+        if rows.start >= rows.stop:
+            return False
+        if rows.start != self.rows.start:
+            self.rebased = {}
+        self.rows = rows
+        return True
+
+    # Function to fit the view to the selected range of the visible series
+    def fit_view(self):
+        visible = [series for series, line in self.lines.items() if line.get_visible()]
+        if not visible:
+            return
+        selected = np.column_stack([self.series_values(series)[self.rows] for series in visible])
+        finite = np.isfinite(selected).any(axis=1)
+        if finite.any():
+            x = self.x[self.rows]
+            low, high = np.nanmin(selected), np.nanmax(selected)
+            pad = 0.05 * (high - low) or 0.05 * abs(high) or 1.0
+            self.ax.set_ylim(low - pad, high + pad)
+            if x[finite][0] < x[finite][-1]:
+                self.ax.set_xlim(x[finite][0], x[finite][-1])
+
+    # Function to plot selected series
+    def plot_series(self, selected_series):
+        for series in self.columns:
+            if series in selected_series:
+                self.line(series).set_visible(True)
+            elif series in self.lines:
+                self.lines[series].set_visible(False)
+
+        visible = [self.lines[series] for series in selected_series]
+        legend = self.ax.get_legend()
+        if legend is not None:
+            legend.remove()
+        if visible:
+            if len(visible) <= MAX_LABELLED_SERIES:
+                self.ax.legend(handles=visible)
+            self.fit_view()
+
+        self.refresh_lines()
+        self.canvas.draw_idle()
+
+    def on_plot_button_click(self):
+        selected_indices = self.series_listbox.curselection()
+        self.plot_series([self.columns[i] for i in selected_indices])
+
+    # Function to apply the dates typed in the range fields
+    def on_range_change(self):
+        try:
+            start, end = (pd.Timestamp(entry.get()) if entry.get().strip() else None
+                          for entry in self.range_entries.values())
+        except ValueError as error:
+            self.messagebox.showerror('Date range', str(error))
+            return
+        if not self.set_range(start, end):
+            self.messagebox.showerror('Date range', 'No dates in the selected range')
+            return
+        self.fit_view()
+        self.refresh_lines()
+        self.canvas.draw_idle()
+
+    # Function to clear the range fields and show the whole history
+    def on_full_range(self):
+        for entry in self.range_entries.values():
+            entry.delete(0, 'end')
+        self.on_range_change()
+
+    # Function to cache the background the cursor is blitted over
+    def on_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+
+    # Function to move the date cursor and show the values of the visible series under it
+    def on_motion(self, event):
+        if self.background is None or event.inaxes is not self.ax or not len(self.x):
+            return
+        i = min(np.searchsorted(self.x, event.xdata), len(self.x) - 1)
+        self.cursor.set_xdata([self.x[i], self.x[i]])
+        lines = [f'{self.prices.index[i]:%Y-%m-%d}']
+        visible = [series for series, line in self.lines.items() if line.get_visible()]
+        for series in visible[:MAX_LABELLED_SERIES]:
+            lines.append(f'{series}: {self.series_values(series)[i]:.4g}')
+        if len(visible) > MAX_LABELLED_SERIES:
+            lines.append(f'... {len(visible) - MAX_LABELLED_SERIES} more')
+        self.readout.set_text('\n'.join(lines))
+
+        self.canvas.restore_region(self.background)
+        self.ax.draw_artist(self.cursor)
+        self.ax.draw_artist(self.readout)
+        self.canvas.blit(self.ax.bbox)
+
+    # Function to start the Tkinter event loop
+    def run(self):
+        self.window.mainloop()
+        self.plt.close(self.fig)
+
+# Function to open the "Compounded Prices Plotter" window for a date x series frame
+def show_prices(prices, start=None, end=None, title='Compounded Prices Plotter'):
+    """Show a ``PricePlotter`` for ``prices``, starting on the ``[start, end]``
+    range; blocks until the window is closed."""
+    PricePlotter(prices, title, start, end).run()
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+
+# =============================================================================
+# Price series as log-return prefix sums
+# =============================================================================
+
+# Lowest return compounded: a total loss (-1) would add log(0) = -inf to the
+# prefix sums and turn every later window into NaN, so it keeps a price of
+# about 2e-16 of the previous one instead
+RETURN_FLOOR = -1 + np.finfo(float).eps
+
+class PriceStore:
+    """Compounded prices of many series, kept as cumulative log returns.
+
+    ``log_prices[t]`` is the sum of ``log(1 + r)`` over the returns up to and
+    including date ``t``, so the price of any date relative to a base date is
+    ``exp(log_prices[t] - log_prices[base])``: a window of every series is
+    rebased to 1 with a single vector subtraction, whatever its start and end.
+
+    Missing returns count as zero (the price carries over) and show as NaN in
+    the prices, like ``cumprod``; the base date of a window is always 1.
+    Returns of -1 or below are compounded as ``RETURN_FLOOR``, so prices
+    after a total loss are zero to within 1e-15 and windows starting after it
+    are rebased as usual.
+    """
+
+    def __init__(self, log_prices, observed):
+        self.log_prices = log_prices
+        self.observed = observed
+
+    # Function to build the store from date x series returns
+    @classmethod
+    def from_returns(cls, returns):
+        values = returns.to_numpy(dtype=float)
+        observed = ~np.isnan(values)
+        log_growth = np.log1p(np.maximum(np.where(observed, values, 0.0), RETURN_FLOOR))
+        log_prices = pd.DataFrame(np.cumsum(log_growth, axis=0), index=returns.index, columns=returns.columns)
+        return cls(log_prices, observed)
+
+    # Function to build the store from date x series prices on any base
+    @classmethod
+    def from_prices(cls, prices):
+        """Build the store from prices, e.g. stored results or a file of levels.
+
+        Series that start after the first date are based on their first price.
+        """
+        values = prices.to_numpy(dtype=float)
+        observed = ~np.isnan(values)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_prices = pd.DataFrame(np.log(values), index=prices.index, columns=prices.columns)
+        log_prices = log_prices.ffill().bfill()
+        return cls(log_prices, observed)
+
+    @property
+    def index(self):
+        return self.log_prices.index
+
+    @property
+    def columns(self):
+        return self.log_prices.columns
+
+    # Function to find the rows of a [start, end] window
+    def rows(self, start=None, end=None):
+        return self.index.slice_indexer(start, end)
+
+    # Function to get the prices of a window, rebased to 1 on its first date
+    def window(self, start=None, end=None, columns=None):
+        """Return the prices over ``[start, end]`` (dates or None for the ends
+        of the history), each series equal to 1 on the first date."""
+        rows = self.rows(start, end)
+        cols = slice(None) if columns is None else self.columns.get_indexer(columns)
+        log_prices = self.log_prices.to_numpy()[rows][:, cols]
+        if len(log_prices) == 0:
+            return pd.DataFrame(log_prices, index=self.index[rows], columns=self.columns[cols])
+
+        with np.errstate(invalid='ignore'):
+            prices = np.exp(log_prices - log_prices[0])
+        observed = self.observed[rows][:, cols].copy()
+        observed[0] = True
+        prices[~observed] = np.nan
+        return pd.DataFrame(prices, index=self.index[rows], columns=self.columns[cols])
+
+# Function to compound returns into prices, with the first row as the base
+def cumulative_prices(returns):
+    """Return prices starting at 1 on the first row; the first row's returns
+    are ignored, as that date is the base of the series. ``returns`` is not
+    modified."""
+    return PriceStore.from_returns(returns).window()
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+# =============================================================================
+# Rebalance schedules
+# =============================================================================
+
+# Months whose last date is a formation date, for each named schedule
+SCHEDULES = {
+    'monthly': tuple(range(1, 13)),
+    'quarterly': (3, 6, 9, 12),
+    'semiannual': (6, 12),
+    'annual': (12,),
+    # Fama-French: portfolios formed at the end of June, held July to June
+    'june': (6,),
+}
+
+# Function to pick the formation dates of a schedule among the available dates
+def formation_dates(dates, schedule):
+    """Return the positions in ``dates`` on which portfolios are formed.
+
+    ``schedule`` is a key of ``SCHEDULES`` (the last date of each listed month)
+    or a sequence of custom dates, each snapped to the last available date on
+    or before it.
+    """
+    dates = pd.DatetimeIndex(dates)
+    if isinstance(schedule, str):
+        if schedule not in SCHEDULES:
+            raise ValueError(f'Unknown rebalance schedule: {schedule}')
+        months = dates.year * 12 + dates.month - 1
+        is_last = np.append(months[1:] != months[:-1], True)
+        return np.flatnonzero(is_last & dates.month.isin(SCHEDULES[schedule]))
+
+    positions = dates.searchsorted(pd.DatetimeIndex(schedule), side='right') - 1
+    return np.unique(positions[positions >= 0])
+
+# Function to find the formation each date is held under
+def holding_periods(n_dates, formations):
+    """Return, for every date position, the index into ``formations`` of the
+    latest formation strictly before it (-1 before the first formation)."""
+    return np.searchsorted(formations, np.arange(n_dates), side='left') - 1
+
+# Function to spread values taken on formation dates over their holding periods
+def expand_formations(values, formations, periods):
+    """Return a dates x PERMNO array holding ``values[formations[p]]`` on every date of period ``p``."""
+    values = np.asarray(values, dtype=float)
+    expanded = np.full((len(periods),) + values.shape[1:], np.nan)
+    held = periods >= 0
+    expanded[held] = values[formations[periods[held]]]
+    return expanded
+
+# =============================================================================
+# Buy-and-hold drift
+# =============================================================================
+
+# Function to compute how much each holding has grown since its formation date
+def drift_factors(returns, formations, periods):
+    """Return a dates x PERMNO array of gross returns from the formation date to
+    the previous date: the factor a buy-and-hold weight has drifted by when the
+    date's return is earned.
+
+    One cumulative log-return vector per stock is built once; every factor is
+    then a difference of two of its entries. Missing returns count as zero
+    (the holding keeps its value), and total losses are floored just above -100%
+    so the logarithm stays finite.
+    """
+    returns = np.asarray(returns, dtype=float)
+    log_growth = np.log1p(np.clip(np.nan_to_num(returns, nan=0.0), -1 + 1e-12, None))
+    cumulative = np.zeros((len(returns) + 1,) + returns.shape[1:])
+    np.cumsum(log_growth, axis=0, out=cumulative[1:])
+
+    # cumulative[t] is the log growth over dates 0..t-1
+    factors = np.full(returns.shape, np.nan)
+    held = periods >= 0
+    dates = np.flatnonzero(held)
+    factors[held] = np.exp(cumulative[dates] - cumulative[formations[periods[held]] + 1])
+    return factors
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from market_cap.cache import has_entry, read_entry, write_entry
+from market_cap.unadjust import unadjust
+
+# =============================================================================
+# Vendor price sources
+# =============================================================================
+
+# Columns every source returns, one row per trading day: closes adjusted for
+# splits only, closes adjusted for splits and dividends, and the dividends and
+# split ratios paid on each ex-date
+VENDOR_COLUMNS = ['date', 'Close', 'Adj Close', 'Dividends', 'Stock Splits']
+
+# Function to put a vendor frame in the common layout
+def _vendor_frame(prices):
+    if 'date' not in prices and 'Date' not in prices:
+        prices = prices.reset_index()
+    prices = prices.rename(columns={'Date': 'date'})
+    # Keep the exchange's local dates, dropping the time zone (offsets written
+    # to CSV change with daylight saving time)
+    dates = prices['date']
+    if isinstance(dates.dtype, pd.DatetimeTZDtype):
+        dates = dates.dt.tz_localize(None)
+    elif not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = dates.astype(str).str.replace(r'[+-]\d\d:\d\d$', '', regex=True)
+    prices['date'] = pd.to_datetime(dates)
+    for column in ('Dividends', 'Stock Splits'):
+        if column not in prices:
+            prices[column] = 0.0
+    return prices[VENDOR_COLUMNS].sort_values('date', ignore_index=True)
+
+class YahooSource:
+    """Full daily history of a ticker from Yahoo Finance, in one request.
+
+    yfinance is imported on the first fetch, so the rest of the module works
+    without it (e.g. offline against a ``CsvSource``).
+    """
+
+    name = 'yahoo'
+
+    def fetch(self, ticker):
+        import yfinance as yf
+        prices = yf.Ticker(ticker).history(period='max', auto_adjust=False)
+        if prices.empty:
+            raise ValueError(f'No Yahoo Finance data for {ticker}')
+        return _vendor_frame(prices)
+
+class CsvSource:
+    """Local stand-in for a vendor: ``<directory>/<ticker>.csv`` with the ``VENDOR_COLUMNS``."""
+
+    name = 'csv'
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def fetch(self, ticker):
+        return _vendor_frame(pd.read_csv(os.path.join(self.directory, f'{ticker}.csv')))
+
+class CachedSource:
+    """Wrap a source so that each ticker is fetched once and then read from ``cache_dir``.
+
+    Entries are stored like the panel cache, one per (source, ticker), so
+    reruns work offline; ``refresh`` fetches again and replaces them. A
+    ticker's key never changes, so writes skip pruning the cache directory.
+    """
+
+    def __init__(self, source, cache_dir, refresh=False):
+        self.source = source
+        self.cache_dir = cache_dir
+        self.refresh = refresh
+        self.name = source.name
+
+    # Function to derive the cache key of a ticker
+    def key(self, ticker):
+        payload = json.dumps({'source': self.name, 'ticker': ticker, 'columns': VENDOR_COLUMNS}, sort_keys=True)
+        return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+    def fetch(self, ticker):
+        key = self.key(ticker)
+        if not self.refresh and has_entry(self.cache_dir, key):
+            frames, _, _ = read_entry(self.cache_dir, key, mmap=False)
+            return frames['prices']
+        prices = self.source.fetch(ticker)
+        write_entry(self.cache_dir, key, os.path.join(self.cache_dir, self.name, ticker), frames={'prices': prices},
+                    meta={'source': self.name, 'ticker': ticker}, prune=False)
+        return prices
+
+# =============================================================================
+# Reference prices
+# =============================================================================
+
+# Function to read a Compustat daily security file (e.g. AAPL.csv)
+def read_compustat(path):
+    """Return one row per date with the raw price ``prccd`` and the adjusted
+    price ``ajprc`` (``prccd / ajexdi * trfd``) and return ``ajret``."""
+    crspdata = pd.read_csv(path, usecols=['datadate', 'GVKEY', 'prccd', 'ajexdi', 'trfd'])
+    crspdata['datadate'] = pd.to_datetime(crspdata['datadate'], format='%Y%m%d')
+    crspdata = crspdata.drop_duplicates(subset=['datadate', 'GVKEY']).sort_values('datadate')
+    crspdata['ajprc'] = crspdata['prccd'] / crspdata['ajexdi'] * crspdata['trfd']
+    crspdata['ajret'] = crspdata['ajprc'].pct_change(fill_method=None)
+    crspdata = crspdata.dropna(subset=['ajprc'])
+    return crspdata.rename(columns={'datadate': 'date'})[['date', 'prccd', 'ajprc', 'ajret']]
+
+# Function to read the reference file of every ticker from a directory
+def compustat_files(directory):
+    """Return a loader of ``<directory>/<ticker>.csv`` for ``reconcile``."""
+    return lambda ticker: read_compustat(os.path.join(directory, f'{ticker}.csv'))
+
+# =============================================================================
+# Reconciliation
+# =============================================================================
+
+# Function to compare one ticker's vendor prices with its reference prices
+def reconcile_ticker(vendor, reference, tolerance=1e-3):
+    """Return a dict of match counts, return correlation and mismatch rates.
+
+    Vendor returns come from the dividend-adjusted close and raw vendor prices
+    from undoing the splits of the split-adjusted close; they are compared
+    with ``ajret`` and ``prccd`` on the dates found in both. A date is a
+    mismatch when the returns differ by more than ``tolerance`` or the raw
+    prices by more than ``tolerance`` relative.
+    """
+    vendor = unadjust(vendor, symbol=None, date='date')
+    vendor['ret'] = vendor['Adj Close'].pct_change(fill_method=None)
+    vendor['price'] = vendor['Close'] * vendor['split_factor']
+
+    merged = pd.merge(vendor[['date', 'ret', 'price']], reference, on='date', how='outer', indicator=True)
+    both = merged[merged['_merge'] == 'both']
+    ret_diff = (both['ret'] - both['ajret']).abs()
+    price_diff = (both['price'] / both['prccd'].abs() - 1).abs()
+    return {
+        'vendor_dates': int((merged['_merge'] != 'right_only').sum()),
+        'reference_dates': int((merged['_merge'] != 'left_only').sum()),
+        'matched_dates': len(both),
+        'first_date': both['date'].min(),
+        'last_date': both['date'].max(),
+        'ret_corr': both['ret'].corr(both['ajret']),
+        'ret_mismatch_share': (ret_diff > tolerance).sum() / max(int(ret_diff.notna().sum()), 1),
+        'max_ret_diff': ret_diff.max(),
+        'price_mismatch_share': (price_diff > tolerance).sum() / max(int(price_diff.notna().sum()), 1),
+        'max_price_diff': price_diff.max(),
+    }
+
+# Function to reconcile many tickers, fetching and comparing them on a thread pool
+def reconcile(tickers, source, reference, tolerance=1e-3, max_workers=8):
+    """Return one row of ``reconcile_ticker`` results per ticker.
+
+    ``source`` has a ``fetch(ticker)`` method (wrap it in ``CachedSource`` to
+    keep the responses on disk) and ``reference(ticker)`` returns the
+    ``read_compustat`` frame of a ticker. Fetches are I/O bound, so tickers
+    run on threads; a ticker that fails gets its error in the ``error``
+    column instead of stopping the others.
+    """
+    tickers = list(dict.fromkeys(tickers))
+
+    def run(ticker):
+        try:
+            return reconcile_ticker(source.fetch(ticker), reference(ticker), tolerance)
+        except Exception as error:
+            return {'error': f'{type(error).__name__}: {error}'}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(run, tickers))
+    report = pd.DataFrame(results, index=pd.Index(tickers, name='ticker'))
+    if 'error' not in report:
+        report['error'] = np.nan
+    return report
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+
+from market_cap.cache import entry_dir, file_fingerprint, has_entry, read_entry, write_entry
+
+# =============================================================================
+# Results store
+# =============================================================================
+
+# Bumped whenever a change to the pipeline changes its results, so that stored
+# results from older code are not reused
+RESULTS_VERSION = 1
+
+# Function to derive the key of a result from its input files and parameters
+def results_key(name, inputs, results_dir, **params):
+    """Return a short key over the content of every input file and ``params``.
+
+    Input files are fingerprinted like the panel cache (size and content hash,
+    with the hash remembered in ``results_dir``), so an unchanged file is not
+    re-read.
+    """
+    fingerprints = [file_fingerprint(path, results_dir) for path in inputs]
+    payload = json.dumps({
+        'name': name,
+        'version': RESULTS_VERSION,
+        'inputs': [{'size': f['size'], 'sha1': f['sha1']} for f in fingerprints],
+        'params': params,
+    }, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+# Function to name the pseudo-source the entries of a result are grouped under
+def results_source(results_dir, name, **params):
+    """Return the source a result is pruned by: its name and ``params``.
+
+    A new result replaces the stored ones of the same name and parameters (built
+    from older inputs), while runs with other parameters keep their own.
+    """
+    payload = json.dumps({'name': name, 'params': params}, sort_keys=True, default=str)
+    return os.path.join(results_dir, f'{name}-{hashlib.sha1(payload.encode()).hexdigest()[:16]}')
+
+# Function to store the frames of a result, replacing older results of the same name and parameters
+def save_results(results_dir, name, key, frames, meta=None, source=None):
+    """Store date x series ``frames`` (e.g. ``{'prices': prices}``) under ``key``.
+
+    ``source`` comes from ``results_source`` over the parameters of ``key``
+    (by default, that of ``name`` without parameters).
+    """
+    source = results_source(results_dir, name) if source is None else source
+    write_entry(results_dir, key, source, matrices=frames, meta=dict(meta or {}, name=name))
+
+# Function to load the frames and meta of a result, or None if it is not stored
+def load_results(results_dir, key):
+    if not has_entry(results_dir, key):
+        return None
+    _, frames, meta = read_entry(results_dir, key)
+    return frames, meta
+
+# Function to load the last stored result of a name, whatever inputs it came from
+def latest_results(results_dir, name):
+    """Return ``(frames, meta)`` of the latest result called ``name``, or None.
+
+    The most recently written result wins, so this attaches to it without
+    fingerprinting the inputs (e.g. on a machine without the source files).
+    """
+    if not os.path.isdir(results_dir):
+        return None
+    latest, latest_mtime = None, None
+    for key in os.listdir(results_dir):
+        if not has_entry(results_dir, key):
+            continue
+        directory = entry_dir(results_dir, key)
+        # Entries can be replaced by other writers while the directory is scanned
+        try:
+            with open(os.path.join(directory, 'entry.json')) as f:
+                entry_name = json.load(f)['meta'].get('name')
+            mtime = os.stat(os.path.join(directory, 'complete')).st_mtime_ns
+        except (OSError, ValueError, KeyError):
+            continue
+        if entry_name == name and (latest_mtime is None or mtime > latest_mtime):
+            latest, latest_mtime = key, mtime
+    return None if latest is None else load_results(results_dir, latest)
+
+# Function to load a result if its inputs are unchanged, computing and storing it otherwise
+def cached_results(results_dir, name, inputs, compute, **params):
+    """Return ``(frames, meta)`` of result ``name``.
+
+    ``compute()`` returns ``(frames, meta)`` and only runs when no result is
+    stored for the current content of ``inputs`` and ``params``. ``meta`` is
+    a JSON-serializable dict, e.g. counts to report on later loads.
+    """
+    key = results_key(name, inputs, results_dir, **params)
+    results = load_results(results_dir, key)
+    if results is not None:
+        return results
+
+    frames, meta = compute()
+    save_results(results_dir, name, key, frames, meta, results_source(results_dir, name, **params))
+    return frames, dict(meta or {}, name=name)
@@ -0,0 +1,276 @@
+import numpy as np
+import pandas as pd
+
+from market_cap.instrument import instrumented
+
+# =============================================================================
+# Helpers
+# =============================================================================
+
+# Function to put several date x PERMNO frames on the same rows and columns
+def align_frames(*frames):
+    """Reindex all frames to the union of their dates and PERMNOs."""
+    index = frames[0].index
+    columns = frames[0].columns
+    for df in frames[1:]:
+        if not df.index.equals(index):
+            index = index.union(df.index)
+        if not df.columns.equals(columns):
+            columns = columns.union(df.columns)
+
+    # Only reindex frames that are not already aligned, to avoid needless copies
+    aligned = []
+    for df in frames:
+        if df.index.equals(index) and df.columns.equals(columns):
+            aligned.append(df)
+        else:
+            aligned.append(df.reindex(index=index, columns=columns))
+    return aligned
+
+# Function to divide group sums, leaving NaN where a group is empty
+def _safe_divide(numerator, denominator, counts):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = numerator / denominator
+    result[counts == 0] = np.nan
+    return result
+
+# =============================================================================
+# Bucket portfolios
+# =============================================================================
+
+# Function to shift the rows of a date x PERMNO array down by `periods` dates
+def lag_rows(values, periods=1):
+    lagged = np.full(values.shape, np.nan)
+    if periods < len(values):
+        lagged[periods:] = values[:len(values) - periods]
+    return lagged
+
+# Function to reduce returns by (date, group) label with a single group-sum
+def grouped_returns(labels, returns, weights, n_groups):
+    """Return dates x n_groups arrays ``(ew, vw)`` from aligned arrays.
+
+    ``labels`` (1..n_groups, NaN outside any group) and ``weights`` must already
+    be lagged to the formation date; ``returns`` are the returns being earned.
+    """
+    n_dates = len(returns)
+
+    # Keep stocks that have a group label and a return
+    valid = ~np.isnan(labels) & ~np.isnan(returns)
+    rows, cols = np.nonzero(valid)
+    keys = rows * n_groups + (labels[rows, cols].astype(np.int64) - 1)
+    curr_returns = returns[rows, cols]
+    prev_weights = weights[rows, cols]
+
+    # Value weights only count stocks with a lagged weight
+    has_weight = ~np.isnan(prev_weights)
+    prev_weights = np.where(has_weight, prev_weights, 0.0)
+
+    size = n_dates * n_groups
+    counts = np.bincount(keys, minlength=size)
+    ret_sums = np.bincount(keys, weights=curr_returns, minlength=size)
+    weighted_sums = np.bincount(keys, weights=curr_returns * prev_weights, minlength=size)
+    weight_sums = np.bincount(keys, weights=prev_weights, minlength=size)
+    weight_counts = np.bincount(keys, weights=has_weight, minlength=size)
+
+    ew = _safe_divide(ret_sums, counts, counts).reshape(n_dates, n_groups)
+    vw = _safe_divide(weighted_sums, weight_sums, weight_counts).reshape(n_dates, n_groups)
+    return ew, vw
+
+# Function to compute equal- and value-weighted returns of every bucket in one pass
+@instrumented
+def bucket_returns(buckets_df, ret_df, mktcap_df, n_buckets=10):
+    """Return ``(ewret_df, vwret_df)`` with one column per bucket 1..n_buckets.
+
+    Stocks are assigned with the previous date's bucket labels, earn the current
+    date's return and are weighted by the previous date's market cap. All dates
+    and buckets are reduced together with a single group-sum over the flattened
+    (date, bucket) key, so the cost does not grow with ``n_buckets``.
+    """
+    buckets_df, ret_df, mktcap_df = align_frames(buckets_df, ret_df, mktcap_df)
+
+    # Lag the bucket labels and market caps by one date
+    labels = lag_rows(buckets_df.to_numpy(dtype=float))
+    weights = lag_rows(mktcap_df.to_numpy(dtype=float))
+    ew, vw = grouped_returns(labels, ret_df.to_numpy(dtype=float), weights, n_buckets)
+
+    columns = range(1, n_buckets + 1)
+    ewret_df = pd.DataFrame(ew, index=ret_df.index, columns=columns)
+    vwret_df = pd.DataFrame(vw, index=ret_df.index, columns=columns)
+    return ewret_df, vwret_df
+
+# =============================================================================
+# Top X largest stocks portfolios
+# =============================================================================
+
+# Function to compute top-X returns for many portfolio sizes from one sort per date
+@instrumented
+def topx_returns(ret_df, mktcap_df, sizes):
+    """Return ``(ew_df, vw_df)`` with one column per portfolio size.
+
+    Each cross-section is sorted once by the previous date's market cap (largest
+    first, ties in column order like ``nlargest``). Prefix sums of returns and of
+    cap-weighted returns along that order then give the portfolio return of every
+    size by a single lookup, so any number of sizes costs one pass.
+    """
+    ret_df, mktcap_df = align_frames(ret_df, mktcap_df)
+    sizes = list(sizes)
+    n_dates, n_stocks = ret_df.shape
+    depth = min(max(sizes), n_stocks) if sizes else 0
+
+    # Lagged market caps and current returns
+    prev_caps = mktcap_df.to_numpy(dtype=float)[:-1]
+    curr_returns = ret_df.to_numpy(dtype=float)[1:]
+
+    # Sort each row by descending lagged market cap; missing caps go last
+    order = np.argsort(-prev_caps, axis=1, kind='stable')[:, :depth]
+    sorted_caps = np.take_along_axis(prev_caps, order, axis=1)
+    sorted_returns = np.take_along_axis(curr_returns, order, axis=1)
+
+    # Stocks count once they were ranked last date and have a return this date
+    valid = ~np.isnan(sorted_caps) & ~np.isnan(sorted_returns)
+    sorted_returns = np.where(valid, sorted_returns, 0.0)
+    sorted_caps = np.where(valid, sorted_caps, 0.0)
+
+    # Running totals along the size ordering
+    cum_counts = np.cumsum(valid, axis=1)
+    cum_returns = np.cumsum(sorted_returns, axis=1)
+    cum_weighted = np.cumsum(sorted_returns * sorted_caps, axis=1)
+    cum_weights = np.cumsum(sorted_caps, axis=1)
+
+    # Sizes larger than the cross-section use every available stock
+    positions = np.clip(np.asarray(sizes, dtype=np.int64), 1, max(depth, 1)) - 1
+    ew = np.full((n_dates, len(sizes)), np.nan)
+    vw = np.full((n_dates, len(sizes)), np.nan)
+    if depth > 0:
+        counts = cum_counts[:, positions]
+        ew[1:] = _safe_divide(cum_returns[:, positions], counts, counts)
+        vw[1:] = _safe_divide(cum_weighted[:, positions], cum_weights[:, positions], counts)
+
+    ew_df = pd.DataFrame(ew, index=ret_df.index, columns=sizes)
+    vw_df = pd.DataFrame(vw, index=ret_df.index, columns=sizes)
+    return ew_df, vw_df
+
+# Function to compute top-X returns for many sizes from precomputed rank positions
+def ranked_prefix_returns(ranks, returns, weights, sizes):
+    """Return dates x len(sizes) arrays ``(ew, vw)``.
+
+    ``ranks`` hold each stock's 1-based position (1 = first in), already lagged
+    to the formation date, NaN for unranked stocks. Returns and weights are
+    scattered into rank order and prefix-summed, so every size is one lookup.
+    """
+    n_dates = len(returns)
+    sizes = np.asarray(list(sizes), dtype=np.int64)
+    depth = int(min(sizes.max(), returns.shape[1])) if len(sizes) else 0
+
+    # Scatter the stocks that are in the first `depth` positions into rank order
+    in_depth = ~np.isnan(ranks) & (ranks <= depth)
+    rows, cols = np.nonzero(in_depth)
+    positions = ranks[rows, cols].astype(np.int64) - 1
+    sorted_returns = np.full((n_dates, max(depth, 1)), np.nan)
+    sorted_weights = np.full((n_dates, max(depth, 1)), np.nan)
+    sorted_returns[rows, positions] = returns[rows, cols]
+    sorted_weights[rows, positions] = weights[rows, cols]
+
+    has_return = ~np.isnan(sorted_returns)
+    has_weight = has_return & ~np.isnan(sorted_weights)
+    sorted_returns = np.where(has_return, sorted_returns, 0.0)
+    sorted_weights = np.where(has_weight, sorted_weights, 0.0)
+
+    # Running totals along the rank order
+    positions = np.clip(sizes, 1, max(depth, 1)) - 1
+    counts = np.cumsum(has_return, axis=1)[:, positions]
+    weight_counts = np.cumsum(has_weight, axis=1)[:, positions]
+    ew = _safe_divide(np.cumsum(sorted_returns, axis=1)[:, positions], counts, counts)
+    vw = _safe_divide(np.cumsum(sorted_returns * sorted_weights, axis=1)[:, positions],
+                      np.cumsum(sorted_weights, axis=1)[:, positions], weight_counts)
+    return ew, vw
+
+# =============================================================================
+# Top X largest stocks portfolios (yearly rebalance)
+# =============================================================================
+
+# Function to get the last date in December for each year
+def get_end_of_year_dates(dates):
+    """Return the last December date of every year present in ``dates``."""
+    dates = pd.DatetimeIndex(dates)
+    december = dates[dates.month == 12]
+    return pd.DatetimeIndex(december.to_series().groupby(december.year).max().to_numpy())
+
+# Function to rank market caps at each year end, keyed by the year the ranks apply to
+@instrumented
+def year_end_ranks(mktcap_df):
+    """Return a year x PERMNO frame of market-cap ranks (1 = largest).
+
+    Ranks are taken on the last December date of each year and stored under the
+    following year, which is when they are used to form portfolios. Ties are
+    broken by column order, as ``nsmallest`` does on the original ranks.
+    """
+    end_of_year_dates = get_end_of_year_dates(mktcap_df.index)
+    years = end_of_year_dates.year + 1
+    keep = years.isin(mktcap_df.index.year)
+    end_of_year_dates = end_of_year_dates[keep]
+
+    ranks = descending_ranks(mktcap_df.loc[end_of_year_dates].to_numpy(dtype=float))
+    return pd.DataFrame(ranks, index=years[keep], columns=mktcap_df.columns)
+
+# Function to rank each row from largest (1) to smallest, NaN where missing
+def descending_ranks(caps):
+    # Descending ranks: sort the negated market caps in ascending order
+    caps = np.atleast_2d(caps)
+    order = np.argsort(-caps, axis=1, kind='stable')
+    ranks = np.empty(caps.shape)
+    np.put_along_axis(ranks, order, np.broadcast_to(np.arange(1, caps.shape[1] + 1), caps.shape), axis=1)
+    ranks[np.isnan(caps)] = np.nan
+    return ranks
+
+# Function to expand year-end ranks to one row per date
+def expand_year_ranks(ranks_df, dates, columns):
+    """Return a date x PERMNO array holding each date's applicable year-end ranks."""
+    ranks_df = ranks_df.reindex(columns=columns)
+    rows = ranks_df.index.get_indexer(pd.DatetimeIndex(dates).year)
+    expanded = np.full((len(dates), len(columns)), np.nan)
+    has_ranks = rows >= 0
+    expanded[has_ranks] = ranks_df.to_numpy(dtype=float)[rows[has_ranks]]
+    return expanded
+
+# Function to compute annually rebalanced top-X returns as masked reductions
+@instrumented
+def annual_topx_returns(ret_df, mktcap_df, sizes, ranks_df=None):
+    """Return ``(ew_df, vw_df)`` for portfolios of the largest stocks at each year end.
+
+    Membership is fixed from the December ranks for the whole following year;
+    value weights use the previous date's market cap, as in the monthly portfolios.
+    ``ranks_df`` can be passed to reuse ranks from ``year_end_ranks``.
+    """
+    ret_df, mktcap_df = align_frames(ret_df, mktcap_df)
+    sizes = list(sizes)
+    if ranks_df is None:
+        ranks_df = year_end_ranks(mktcap_df)
+
+    # Year-end ranks on every date; the first date has no prior period
+    ranks = expand_year_ranks(ranks_df, ret_df.index, ret_df.columns)
+    ranks[0] = np.nan
+
+    returns = ret_df.to_numpy(dtype=float)
+    prev_caps = np.full(mktcap_df.shape, np.nan)
+    prev_caps[1:] = mktcap_df.to_numpy(dtype=float)[:-1]
+
+    has_return = ~np.isnan(returns)
+    has_weight = has_return & ~np.isnan(prev_caps)
+    returns = np.where(has_return, returns, 0.0)
+    prev_caps = np.where(has_weight, prev_caps, 0.0)
+    weighted_returns = returns * prev_caps
+
+    ew = np.full((len(ret_df), len(sizes)), np.nan)
+    vw = np.full((len(ret_df), len(sizes)), np.nan)
+    for j, size in enumerate(sizes):
+        members = ranks <= size
+        counts = (members & has_return).sum(axis=1)
+        weight_counts = (members & has_weight).sum(axis=1)
+        ew[:, j] = _safe_divide(np.where(members, returns, 0.0).sum(axis=1), counts, counts)
+        vw[:, j] = _safe_divide(np.where(members, weighted_returns, 0.0).sum(axis=1),
+                                np.where(members, prev_caps, 0.0).sum(axis=1), weight_counts)
+
+    ew_df = pd.DataFrame(ew, index=ret_df.index, columns=sizes)
+    vw_df = pd.DataFrame(vw, index=ret_df.index, columns=sizes)
+    return ew_df, vw_df
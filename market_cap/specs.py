@@ -0,0 +1,376 @@
+import hashlib
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from market_cap.buckets import (BREAKPOINT_UNIVERSES, assign_by_breakpoints, breakpoint_table, bucket_of_rank,
+                                rank_rows)
+from market_cap.compact import CompactPanel
+from market_cap.instrument import instrumented
+from market_cap.rebalance import SCHEDULES, drift_factors, expand_formations, formation_dates, holding_periods
+from market_cap.returns import descending_ranks, grouped_returns, lag_rows, ranked_prefix_returns
+
+# =============================================================================
+# Portfolio specifications
+# =============================================================================
+
+@dataclass(frozen=True)
+class PortfolioSpec:
+    """Declarative description of one portfolio family.
+
+    Exactly one of ``buckets`` (equal-count quantile buckets, one column per
+    bucket, smallest first) or ``top`` (the ``top`` largest stocks) is set.
+    Stocks are sorted on ``sort`` as of ``lag`` dates before the return date
+    (``rebalance='monthly'``), or on the latest formation date of a schedule
+    from ``SCHEDULES`` (e.g. ``'annual'``: the last December date,
+    ``'june'``: the last June date) or of a tuple of custom dates (named
+    ``custom_`` plus a short hash of the dates in columns), where ``lag``
+    must be 1. Value weights use ``weight`` on the previous date; with
+    ``drift`` set, weights are instead set on the formation date and drift with
+    realized returns until the next one (buy-and-hold).
+
+    Bucket specs cut on all-stock quantiles by default; ``breakpoints`` names a
+    sub-universe from ``BREAKPOINT_UNIVERSES`` (e.g. ``'nyse'``) whose
+    quantiles are used as breakpoints for every stock instead.
+    """
+    sort: str = 'MKTCAP'
+    buckets: Optional[int] = None
+    top: Optional[int] = None
+    weighting: str = 'ew'
+    rebalance: str = 'monthly'
+    lag: int = 1
+    weight: str = 'MKTCAP'
+    breakpoints: Optional[str] = None
+    drift: bool = False
+
+    def __post_init__(self):
+        # Custom schedules are stored as a tuple of timestamps so specs stay hashable
+        if not isinstance(self.rebalance, str):
+            object.__setattr__(self, 'rebalance', tuple(pd.to_datetime(list(self.rebalance))))
+        if (self.buckets is None) == (self.top is None):
+            raise ValueError('Set exactly one of `buckets` or `top`')
+        for name in ('buckets', 'top'):
+            value = getattr(self, name)
+            if value is not None and value < 1:
+                raise ValueError(f'`{name}` must be at least 1, not {value}')
+        if self.breakpoints is not None and (self.top is not None or self.breakpoints not in BREAKPOINT_UNIVERSES):
+            raise ValueError(f'Invalid breakpoints {self.breakpoints!r} for this spec')
+        if self.weighting not in ('ew', 'vw'):
+            raise ValueError(f'Unknown weighting: {self.weighting}')
+        if isinstance(self.rebalance, str) and self.rebalance not in SCHEDULES:
+            raise ValueError(f'Unknown rebalance frequency: {self.rebalance}')
+        if self.lag < 1 or (self.rebalance != 'monthly' and self.lag != 1):
+            raise ValueError(f'Invalid lag {self.lag} for {self.rebalance} rebalancing')
+
+    # Key of the ranking this spec needs; specs with the same key share it
+    @property
+    def ranking(self):
+        ascending = self.buckets is not None
+        return (self.sort, self.rebalance, self.lag, ascending)
+
+    # Column prefix, following the names used in portfolios.py
+    @property
+    def prefix(self):
+        sort = '' if self.sort == 'MKTCAP' else f'{self.sort.lower()}_'
+        lag = '' if self.lag == 1 else f'_lag{self.lag}'
+        if not isinstance(self.rebalance, str):
+            # Custom calendars are told apart by a short hash of their dates
+            dates = ','.join(f'{date:%Y-%m-%d}' for date in self.rebalance)
+            frequency = f'custom_{hashlib.sha1(dates.encode()).hexdigest()[:6]}'
+        else:
+            frequency = {'monthly': 'm', 'quarterly': 'qtr', 'semiannual': 'sa', 'annual': 'y',
+                         'june': 'jun'}[self.rebalance]
+        drift = '_bh' if self.drift else ''
+        weighting = self.weighting if self.weight == 'MKTCAP' else f'{self.weighting}_{self.weight.lower()}'
+        if self.top is not None:
+            return f'{sort}topx_{frequency}{lag}{drift}_{weighting}_'
+        scheme = 'dec' if self.buckets == 10 else f'q{self.buckets}'
+        if self.breakpoints is not None:
+            scheme = f'{scheme}_{self.breakpoints}'
+        frequency = '' if self.rebalance == 'monthly' else f'_{frequency}'
+        return f'{sort}{scheme}{frequency}{lag}{drift}_{weighting}_'
+
+    @property
+    def columns(self):
+        if self.top is not None:
+            return [f'{self.prefix}{self.top}']
+        return [f'{self.prefix}{bucket}' for bucket in range(1, self.buckets + 1)]
+
+# Function to build the spec list of the six families in portfolios.py
+def default_specs(sizes=(50, 100, 500, 1000)):
+    specs = [PortfolioSpec(buckets=10, weighting=w) for w in ('ew', 'vw')]
+    specs += [PortfolioSpec(top=size, weighting=w) for w in ('ew', 'vw') for size in sizes]
+    specs += [PortfolioSpec(top=size, weighting=w, rebalance='annual') for w in ('ew', 'vw') for size in sizes]
+    return specs
+
+# =============================================================================
+# Shared rankings
+# =============================================================================
+
+# Function to rank the sort variable once for a ranking key
+def _rank(values, dates, rebalance, lag, ascending):
+    """Return (ranks, counts) aligned with the return dates.
+
+    ``ranks`` is a dates x PERMNO array of 1-based positions as of the formation
+    date (NaN for unranked stocks) and ``counts`` the number ranked per date.
+    """
+    if rebalance == 'monthly':
+        if ascending:
+            ranks, counts = rank_rows(values)
+            ranks = np.where(ranks <= counts[:, None], ranks, np.nan)
+        else:
+            ranks = descending_ranks(values)
+            counts = (~np.isnan(values)).sum(axis=1)
+        return lag_rows(ranks, lag), lag_rows(counts[:, None].astype(float), lag)[:, 0]
+
+    # Other schedules: rank on each formation date, apply until the next one
+    formations = formation_dates(dates, rebalance)
+    periods = holding_periods(len(dates), formations)
+    formation_values = values[formations]
+    if ascending:
+        formation_ranks, formation_counts = rank_rows(formation_values)
+        formation_ranks = np.where(formation_ranks <= formation_counts[:, None], formation_ranks, np.nan)
+    else:
+        formation_ranks = descending_ranks(formation_values)
+        formation_counts = (~np.isnan(formation_values)).sum(axis=1)
+    # Values are indexed by formation, so expand with identity positions
+    positions = np.arange(len(formations))
+    return (expand_formations(formation_ranks, positions, periods),
+            expand_formations(formation_counts, positions, periods))
+
+# Function to assign bucket labels from sub-universe breakpoints, lagged to the return dates
+def _breakpoint_labels(sort, values_df, exchcd_df, universe, n_buckets, rebalance, lag, tables):
+    """``tables`` caches the breakpoint table of each (sort, universe, n_buckets,
+    rebalance) so it is computed once and reused across weightings and lags."""
+    key = (sort, universe, n_buckets, rebalance)
+    n_dates = len(values_df)
+    if rebalance != 'monthly':
+        formations = formation_dates(values_df.index, rebalance)
+        values_df = values_df.iloc[formations]
+        exchcd_df = exchcd_df.iloc[formations]
+    if key not in tables:
+        in_universe = exchcd_df.isin(BREAKPOINT_UNIVERSES[universe]).to_numpy()
+        tables[key] = breakpoint_table(values_df, in_universe, n_buckets)
+    labels = assign_by_breakpoints(values_df, tables[key]).to_numpy()
+    if rebalance != 'monthly':
+        return expand_formations(labels, np.arange(len(formations)), holding_periods(n_dates, formations))
+    return lag_rows(labels, lag)
+
+# =============================================================================
+# Batch evaluator
+# =============================================================================
+
+# Function to make sure different specs do not write the same column
+def _check_columns(specs):
+    owners = {}
+    for spec in specs:
+        for column in spec.columns:
+            owner = owners.setdefault(column, spec)
+            if owner != spec:
+                raise ValueError(f'{owner} and {spec} both produce column {column!r}')
+
+# Function to evaluate many portfolio specs, sharing rankings between them
+@instrumented
+def evaluate(specs, panels, breakpoint_tables=None):
+    """Return a date x column frame of returns for every spec, in spec order.
+
+    ``panels`` maps variable names (``'RET'``, the sort and weight variables) to
+    aligned date x PERMNO frames, as returned by ``load_panel``. Specs are
+    grouped by ranking key so each ranking is computed once; bucket specs with
+    the same bucket count share one grouped reduction, and top-X specs sharing a
+    ranking are answered together from one prefix-sum pass.
+
+    Breakpoint specs also need ``panels['EXCHCD']``. Their breakpoint tables
+    are kept in ``breakpoint_tables`` (a dict, which can be passed in to reuse
+    tables across calls).
+
+    Drifting specs run the same kernels with buy-and-hold weights in place of
+    the lagged weights: the EW weight of a holding is its drift factor since
+    formation and the VW weight its formation-date weight times that factor.
+
+    ``panels`` can also be a ``CompactPanel`` (``load_panel(..., compact=True)``),
+    which runs the same rankings and reductions on the live securities only.
+    """
+    specs = list(specs)
+    _check_columns(specs)
+    if isinstance(panels, CompactPanel):
+        return _evaluate_compact(specs, panels, {} if breakpoint_tables is None else breakpoint_tables)
+    ret_df = panels['RET']
+    dates = ret_df.index
+    returns = ret_df.to_numpy(dtype=float)
+
+    rankings = {}
+    weights = {}
+    breakpoint_tables = {} if breakpoint_tables is None else breakpoint_tables
+    bucket_results = {}
+    top_results = {}
+
+    # Function to get the lagged weights of a weight variable
+    def get_weights(name):
+        if name not in weights:
+            weights[name] = lag_rows(panels[name].reindex_like(ret_df).to_numpy(dtype=float))
+        return weights[name]
+
+    # Function to get the (EW, VW) buy-and-hold weights of a schedule and weight variable
+    def get_drift_weights(rebalance, name):
+        key = ('drift', rebalance, name)
+        if key not in weights:
+            if rebalance == 'monthly':
+                formations = np.arange(len(dates))
+            else:
+                formations = formation_dates(dates, rebalance)
+            periods = holding_periods(len(dates), formations)
+            factor_key = ('factors', rebalance)
+            if factor_key not in weights:
+                weights[factor_key] = drift_factors(returns, formations, periods)
+            factors = weights[factor_key]
+            values = panels[name].reindex_like(ret_df).to_numpy(dtype=float)
+            weights[key] = (factors, factors * expand_formations(values, formations, periods))
+        return weights[key]
+
+    # Function to run a kernel with the weights of a spec group, returning (ew, vw)
+    def run_kernel(kernel, labels, weight, rebalance, drift, *args):
+        if not drift:
+            return kernel(labels, returns, get_weights(weight), *args)
+        ew_weights, vw_weights = get_drift_weights(rebalance, weight)
+        return kernel(labels, returns, ew_weights, *args)[1], kernel(labels, returns, vw_weights, *args)[1]
+
+    # Function to get the ranking of a key
+    def get_ranking(key):
+        if key not in rankings:
+            sort, rebalance, lag, ascending = key
+            values = panels[sort].reindex_like(ret_df).to_numpy(dtype=float)
+            rankings[key] = _rank(values, dates, rebalance, lag, ascending)
+        return rankings[key]
+
+    # Answer the top-X specs of each (ranking, weight, drift) group in one pass
+    top_groups = {}
+    for spec in specs:
+        if spec.top is not None:
+            top_groups.setdefault((spec.ranking, spec.weight, spec.drift), set()).add(spec.top)
+    for (key, weight, drift), sizes in top_groups.items():
+        sizes = sorted(sizes)
+        ranks, _ = get_ranking(key)
+        ew, vw = run_kernel(ranked_prefix_returns, ranks, weight, key[1], drift, sizes)
+        for j, size in enumerate(sizes):
+            top_results[(key, weight, drift, size)] = (ew[:, j], vw[:, j])
+
+    columns = {}
+    for spec in specs:
+        side = 0 if spec.weighting == 'ew' else 1
+        if spec.top is not None:
+            columns[spec.columns[0]] = top_results[(spec.ranking, spec.weight, spec.drift, spec.top)][side]
+            continue
+
+        result_key = (spec.ranking, spec.weight, spec.drift, spec.buckets, spec.breakpoints)
+        if result_key not in bucket_results:
+            if spec.breakpoints is not None:
+                labels = _breakpoint_labels(spec.sort, panels[spec.sort].reindex_like(ret_df),
+                                            panels['EXCHCD'].reindex_like(ret_df), spec.breakpoints,
+                                            spec.buckets, spec.rebalance, spec.lag, breakpoint_tables)
+            else:
+                ranks, counts = get_ranking(spec.ranking)
+                labels = bucket_of_rank(np.nan_to_num(ranks, nan=1), np.nan_to_num(counts, nan=1)[:, None],
+                                        spec.buckets)
+                labels[np.isnan(ranks)] = np.nan
+            bucket_results[result_key] = run_kernel(grouped_returns, labels, spec.weight, spec.rebalance, spec.drift,
+                                                    spec.buckets)
+        values = bucket_results[result_key][side]
+        for j, column in enumerate(spec.columns):
+            columns[column] = values[:, j]
+
+    return pd.DataFrame(columns, index=dates)
+
+# =============================================================================
+# Compact evaluator
+# =============================================================================
+
+# Function to find, for every date, the date its holdings were formed on
+def _source_dates(dates, rebalance, lag=1):
+    """Return one date position per date (-1 for none): ``lag`` dates back for
+    monthly rebalancing, otherwise the latest formation date strictly before."""
+    if rebalance == 'monthly':
+        source = np.arange(len(dates)) - lag
+        return np.where(source >= 0, source, -1)
+    formations = formation_dates(dates, rebalance)
+    periods = holding_periods(len(dates), formations)
+    if len(formations) == 0:
+        return np.full(len(dates), -1)
+    return np.where(periods >= 0, formations[np.maximum(periods, 0)], -1)
+
+# Function to evaluate specs on a CompactPanel, mirroring the dense evaluator
+def _evaluate_compact(specs, panel, breakpoint_tables):
+    dates = panel.dates
+    rankings = {}
+    weights = {}
+    bucket_results = {}
+    top_results = {}
+
+    # Function to get the ranks and cross-section sizes of a key, aligned with the return dates
+    def get_ranking(key):
+        if key not in rankings:
+            sort, rebalance, lag, ascending = key
+            source = _source_dates(dates, rebalance, lag)
+            ranks, counts = panel.rank(sort, ascending)
+            source_counts = np.where(source >= 0, counts[np.maximum(source, 0)], np.nan)
+            rankings[key] = (panel.align(ranks, source), source_counts[panel.date_codes])
+        return rankings[key]
+
+    # Function to run a kernel with the weights of a spec group, returning (ew, vw)
+    def run_kernel(kernel, labels, weight, rebalance, drift, *args):
+        if not drift:
+            if weight not in weights:
+                weights[weight] = panel.lag(weight)
+            return kernel(labels, 'RET', weights[weight], *args)
+        key = ('drift', rebalance, weight)
+        if key not in weights:
+            source = _source_dates(dates, rebalance)
+            factors = panel.growth_since('RET', source)
+            weights[key] = (factors, factors * panel.align(weight, source))
+        ew_weights, vw_weights = weights[key]
+        return kernel(labels, 'RET', ew_weights, *args)[1], kernel(labels, 'RET', vw_weights, *args)[1]
+
+    # Function to get the breakpoint bucket labels of a spec, aligned with the return dates
+    def breakpoint_labels(spec):
+        key = ('compact', spec.sort, spec.breakpoints, spec.buckets)
+        if key not in breakpoint_tables:
+            in_universe = np.isin(panel['EXCHCD'], BREAKPOINT_UNIVERSES[spec.breakpoints])
+            breakpoint_tables[key] = panel.breakpoints(spec.sort, in_universe, spec.buckets)
+        labels = panel.breakpoint_buckets(spec.sort, breakpoint_tables[key])
+        return panel.align(labels, _source_dates(dates, spec.rebalance, spec.lag))
+
+    # Answer the top-X specs of each (ranking, weight, drift) group in one pass
+    top_groups = {}
+    for spec in specs:
+        if spec.top is not None:
+            top_groups.setdefault((spec.ranking, spec.weight, spec.drift), set()).add(spec.top)
+    for (key, weight, drift), sizes in top_groups.items():
+        sizes = sorted(sizes)
+        ranks, _ = get_ranking(key)
+        ew, vw = run_kernel(panel.ranked_prefix_returns, ranks, weight, key[1], drift, sizes)
+        for j, size in enumerate(sizes):
+            top_results[(key, weight, drift, size)] = (ew[:, j], vw[:, j])
+
+    columns = {}
+    for spec in specs:
+        side = 0 if spec.weighting == 'ew' else 1
+        if spec.top is not None:
+            columns[spec.columns[0]] = top_results[(spec.ranking, spec.weight, spec.drift, spec.top)][side]
+            continue
+
+        result_key = (spec.ranking, spec.weight, spec.drift, spec.buckets, spec.breakpoints)
+        if result_key not in bucket_results:
+            if spec.breakpoints is not None:
+                labels = breakpoint_labels(spec)
+            else:
+                ranks, counts = get_ranking(spec.ranking)
+                labels = panel.rank_buckets(ranks, counts, spec.buckets)
+            bucket_results[result_key] = run_kernel(panel.grouped_returns, labels, spec.weight, spec.rebalance,
+                                                    spec.drift, spec.buckets)
+        values = bucket_results[result_key][side]
+        for j, column in enumerate(spec.columns):
+            columns[column] = values[:, j]
+
+    return pd.DataFrame(columns, index=dates)
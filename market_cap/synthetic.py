@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+
+from market_cap.ingest import CRSP_COLUMNS
+
+# =============================================================================
+# Synthetic CRSP-like monthly panel
+# =============================================================================
+
+# CRSP letter codes that can appear in RET instead of a number
+RET_LETTER_CODES = np.array(['A', 'B', 'C', 'D', 'E'])
+
+# Function to generate a synthetic monthly panel with the columns of crspm.csv
+def generate_crsp(n_permnos=5000, n_months=240, churn=0.01, letter_share=0.01, start='1926-01-31', seed=0, freq='ME'):
+    """Return a long frame shaped like ``crspm.csv``.
+
+    Each PERMNO lists at a random month and delists with monthly probability
+    ``churn``; a share ``letter_share`` of RET values are CRSP letter codes and a
+    few are the numeric missing codes (-66, -99). Prices follow the returns,
+    some are negative (bid/ask averages), and a small share of rows fall outside
+    the default EXCHCD/SHRCD filters.
+
+    ``freq`` sets the spacing of the dates (e.g. ``'B'`` for a daily-like file
+    of ``n_months`` business days); churn and return scales stay per period.
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start, periods=n_months, freq=freq)
+
+    # Listing month and lifetime of every security
+    first = rng.integers(0, n_months, n_permnos)
+    lifetime = rng.geometric(max(churn, 1e-9), n_permnos)
+    last = np.minimum(first + lifetime, n_months)
+    lengths = last - first
+
+    # One row per security and live month
+    permno_idx = np.repeat(np.arange(n_permnos), lengths)
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    month_idx = np.repeat(first, lengths) + np.arange(lengths.sum()) - starts
+    n_rows = len(permno_idx)
+
+    # Returns, and prices that compound them from a random listing price
+    ret = rng.normal(0.01, 0.12, n_rows).clip(-0.95, 3.0)
+    log_growth = np.log1p(ret)
+    cum = np.cumsum(log_growth)
+    cum -= np.repeat(cum[np.cumsum(lengths) - lengths] - log_growth[np.cumsum(lengths) - lengths], lengths)
+    prc = np.repeat(rng.lognormal(3.0, 1.0, n_permnos), lengths) * np.exp(cum)
+    prc = np.where(rng.random(n_rows) < 0.05, -prc, prc)
+    shrout = np.repeat(rng.lognormal(9.0, 1.5, n_permnos).round(), lengths)
+
+    # Letter and numeric missing-return codes
+    ret_text = np.round(ret, 6).astype(str).astype(object)
+    is_letter = rng.random(n_rows) < letter_share
+    ret_text[is_letter] = rng.choice(RET_LETTER_CODES, is_letter.sum())
+    is_missing = rng.random(n_rows) < letter_share / 4
+    ret_text[is_missing] = rng.choice(np.array(['-66.0', '-99.0'], dtype=object), is_missing.sum())
+
+    # Exchange and share codes, mostly inside the default universe
+    exchcd = np.repeat(rng.choice([1, 2, 3, 4], n_permnos, p=[0.3, 0.15, 0.5, 0.05]), lengths)
+    shrcd = np.repeat(rng.choice([10, 11, 12, 31, 73], n_permnos, p=[0.1, 0.75, 0.05, 0.05, 0.05]), lengths)
+
+    # Market returns are date-level fields repeated on every row
+    vwretd = rng.normal(0.008, 0.045, n_months)
+    ewretd = rng.normal(0.011, 0.055, n_months)
+
+    crsp = pd.DataFrame({
+        'date': (dates.year * 10000 + dates.month * 100 + dates.day).to_numpy()[month_idx],
+        'PERMNO': 10000 + permno_idx,
+        'EXCHCD': exchcd,
+        'SHRCD': shrcd,
+        'TICKER': np.char.add('T', permno_idx.astype(str)),
+        'PRC': prc.round(4),
+        'SHROUT': shrout,
+        'RET': ret_text,
+        'vwretd': vwretd[month_idx].round(6),
+        'ewretd': ewretd[month_idx].round(6),
+    })
+    return crsp.sort_values(['date', 'PERMNO'], ignore_index=True)[CRSP_COLUMNS]
+
+# Function to write a synthetic panel to a CSV file
+def write_crsp(path, **params):
+    crsp = generate_crsp(**params)
+    crsp.to_csv(path, index=False)
+    return crsp
@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+
+# =============================================================================
+# Ticker intervals
+# =============================================================================
+
+# Width of the day field in the composite (id, day) search keys; days are
+# shifted by half its range so dates before 1970 keep the keys ordered
+_DAY_BITS = 20
+_DAY_OFFSET = 1 << (_DAY_BITS - 1)
+
+# Function to turn dates into integer days since 1970
+def _days(dates):
+    return pd.DatetimeIndex(np.atleast_1d(pd.to_datetime(dates))).to_numpy(dtype='datetime64[D]').astype(np.int64)
+
+# Function to combine ids and days into keys sorted by id, then day
+def _keys(ids, days):
+    return (np.asarray(ids, dtype=np.int64) << _DAY_BITS) + days + _DAY_OFFSET
+
+class TickerIndex:
+    """Point-in-time map between PERMNOs and tickers.
+
+    Each row of the long CRSP panel is collapsed into intervals: one per run of
+    consecutive panel dates on which a PERMNO carries the same ticker (a PERMNO
+    missing from a date, or without a ticker on it, ends the run), stored as
+    ``(permno, start, end, ticker)`` with ``start``/``end`` the first and last
+    dates the ticker was observed. Intervals are kept twice in sorted order,
+    by (PERMNO, start) and by (ticker, start), so lookups in either direction
+    are a vectorized binary search over composite keys.
+    """
+
+    def __init__(self, permnos, starts, ends, codes, tickers):
+        self.tickers = pd.Index(tickers)
+
+        # By PERMNO, then start
+        order = np.lexsort((starts, permnos))
+        self.permnos = np.asarray(permnos, dtype=np.int64)[order]
+        self.starts = np.asarray(starts, dtype=np.int64)[order]
+        self.ends = np.asarray(ends, dtype=np.int64)[order]
+        self.codes = np.asarray(codes, dtype=np.int32)[order]
+        self.permno_keys = _keys(self.permnos, self.starts)
+
+        # By ticker, then start, as positions into the arrays above
+        self.ticker_order = np.lexsort((self.starts, self.codes))
+        self.ticker_keys = _keys(self.codes[self.ticker_order], self.starts[self.ticker_order])
+
+        # Latest end among the intervals of the same ticker up to each position,
+        # to detect dates covered by an earlier interval of a reused ticker
+        ordered_ends = _keys(self.codes[self.ticker_order], self.ends[self.ticker_order])
+        self.ticker_max_ends = np.maximum.accumulate(ordered_ends) if len(ordered_ends) else ordered_ends
+
+    # Function to build the index from the long CRSP frame
+    @classmethod
+    def from_crsp(cls, crsp):
+        """Build the index from the ``date``, ``PERMNO`` and ``TICKER`` columns.
+
+        The panel dates are those of every row of ``crsp``, with or without a
+        ticker.
+        """
+        panel_days = np.unique(_days(crsp['date']))
+        frame = crsp[['PERMNO', 'date', 'TICKER']].dropna(subset=['TICKER'])
+        codes, tickers = pd.factorize(frame['TICKER'].astype(str))
+        permnos = frame['PERMNO'].to_numpy(dtype=np.int64)
+        days = _days(frame['date'])
+
+        order = np.lexsort((days, permnos))
+        permnos, days, codes = permnos[order], days[order], codes[order]
+        positions = np.searchsorted(panel_days, days)
+
+        # A new interval starts wherever the PERMNO or the ticker changes, or
+        # panel dates were skipped since the previous row
+        is_start = np.ones(len(permnos), dtype=bool)
+        is_start[1:] = ((permnos[1:] != permnos[:-1]) | (codes[1:] != codes[:-1])
+                        | (positions[1:] > positions[:-1] + 1))
+        starts = np.flatnonzero(is_start)
+        ends = np.append(starts[1:], len(permnos)) - 1
+        return cls(permnos[starts], days[starts], days[ends], codes[starts], tickers)
+
+    def __len__(self):
+        return len(self.permnos)
+
+    @property
+    def nbytes(self):
+        return (self.permnos.nbytes + self.starts.nbytes + self.ends.nbytes + self.codes.nbytes
+                + self.permno_keys.nbytes + self.ticker_order.nbytes + self.ticker_keys.nbytes
+                + self.ticker_max_ends.nbytes)
+
+    # Function to list intervals as a frame
+    def to_frame(self, rows=slice(None)):
+        return pd.DataFrame({
+            'PERMNO': self.permnos[rows],
+            'start': self.starts[rows].astype('datetime64[D]'),
+            'end': self.ends[rows].astype('datetime64[D]'),
+            'TICKER': self.tickers.to_numpy()[self.codes[rows]],
+        })
+
+    # =========================================================================
+    # Point-in-time lookups
+    # =========================================================================
+
+    # Function to find the interval of each (id, day) query in a set of sorted keys
+    def _find(self, keys, ids, days):
+        return np.maximum(np.searchsorted(keys, _keys(ids, days), side='right') - 1, 0)
+
+    # Function to get the ticker of PERMNOs on a date
+    def ticker_of(self, permnos, date):
+        """Return the ticker of each PERMNO on ``date`` (None where it had none).
+
+        ``date`` is a single date or one date per PERMNO.
+        """
+        permnos = np.atleast_1d(np.asarray(permnos, dtype=np.int64))
+        days = np.broadcast_to(_days(date), permnos.shape)
+        if len(self.permnos) == 0:
+            return np.full(permnos.shape, None, dtype=object)
+        positions = self._find(self.permno_keys, permnos, days)
+        found = (self.permnos[positions] == permnos) & (self.starts[positions] <= days) & (self.ends[positions] >= days)
+        return np.where(found, self.tickers.to_numpy(dtype=object)[self.codes[positions]], None)
+
+    # Function to get the PERMNO that carried each ticker on a date
+    def permno_of(self, tickers, date):
+        """Return the PERMNO of each ticker on ``date`` (-1 where none carried it).
+
+        When two securities carried a ticker on the same date, the one whose
+        interval started later is returned; ``history`` lists all of them.
+        """
+        tickers = np.atleast_1d(np.asarray(tickers, dtype=object))
+        codes = self.tickers.get_indexer(tickers).astype(np.int64)
+        days = np.broadcast_to(_days(date), codes.shape)
+        if len(self.permnos) == 0:
+            return np.full(codes.shape, -1, dtype=np.int64)
+        ordered = self._find(self.ticker_keys, codes, days)
+        positions = self.ticker_order[ordered]
+        same_ticker = (codes >= 0) & (self.codes[positions] == codes) & (self.starts[positions] <= days)
+        found = same_ticker & (self.ends[positions] >= days)
+        result = np.where(found, self.permnos[positions], -1)
+
+        # Rare: the latest interval has ended but an earlier one of a reused ticker still covers the date
+        overlapped = same_ticker & ~found & (self.ticker_max_ends[ordered] >= _keys(codes, days))
+        for i in np.flatnonzero(overlapped):
+            j = ordered[i]
+            while self.ends[self.ticker_order[j]] < days[i]:
+                j -= 1
+            result[i] = self.permnos[self.ticker_order[j]]
+        return result
+
+    # Function to list every interval of a ticker
+    def history(self, ticker):
+        """Return the intervals in which ``ticker`` was carried, in time order."""
+        code = self.tickers.get_indexer([ticker])[0]
+        if code < 0:
+            return self.to_frame(slice(0))
+        lo, hi = np.searchsorted(self.ticker_keys, _keys([code, code + 1], -_DAY_OFFSET))
+        return self.to_frame(self.ticker_order[lo:hi])
+
+    # Function to list every ticker of a PERMNO
+    def permno_history(self, permno):
+        lo, hi = np.searchsorted(self.permno_keys, _keys([permno, permno + 1], -_DAY_OFFSET))
+        return self.to_frame(slice(lo, hi))
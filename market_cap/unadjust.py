@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+
+# =============================================================================
+# Dividend and split un-adjustment
+# =============================================================================
+
+# Function to take the reverse cumulative product of values within contiguous groups
+def reverse_cumprod(values, groups):
+    """Return, for every position, the product of ``values`` from it to the end of its group.
+
+    ``groups`` are integer codes and must be contiguous (the frame sorted by
+    group); every group is reduced in the same pass.
+    """
+    reversed_values = pd.Series(np.asarray(values, dtype=float)[::-1])
+    return reversed_values.groupby(np.asarray(groups)[::-1], sort=False).cumprod().to_numpy()[::-1]
+
+# Function to shift values up by one row within contiguous groups
+def _next_in_group(values, groups, fill):
+    values = np.asarray(values, dtype=float)
+    following = np.full(len(values), fill, dtype=float)
+    same_group = groups[1:] == groups[:-1]
+    following[:-1] = np.where(same_group, values[1:], fill)
+    return following
+
+# Function to reconstruct raw prices from dividend- and split-adjusted closes
+def unadjust(prices, symbol='symbol', date='date', close='Close', dividends='Dividends', splits='Stock Splits'):
+    """Return ``prices`` with ``div_factor``, ``split_factor`` and ``raw_close`` columns.
+
+    ``prices`` is a long frame of one or many tickers (``symbol`` set to None
+    for a single one) with adjusted closes and the dividends and split ratios
+    paid on each ex-date, as returned by Yahoo Finance. ``date`` may name a
+    column or the index.
+
+    A dividend ``D`` going ex on date ``t + 1`` scales every earlier close by
+    ``1 - D / Close_t``; a split of ratio ``k`` on date ``t + 1`` divides
+    every earlier close by ``k``. The factors that undo them are reverse
+    cumulative products over each ticker's dates, so only adjustments strictly
+    after a date apply to it, and ``raw_close`` is the close times both factors.
+    """
+    frame = prices.reset_index() if date not in prices.columns else prices
+    dates = frame[date]
+    if isinstance(dates.dtype, pd.DatetimeTZDtype):
+        dates = dates.dt.tz_convert(None)
+    dates = dates.to_numpy()
+    codes = pd.factorize(frame[symbol])[0] if symbol is not None else np.zeros(len(frame), dtype=np.int64)
+
+    # Sort by ticker, then date; results are put back in the input order
+    order = np.lexsort((dates, codes))
+    groups = codes[order]
+    closes = frame[close].to_numpy(dtype=float)[order]
+    next_dividends = _next_in_group(np.nan_to_num(frame[dividends].to_numpy(dtype=float)[order]), groups, 0.0)
+    next_splits = _next_in_group(frame[splits].to_numpy(dtype=float)[order], groups, 1.0)
+
+    # DivMult_t = 1 - Div_{t+1} / Close_t, and 1 where no dividend follows
+    with np.errstate(divide='ignore', invalid='ignore'):
+        div_mult = np.where(next_dividends != 0, 1 - next_dividends / closes, 1.0)
+    div_factor = reverse_cumprod(1 / div_mult, groups)
+
+    # Split ratios are 0 (or missing) on dates without a split
+    next_splits = np.where((next_splits == 0) | np.isnan(next_splits), 1.0, next_splits)
+    split_factor = reverse_cumprod(next_splits, groups)
+
+    result = prices.copy()
+    positions = np.empty(len(order), dtype=np.int64)
+    positions[order] = np.arange(len(order))
+    result['div_factor'] = div_factor[positions]
+    result['split_factor'] = split_factor[positions]
+    result['raw_close'] = result[close].to_numpy(dtype=float) * result['div_factor'] * result['split_factor']
+    return result
@@ -0,0 +1,18 @@
+import importlib.util
+import os
+
+# benchmarks/run.py is a script, so it is loaded from its path
+RUN_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'run.py')
+
+def _load_run():
+    spec = importlib.util.spec_from_file_location('benchmark_run', RUN_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def test_implementations_match_reference_loops(capsys):
+    run = _load_run()
+    run.main(['--permnos', '600', '--months', '40', '--repeat', '1', '--no-save', '--check-dates', '39'])
+    output = capsys.readouterr().out
+    assert 'match the reference loops' in output
+    assert 'evaluate' in output and 'run_families' in output
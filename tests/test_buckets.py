@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+from market_cap.buckets import assign_buckets, assign_by_breakpoints, breakpoint_table
+
+# Function to assign buckets one date at a time
+def _reference(values_df, table):
+    values = values_df.to_numpy(dtype=float)
+    breakpoints = np.asarray(table, dtype=float)
+    buckets = np.full(values.shape, np.nan)
+    for t in range(len(values)):
+        if np.isnan(breakpoints[t]).any():
+            continue
+        valid = ~np.isnan(values[t])
+        buckets[t, valid] = np.searchsorted(breakpoints[t], values[t, valid], side='left') + 1
+    return buckets
+
+# Function to assign quantile buckets row by row, as portfolios.py did with rank_to_deciles
+def _reference_buckets(mktcap_df, n_buckets):
+    return mktcap_df.apply(lambda row: pd.qcut(row.rank(method='first'), n_buckets, labels=False) + 1, axis=1)
+
+def test_assign_buckets_matches_per_row_rank_and_qcut():
+    rng = np.random.default_rng(1)
+    values = rng.lognormal(3.0, 2.0, (40, 400)).round(0)
+    values[rng.random(values.shape) < 0.3] = np.nan
+    # Rows with exactly and just over 100 stocks
+    values[3, 100:] = np.nan
+    values[4, 101:] = np.nan
+    mktcap_df = pd.DataFrame(values)
+
+    for n_buckets in (10, 100, 7):
+        expected = _reference_buckets(mktcap_df, n_buckets).to_numpy(dtype=float)
+        np.testing.assert_array_equal(assign_buckets(mktcap_df, n_buckets).to_numpy(), expected)
+
+def test_assign_by_breakpoints_matches_per_date_search():
+    rng = np.random.default_rng(0)
+    values = rng.lognormal(3.0, 2.0, (60, 300)).round(1)
+    values[rng.random(values.shape) < 0.3] = np.nan
+    values[5] = np.nan
+    universe = rng.random(values.shape) < 0.4
+    universe[7] = False
+    values_df = pd.DataFrame(values)
+
+    for n_buckets in (1, 5, 10):
+        table = breakpoint_table(values_df, universe, n_buckets)
+        expected = _reference(values_df, table)
+        np.testing.assert_array_equal(assign_by_breakpoints(values_df, table).to_numpy(), expected)
+
+def test_values_equal_to_a_breakpoint_go_in_the_lower_bucket():
+    values_df = pd.DataFrame([[1.0, 2.0, 2.5, 3.0, 4.0], [np.nan, -1.0, 0.0, 5.0, 3.0]])
+    table = pd.DataFrame([[2.0, 3.0], [0.0, 3.0]], columns=[1, 2])
+    expected = [[1, 1, 2, 2, 3], [np.nan, 1, 1, 3, 2]]
+    np.testing.assert_array_equal(assign_by_breakpoints(values_df, table).to_numpy(), expected)
@@ -0,0 +1,71 @@
+import os
+
+import pandas as pd
+
+from market_cap.cache import has_entry, read_entry, write_entry
+from market_cap.ingest import load_panel
+from market_cap.pipeline import PANEL_VALUES
+from market_cap.reconcile import CachedSource
+from market_cap.synthetic import write_crsp
+
+def test_prune_skips_temporary_and_unreadable_entries(tmp_path):
+    cache_dir = str(tmp_path)
+    frame = pd.DataFrame({'a': [1.0, 2.0]})
+    write_entry(cache_dir, 'old', 'source.csv', frames={'a': frame})
+    # Another writer's temporary directory and an entry caught mid-write
+    os.makedirs(os.path.join(cache_dir, 'other.1234.tmp'))
+    os.makedirs(os.path.join(cache_dir, 'partial'))
+    with open(os.path.join(cache_dir, 'partial', 'entry.json'), 'w') as f:
+        f.write('{"sour')
+
+    write_entry(cache_dir, 'new', 'source.csv', frames={'a': frame})
+    assert not has_entry(cache_dir, 'old') and has_entry(cache_dir, 'new')
+    assert os.path.isdir(os.path.join(cache_dir, 'other.1234.tmp'))
+    assert os.path.isdir(os.path.join(cache_dir, 'partial'))
+
+def test_write_without_prune_keeps_entries(tmp_path):
+    cache_dir = str(tmp_path)
+    frame = pd.DataFrame({'a': [1.0]})
+    write_entry(cache_dir, 'old', 'source.csv', frames={'a': frame})
+    write_entry(cache_dir, 'new', 'source.csv', frames={'a': frame}, prune=False)
+    assert has_entry(cache_dir, 'old') and has_entry(cache_dir, 'new')
+
+# Function to list the keys of the complete entries in a cache directory
+def _entries(cache_dir):
+    return {key for key in os.listdir(cache_dir) if has_entry(cache_dir, key)}
+
+def test_panels_of_other_values_are_kept(tmp_path):
+    crsp_path = os.path.join(tmp_path, 'crspm.csv')
+    write_crsp(crsp_path, n_permnos=100, n_months=12, start='2000-01-31', seed=4)
+    cache_dir = os.path.join(tmp_path, 'cache')
+
+    load_panel(crsp_path, PANEL_VALUES, cache_dir=cache_dir)
+    load_panel(crsp_path, ['MKTCAP'], cache_dir=cache_dir)
+    load_panel(crsp_path, PANEL_VALUES, cache_dir=cache_dir, compact=True)
+    assert len(_entries(cache_dir)) == 3
+
+    # A changed file replaces the entry of the same parameters only
+    old_entries = _entries(cache_dir)
+    write_crsp(crsp_path, n_permnos=100, n_months=12, start='2000-01-31', seed=5)
+    load_panel(crsp_path, ['MKTCAP'], cache_dir=cache_dir)
+    assert len(_entries(cache_dir)) == 3 and len(_entries(cache_dir) & old_entries) == 2
+
+class _Source:
+    name = 'test'
+
+    def __init__(self):
+        self.calls = 0
+
+    def fetch(self, ticker):
+        self.calls += 1
+        return pd.DataFrame({'date': pd.to_datetime(['2020-01-02']), 'Close': [1.0]})
+
+def test_cached_source_fetches_each_ticker_once(tmp_path):
+    source = _Source()
+    cached = CachedSource(source, str(tmp_path))
+    for ticker in ['AAA', 'BBB', 'AAA', 'BBB']:
+        prices = cached.fetch(ticker)
+    assert source.calls == 2
+    frames, _, meta = read_entry(str(tmp_path), cached.key('AAA'), mmap=False)
+    assert meta['ticker'] == 'AAA'
+    pd.testing.assert_frame_equal(frames['prices'], prices)
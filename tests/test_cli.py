@@ -0,0 +1,8 @@
+from market_cap.cli import build_parser
+
+def test_plot_targets_are_unique():
+    parser = build_parser()
+    plot = parser._subparsers._group_actions[0].choices['plot']
+    choices = next(action.choices for action in plot._actions if action.dest == 'name')
+    assert len(choices) == len(set(choices))
+    assert 'crsp-portfolios' in choices
@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from market_cap.compact import CompactPanel
+from market_cap.ingest import build_panel, clean_crsp, load_panel, read_crsp
+from market_cap.pipeline import build_portfolios
+from market_cap.specs import PortfolioSpec, default_specs, evaluate
+from market_cap.synthetic import write_crsp
+
+VALUES = ['RET', 'MKTCAP', 'EXCHCD']
+
+@pytest.fixture(scope='module')
+def crsp_path(tmp_path_factory):
+    path = os.path.join(tmp_path_factory.mktemp('compact'), 'crspm.csv')
+    write_crsp(path, n_permnos=800, n_months=48, start='1990-01-31', churn=0.03, seed=5)
+    return path
+
+@pytest.fixture(scope='module')
+def panels(crsp_path):
+    crsp = clean_crsp(read_crsp(crsp_path))
+    return build_panel(crsp, VALUES)[0], CompactPanel.from_long(crsp, VALUES)
+
+def test_round_trip_and_size(panels):
+    dense, compact = panels
+    for value in VALUES:
+        pd.testing.assert_frame_equal(compact.to_dense(value), dense[value].astype(float), check_names=False,
+                                      check_freq=False)
+    assert compact.nbytes < sum(df.to_numpy().nbytes for df in dense.values())
+
+def test_rankings_match_dense(panels):
+    dense, compact = panels
+    ranks, counts = compact.rank('MKTCAP', ascending=False)
+    expected = dense['MKTCAP'].rank(axis=1, method='first', ascending=False)
+    pd.testing.assert_frame_equal(compact.to_dense(ranks), expected, check_names=False, check_freq=False)
+    np.testing.assert_array_equal(counts, dense['MKTCAP'].notna().sum(axis=1))
+
+def test_evaluate_matches_dense(panels):
+    dense, compact = panels
+    specs = default_specs() + [
+        PortfolioSpec(buckets=100, weighting='vw'),
+        PortfolioSpec(top=500, lag=2),
+        PortfolioSpec(buckets=10, weighting='vw', breakpoints='nyse'),
+        PortfolioSpec(buckets=5, weighting='vw', breakpoints='nyse_amex', rebalance='june', drift=True),
+        PortfolioSpec(top=100, weighting='vw', rebalance='quarterly', drift=True),
+        PortfolioSpec(top=100, rebalance=('1991-03-15', '1992-07-01')),
+    ]
+    expected = evaluate(specs, dense)
+    actual = evaluate(specs, compact)
+    assert list(actual.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(actual, expected, check_freq=False, rtol=1e-12, atol=1e-14)
+
+def test_compact_pipeline_matches_dense(crsp_path, tmp_path):
+    cache_dir = os.path.join(tmp_path, 'cache')
+    _, dense, _ = build_portfolios(crsp_path, start_date=None, end_date=None, cache_dir=cache_dir)
+    for _ in range(2):
+        crsp, compact, _ = build_portfolios(crsp_path, start_date=None, end_date=None, cache_dir=cache_dir,
+                                            compact=True)
+        pd.testing.assert_frame_equal(compact, dense, check_freq=False, rtol=1e-12, atol=1e-14)
+    assert isinstance(load_panel(crsp_path, VALUES, cache_dir=cache_dir, compact=True)[1], CompactPanel)
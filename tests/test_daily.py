@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from market_cap.daily import DailyPortfolios, daily_returns
+from market_cap.ingest import read_crsp
+from market_cap.synthetic import write_crsp
+
+N_BUCKETS = 5
+SIZES = [10, 40]
+
+# Function to compute the buy-and-hold returns of every day with pandas, one day at a time
+def _reference(crsp):
+    crsp = crsp.drop_duplicates(['date', 'PERMNO'])
+    returns = crsp.pivot(index='date', columns='PERMNO', values='RET').astype(float)
+    returns = returns.mask(returns < -60)
+    caps = crsp.assign(MKTCAP=crsp['PRC'].astype(float).abs() * crsp['SHROUT']).pivot(
+        index='date', columns='PERMNO', values='MKTCAP')
+    dates = returns.index
+
+    rows = {}
+    for i, date in enumerate(dates):
+        earlier = dates[(dates < date) & (dates.to_period('M') < date.to_period('M'))]
+        if len(earlier) == 0:
+            continue
+        formed = earlier[-1]
+        formation_caps = caps.loc[formed].dropna()
+        labels = pd.qcut(formation_caps.rank(method='first'), N_BUCKETS, labels=False) + 1
+        descending = formation_caps.rank(method='first', ascending=False)
+        groups = {f'dec_{{}}_{b}': labels.index[labels == b] for b in range(1, N_BUCKETS + 1)}
+        groups.update({f'topx_m_{{}}_{size}': descending.index[descending <= size] for size in SIZES})
+
+        # Growth of each holding since the formation date, missing returns counting as zero
+        held = returns.loc[(dates > formed) & (dates < date), formation_caps.index].fillna(0.0)
+        growth = (1 + held).prod()
+        day = returns.loc[date, formation_caps.index]
+
+        row = {}
+        for name, stocks in groups.items():
+            valid = day[stocks].dropna().index
+            for weighting, weights in (('ew', growth), ('vw', growth * formation_caps)):
+                column = name.format(weighting)
+                if len(valid) == 0:
+                    row[column] = np.nan
+                    continue
+                row[column] = (day[valid] * weights[valid]).sum() / weights[valid].sum()
+        rows[date] = row
+    return pd.DataFrame.from_dict(rows, orient='index')
+
+@pytest.mark.parametrize('chunksize', [97, 1_000_000])
+def test_daily_returns_match_per_day_loop(tmp_path, chunksize):
+    path = os.path.join(tmp_path, 'crspd.csv')
+    write_crsp(path, n_permnos=150, n_months=70, start='2001-01-02', churn=0.01, letter_share=0.05, seed=5,
+               freq='B')
+    columns = DailyPortfolios(N_BUCKETS, SIZES).columns
+    dates, rows = zip(*daily_returns(path, N_BUCKETS, SIZES, chunksize=chunksize))
+    result = pd.DataFrame(list(rows), index=pd.DatetimeIndex(dates), columns=columns)
+
+    expected = _reference(read_crsp(path))[columns]
+    # Days of the first month precede any rebalance
+    assert result.loc[result.index < expected.index[0]].isna().all().all()
+    pd.testing.assert_frame_equal(result.loc[expected.index], expected, check_names=False, check_freq=False,
+                                  rtol=1e-10)
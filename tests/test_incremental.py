@@ -0,0 +1,75 @@
+import os
+
+import pandas as pd
+import pytest
+
+from market_cap.incremental import build_state, load_state, save_state, update, update_many
+from market_cap.ingest import clean_crsp, read_crsp
+from market_cap.pipeline import build_portfolios, cached_portfolios, save_state_results
+from market_cap.results import load_results
+from market_cap.specs import PortfolioSpec
+from market_cap.synthetic import write_crsp
+
+SIZES = [5, 10, 50]
+
+@pytest.fixture
+def crsp_path(tmp_path):
+    path = os.path.join(tmp_path, 'crspm.csv')
+    write_crsp(path, n_permnos=400, n_months=48, start='1990-01-31', seed=3)
+    return path
+
+# Function to read the cleaned rows after a date, as update-portfolios.py does
+def _new_rows(crsp_path, last_date):
+    new_rows = clean_crsp(read_crsp(crsp_path, exchcd=[1, 2, 3], shrcd=[10, 11, 12]), ret_floor=-60)
+    return new_rows[new_rows['date'] > last_date]
+
+def test_cut_build_then_update_matches_full_build(crsp_path, tmp_path):
+    state_path = os.path.join(tmp_path, 'state.pkl')
+    build_portfolios(crsp_path, start_date=None, end_date='1992-06-30', state_path=state_path, sizes=SIZES)
+    state = load_state(state_path)
+    assert state['last_date'] == pd.Timestamp('1992-06-30')
+
+    state, _ = update_many(state, _new_rows(crsp_path, state['last_date']))
+    _, portfolios, prices = build_portfolios(crsp_path, start_date=None, end_date=None, sizes=SIZES)
+
+    pd.testing.assert_frame_equal(state['portfolios'], portfolios, check_freq=False, check_names=False)
+    pd.testing.assert_frame_equal(state['prices'], prices, check_freq=False, check_names=False)
+
+def test_cache_hit_writes_missing_state_and_update_refreshes_results(crsp_path, tmp_path):
+    results_dir = os.path.join(tmp_path, 'results')
+    state_path = os.path.join(tmp_path, 'state.pkl')
+    params = dict(start_date=None, end_date='1992-06-30', sizes=SIZES)
+    portfolios, _, _ = cached_portfolios(results_dir, crsp_path, **params)
+    assert not os.path.exists(state_path)
+
+    # A stored result still gets its state
+    cached, _, _ = cached_portfolios(results_dir, crsp_path, state_path=state_path, **params)
+    pd.testing.assert_frame_equal(cached, portfolios)
+    state = load_state(state_path)
+    assert state['last_date'] == portfolios.index[-1]
+
+    # Months added by an update are served by the next cached run
+    state, new_returns = update_many(state, _new_rows(crsp_path, state['last_date']))
+    save_state(state, state_path)
+    assert save_state_results(state)
+    updated, prices, _ = cached_portfolios(results_dir, crsp_path, state_path=state_path, **params)
+    assert updated.index[-1] == new_returns.index[-1]
+    pd.testing.assert_frame_equal(prices, state['prices'], check_freq=False)
+    assert load_results(results_dir, state['results']['key']) is not None
+
+def test_state_rejects_columns_update_does_not_compute(crsp_path, tmp_path):
+    state_path = os.path.join(tmp_path, 'state.pkl')
+    specs = [PortfolioSpec(top=5, weighting='vw', rebalance='quarterly')]
+    with pytest.raises(ValueError, match='default families'):
+        build_portfolios(crsp_path, specs, start_date=None, end_date='1992-06-30', state_path=state_path, sizes=SIZES)
+
+    # A state whose series gained a column is rejected by update too
+    build_portfolios(crsp_path, start_date=None, end_date='1992-06-30', state_path=state_path, sizes=SIZES)
+    state = load_state(state_path)
+    state['portfolios'] = state['portfolios'].assign(extra=0.0)
+    new_rows = _new_rows(crsp_path, state['last_date'])
+    with pytest.raises(ValueError, match='extra'):
+        update(state, new_rows[new_rows['date'] == new_rows['date'].min()])
+    with pytest.raises(ValueError, match='default families'):
+        build_state(state['caps'].to_frame().T, state['deciles'].to_frame().T, state['year_ranks'],
+                    state['portfolios'], state['prices'], sizes=SIZES)
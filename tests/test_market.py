@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+from market_cap.market import market_returns
+
+DATES = pd.DatetimeIndex(['2000-01-31', '2000-02-29', '2000-03-31'], name='date')
+
+def test_market_returns_on_a_hand_built_panel():
+    nan = np.nan
+    ret_df = pd.DataFrame([[0.1, nan, 0.2], [0.05, -0.1, nan], [0.0, 0.2, 0.1]], index=DATES, columns=[1, 2, 3])
+    mktcap_df = pd.DataFrame([[100.0, 50.0, 200.0], [105.0, 45.0, nan], [105.0, 54.0, 30.0]], index=DATES,
+                             columns=[1, 2, 3])
+    # CRSP's market returns repeat on every row of a date, missing on some rows
+    crsp = pd.DataFrame({
+        'date': DATES.repeat(3),
+        'PERMNO': [1, 2, 3] * 3,
+        'vwretd': [nan, 0.01, 0.01, 0.02, 0.02, 0.02, nan, nan, nan],
+        'ewretd': [0.03, 0.03, nan, -0.01, -0.01, -0.01, 0.05, 0.05, 0.05],
+    })
+
+    market = market_returns(crsp, {'RET': ret_df, 'MKTCAP': mktcap_df})
+
+    # EW averages the date's returns; VW weights them by the previous date's caps
+    expected = pd.DataFrame({
+        'vwretd': [0.01, 0.02, nan],
+        'ewretd': [0.03, -0.01, 0.05],
+        'vw': [nan, (100 * 0.05 + 50 * -0.1) / 150, (105 * 0.0 + 45 * 0.2) / 150],
+        'ew': [0.15, -0.025, 0.1],
+    }, index=DATES)
+    expected['vw_dev'] = expected['vw'] - expected['vwretd']
+    expected['ew_dev'] = expected['ew'] - expected['ewretd']
+    pd.testing.assert_frame_equal(market, expected, check_freq=False, check_names=False)
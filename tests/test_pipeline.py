@@ -0,0 +1,42 @@
+import os
+
+import pandas as pd
+
+from market_cap.cache import has_entry
+from market_cap.pipeline import cached_market_returns, cached_portfolios
+from market_cap.results import latest_results
+from market_cap.synthetic import write_crsp
+
+def test_cached_market_returns_stores_and_reloads(tmp_path):
+    crsp_path = os.path.join(tmp_path, 'crspm.csv')
+    write_crsp(crsp_path, n_permnos=300, n_months=24, start='2000-01-31', seed=1)
+    results_dir = os.path.join(tmp_path, 'results')
+
+    computed = cached_market_returns(results_dir, crsp_path)
+    assert latest_results(results_dir, 'market') is not None
+    loaded = cached_market_returns(results_dir, crsp_path)
+    pd.testing.assert_frame_equal(loaded, computed, check_freq=False)
+    pd.testing.assert_frame_equal(cached_market_returns(None, crsp_path), computed, check_freq=False)
+
+# Function to list the keys of the results stored in a directory
+def _stored_keys(results_dir):
+    return {key for key in os.listdir(results_dir) if has_entry(results_dir, key)}
+
+def test_results_of_other_parameters_are_kept(tmp_path):
+    crsp_path = os.path.join(tmp_path, 'crspm.csv')
+    write_crsp(crsp_path, n_permnos=200, n_months=24, start='2000-01-31', seed=2)
+    results_dir = os.path.join(tmp_path, 'results')
+
+    # portfolios.py (no start date) and the CLI default share the CRSP file
+    cached_portfolios(results_dir, crsp_path, start_date=None, end_date=None, sizes=[5])
+    cached_portfolios(results_dir, crsp_path, sizes=[5])
+    assert len(_stored_keys(results_dir)) == 2
+    latest, _ = latest_results(results_dir, 'portfolios')
+    pd.testing.assert_frame_equal(latest['portfolios'], cached_portfolios(results_dir, crsp_path, sizes=[5])[0])
+
+    # New inputs replace only the result of the same parameters
+    old_keys = _stored_keys(results_dir)
+    write_crsp(crsp_path, n_permnos=200, n_months=24, start='2000-01-31', seed=3)
+    cached_portfolios(results_dir, crsp_path, start_date=None, end_date=None, sizes=[5])
+    keys = _stored_keys(results_dir)
+    assert len(keys) == 2 and len(keys & old_keys) == 1
@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+from market_cap.prices import PriceStore, cumulative_prices
+
+# Function to rebase returns the direct way; the first date is the base, so its returns are ignored
+def _cumprod_prices(returns):
+    returns = returns.copy()
+    returns.iloc[0] = 0.0
+    return (1 + returns).cumprod()
+
+def _returns():
+    dates = pd.date_range('2000-01-31', periods=8, freq='ME')
+    return pd.DataFrame({
+        'a': [0.1, 0.05, -1.0, 0.2, -0.1, 0.3, 0.0, 0.1],
+        'b': [0.0, 0.1, np.nan, -0.2, 0.1, 0.05, -0.3, 0.2],
+    }, index=dates)
+
+def test_windows_match_cumprod_with_a_total_loss():
+    returns = _returns()
+    store = PriceStore.from_returns(returns)
+    for start in returns.index:
+        window = returns.loc[start:]
+        expected = _cumprod_prices(window.fillna(0.0)).where(window.notna())
+        expected.iloc[0] = 1.0
+        actual = store.window(start)
+        assert np.isfinite(actual['a']).all()
+        np.testing.assert_allclose(actual.to_numpy(), expected.to_numpy(), rtol=1e-12, atol=1e-12)
+
+def test_cumulative_prices_of_a_total_loss_stay_at_zero():
+    prices = cumulative_prices(_returns())
+    np.testing.assert_allclose(prices['a'].iloc[2:], 0.0, atol=1e-12)
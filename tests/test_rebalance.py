@@ -0,0 +1,98 @@
+import os
+
+import pandas as pd
+import pytest
+
+from market_cap.compact import CompactPanel
+from market_cap.ingest import build_panel, clean_crsp, read_crsp
+from market_cap.rebalance import SCHEDULES
+from market_cap.specs import PortfolioSpec, evaluate
+from market_cap.synthetic import write_crsp
+
+CUSTOM = ('1990-05-20', '1991-02-28', '1992-09-15')
+
+@pytest.fixture(scope='module')
+def panels(tmp_path_factory):
+    path = os.path.join(tmp_path_factory.mktemp('rebalance'), 'crspm.csv')
+    write_crsp(path, n_permnos=150, n_months=40, start='1990-01-31', churn=0.03, seed=7)
+    crsp = clean_crsp(read_crsp(path))
+    return build_panel(crsp, ['RET', 'MKTCAP'])[0]
+
+# Function to list the formation dates of a schedule the way a reader of the docs would
+def _formations(dates, rebalance):
+    if isinstance(rebalance, str):
+        by_month = pd.Series(dates, index=dates).groupby([dates.year, dates.month]).max()
+        return [date for date in by_month if date.month in SCHEDULES[rebalance]]
+    return sorted({dates[dates <= date].max() for date in pd.to_datetime(list(rebalance)) if (dates <= date).any()})
+
+# Function to compute one spec's returns date by date
+def _reference(spec, ret_df, mktcap_df):
+    dates = ret_df.index
+    formations = _formations(dates, spec.rebalance)
+    ew = {}
+    vw = {}
+    for i, date in enumerate(dates):
+        held = [f for f in formations if f < date]
+        if not held:
+            continue
+        formed = held[-1]
+        caps = mktcap_df.loc[formed].dropna()
+        if spec.top is not None:
+            members = {1: caps.nlargest(min(spec.top, len(caps))).index}
+        else:
+            labels = pd.qcut(caps.rank(method='first'), spec.buckets, labels=False) + 1
+            members = {bucket: labels.index[labels == bucket] for bucket in range(1, spec.buckets + 1)}
+
+        returns = ret_df.loc[date]
+        if spec.drift:
+            # Growth of each holding from the formation date to the previous date
+            between = ret_df.loc[(dates > formed) & (dates < date)].fillna(0.0)
+            factors = (1 + between).prod()
+            ew_weights, vw_weights = factors, factors * mktcap_df.loc[formed]
+        else:
+            ew_weights, vw_weights = None, mktcap_df.iloc[i - 1]
+
+        for group, stocks in members.items():
+            stocks = stocks.intersection(returns.dropna().index)
+            if len(stocks) == 0:
+                continue
+            for out, weights in ((ew, ew_weights), (vw, vw_weights)):
+                if weights is None:
+                    out[(date, group)] = returns[stocks].mean()
+                    continue
+                weights = weights[stocks].dropna()
+                if len(weights):
+                    out[(date, group)] = (returns[weights.index] * weights).sum() / weights.sum()
+    return ew if spec.weighting == 'ew' else vw
+
+SPECS = [
+    PortfolioSpec(top=20, rebalance='quarterly'),
+    PortfolioSpec(top=20, weighting='vw', rebalance='june'),
+    PortfolioSpec(buckets=4, weighting='vw', rebalance='semiannual'),
+    PortfolioSpec(top=20, weighting='vw', rebalance=CUSTOM),
+    PortfolioSpec(top=20, rebalance='annual', drift=True),
+    PortfolioSpec(top=20, weighting='vw', rebalance='quarterly', drift=True),
+    PortfolioSpec(buckets=4, weighting='vw', rebalance='june', drift=True),
+    PortfolioSpec(buckets=4, rebalance=CUSTOM, drift=True),
+    PortfolioSpec(top=20, weighting='vw', drift=True),
+]
+
+@pytest.mark.parametrize('spec', SPECS, ids=lambda spec: spec.prefix)
+@pytest.mark.parametrize('layout', ['dense', 'compact'])
+def test_schedules_and_drift_match_per_date_loop(panels, spec, layout):
+    evaluated = panels if layout == 'dense' else CompactPanel.from_dense(panels)
+    result = evaluate([spec], evaluated)
+    expected = _reference(spec, panels['RET'].astype(float), panels['MKTCAP'].astype(float))
+    assert len(expected) > 0
+    for (date, group), value in expected.items():
+        column = spec.columns[group - 1]
+        assert result.loc[date, column] == pytest.approx(value, rel=1e-10), (date, column)
+    # Dates and groups without holdings are left empty
+    assert result.notna().sum().sum() == len(expected)
+
+def test_custom_calendars_get_distinct_columns():
+    first = PortfolioSpec(top=50, rebalance=('2000-06-30', '2001-06-29'))
+    second = PortfolioSpec(top=50, rebalance=('2000-12-29',))
+    assert first.columns != second.columns
+    assert first.columns == PortfolioSpec(top=50, rebalance=('2000-06-30', '2001-06-29')).columns
+    assert first.columns[0].startswith('topx_custom_')
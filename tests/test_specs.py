@@ -0,0 +1,36 @@
+import pandas as pd
+import pytest
+
+from market_cap.specs import PortfolioSpec, default_specs, evaluate
+
+@pytest.mark.parametrize('params', [
+    {},
+    {'buckets': 10, 'top': 50},
+    {'buckets': 0},
+    {'top': 0},
+    {'top': -5},
+])
+def test_invalid_specs_raise(params):
+    with pytest.raises(ValueError):
+        PortfolioSpec(**params)
+
+def test_default_specs_are_valid():
+    specs = default_specs()
+    assert len(specs) == 18
+    assert specs[0].columns[0] == 'dec_ew_1'
+    assert PortfolioSpec(top=50, rebalance='annual').columns == ['topx_y_ew_50']
+
+def test_weight_variable_is_part_of_the_column_name():
+    assert PortfolioSpec(top=50, weighting='vw').columns == ['topx_m_vw_50']
+    assert PortfolioSpec(top=50, weighting='vw', weight='PRC').columns == ['topx_m_vw_prc_50']
+    assert PortfolioSpec(buckets=10, weight='PRC').columns[0] == 'dec_ew_prc_1'
+
+def test_evaluate_rejects_specs_writing_the_same_column():
+    panels = {'RET': pd.DataFrame([[0.1, 0.2], [0.0, -0.1]]), 'MKTCAP': pd.DataFrame([[1.0, 2.0], [1.5, 2.5]])}
+    # The same spec twice is one column
+    assert list(evaluate([PortfolioSpec(top=1)] * 2, panels).columns) == ['topx_m_ew_1']
+
+    # Variable names are lower-cased in column names
+    with pytest.raises(ValueError, match='topx_m_vw_prc_1'):
+        evaluate([PortfolioSpec(top=1, weighting='vw', weight='PRC'),
+                  PortfolioSpec(top=1, weighting='vw', weight='prc')], panels)
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+from market_cap.tickers import TickerIndex
+
+DATES = pd.date_range('2000-01-31', periods=8, freq='ME')
+
+# Function to build long CRSP rows from (PERMNO, date positions, ticker) runs
+def _crsp(runs):
+    rows = [(permno, DATES[i], ticker) for permno, positions, ticker in runs for i in positions]
+    return pd.DataFrame(rows, columns=['PERMNO', 'date', 'TICKER'])
+
+def test_a_missing_date_ends_the_interval():
+    crsp = _crsp([
+        (10, [0, 1, 2], 'AAA'),
+        (10, [5, 6, 7], 'AAA'),
+        (20, [3, 4], 'AAA'),
+        (30, range(8), 'BBB'),
+    ])
+    index = TickerIndex.from_crsp(crsp)
+    assert len(index) == 4
+
+    # PERMNO 10 left the panel in months 3 and 4, when 20 carried AAA
+    tickers = index.ticker_of([10, 10, 10, 20], [DATES[2], DATES[3], DATES[5], DATES[4]])
+    assert list(tickers) == ['AAA', None, 'AAA', 'AAA']
+    assert list(index.permno_of(['AAA'] * 4, [DATES[2], DATES[3], DATES[4], DATES[5]])) == [10, 20, 20, 10]
+    assert index.ticker_of([20], DATES[5])[0] is None
+
+# Function to look the ticker of each (PERMNO, date) up row by row
+def _reference_ticker_of(crsp, permnos, dates):
+    lookup = crsp.set_index(['PERMNO', 'date'])['TICKER']
+    return [lookup.get((permno, date)) for permno, date in zip(permnos, dates)]
+
+def test_lookups_match_the_rows_on_each_date():
+    rng = np.random.default_rng(0)
+    rows = []
+    for permno in range(1, 40):
+        for date in DATES[rng.random(len(DATES)) < 0.7]:
+            rows.append((permno, date, f'T{rng.integers(3)}{permno % 5}'))
+    crsp = pd.DataFrame(rows, columns=['PERMNO', 'date', 'TICKER'])
+    index = TickerIndex.from_crsp(crsp)
+
+    permnos = np.repeat(np.arange(1, 40), len(DATES))
+    dates = np.tile(DATES, 39)
+    np.testing.assert_array_equal(index.ticker_of(permnos, dates), _reference_ticker_of(crsp, permnos, dates))
+
+    # Tickers carried by a single PERMNO on a date map back to it
+    for (date, ticker), group in crsp.groupby(['date', 'TICKER']):
+        if len(group) == 1:
+            assert index.permno_of([ticker], date)[0] == group['PERMNO'].iloc[0]
+    assert index.permno_of(['ZZZ'], DATES[0])[0] == -1
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from market_cap.unadjust import unadjust
+
+# Function to un-adjust one ticker the way yahoo-comparison/AAPL.py did, walking back from the last date
+def _reference(ticker_prices):
+    prices = ticker_prices.sort_values('date').reset_index(drop=True)
+    prices['Dividends_next'] = prices['Dividends'].shift(-1)
+    prices['DivMult'] = prices.apply(
+        lambda row: 1 if row['Dividends_next'] == 0 else (1 - row['Dividends_next'] / row['Close']), axis=1)
+    prices.at[prices.index[-1], 'DivMult'] = 1
+
+    prices['CumMult'] = 1.0
+    prices['SplitMult'] = 1.0
+    for i in range(len(prices) - 2, -1, -1):
+        if prices.at[i + 1, 'Dividends'] != 0:
+            prices.at[i, 'CumMult'] = prices.at[i + 1, 'CumMult'] / prices.at[i, 'DivMult']
+        else:
+            prices.at[i, 'CumMult'] = prices.at[i + 1, 'CumMult']
+        split = prices.at[i + 1, 'Stock Splits']
+        prices.at[i, 'SplitMult'] = prices.at[i + 1, 'SplitMult'] * (split if split != 0 else 1)
+    prices['Unadj Close'] = prices['Close'] * prices['CumMult'] * prices['SplitMult']
+    return prices
+
+def test_unadjust_matches_per_ticker_loop_on_shuffled_rows():
+    rng = np.random.default_rng(0)
+    frames = []
+    for symbol, n_dates in (('AAA', 120), ('BBB', 80), ('CCC', 1), ('DDD', 60)):
+        frames.append(pd.DataFrame({
+            'symbol': symbol,
+            'date': pd.bdate_range('2020-01-01', periods=n_dates),
+            'Close': rng.lognormal(4.0, 0.3, n_dates),
+            'Dividends': np.where(rng.random(n_dates) < 0.1, rng.uniform(0.1, 2.0, n_dates), 0.0),
+            'Stock Splits': np.where(rng.random(n_dates) < 0.03, rng.choice([2.0, 3.0, 0.5], n_dates), 0.0),
+        }))
+    prices = pd.concat(frames, ignore_index=True)
+    # Rows of every ticker, interleaved and out of date order
+    prices = prices.iloc[rng.permutation(len(prices))].reset_index(drop=True)
+
+    result = unadjust(prices)
+    pd.testing.assert_frame_equal(result[prices.columns], prices)
+    for symbol, rows in result.groupby('symbol'):
+        expected = _reference(prices[prices['symbol'] == symbol])
+        rows = rows.sort_values('date')
+        np.testing.assert_allclose(rows['div_factor'], expected['CumMult'], rtol=1e-12)
+        np.testing.assert_allclose(rows['split_factor'], expected['SplitMult'], rtol=1e-12)
+        np.testing.assert_allclose(rows['raw_close'], expected['Unadj Close'], rtol=1e-12)
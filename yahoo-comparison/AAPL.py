@@ -3,6 +3,12 @@ import numpy as np
 import yfinance as yf
 import matplotlib.pyplot as plt
 import os
+import sys
+
+# Make the shared `market_cap` modules importable from this directory or the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from market_cap.unadjust import unadjust
 
 # Sample period
 # startdate = pd.to_datetime('20230102', format='%Y%m%d')
@@ -12,10 +18,11 @@ import os
 #  Yahoo Finance Data
 # =============================================================================
 
-# Download historical stock data for AAPL
+# Download historical stock data for AAPL; many tickers, with the responses
+# cached for offline reruns, are compared at once by
+#     python -m market_cap reconcile AAPL MSFT ...
 aapl = yf.Ticker("AAPL")
 yfdata = aapl.history(period="max")
-yfdata_alt = yf.download('AAPL')
 
 # # Plot the Close price
 # plt.figure(figsize=(24, 10))
@@ -56,43 +63,6 @@ yfdata_alt = yf.download('AAPL')
 
 # =============================================================================
 
-### Reverse dividends
-
-# Retrieve historical market data
-yfdata2 = yfdata
-
-# Shift the Dividends column to get the next day's dividend
-yfdata2['Dividends_next'] = yfdata2['Dividends'].shift(-1)
-
-# Calculate the DivMult column based on the given condition
-yfdata2['DivMult'] = yfdata2.apply(
-    lambda row: 1 if row['Dividends_next'] == 0 else (1 - row['Dividends_next'] / row['Close']),
-    axis=1
-)
-
-# Set the last observation of DivMult to 1
-yfdata2.at[yfdata2.index[-1], 'DivMult'] = 1
-
-# Initialize the cumulative multiplier with 1 at the end
-yfdata2['CumMult'] = 1.0
-
-# Calculate the cumulative multiplier starting from the end
-for i in range(len(yfdata2) - 2, -1, -1):
-    current_index = yfdata2.index[i]
-    next_index = yfdata2.index[i + 1]
-    if yfdata2.at[next_index, 'Dividends'] != 0:
-        yfdata2.at[current_index, 'CumMult'] = yfdata2.at[next_index, 'CumMult'] / yfdata2.at[current_index, 'DivMult']
-    else:
-        yfdata2.at[current_index, 'CumMult'] = yfdata2.at[next_index, 'CumMult']
-
-# Calculate the Adj Close by multiplying Close by CumMult
-yfdata2['Unadj Close'] = yfdata2['Close'] * yfdata2['CumMult']
-
-# Drop the Dividends_next column as it's no longer needed
-yfdata2.drop(columns=['Dividends_next'], inplace=True)
-
-# =============================================================================
-
 ### Checking split adjustments
 
 # # Find the indices (dates) where Stock Splits are equal to 7
@@ -120,16 +90,22 @@ yfdata2.drop(columns=['Dividends_next'], inplace=True)
 
 # =============================================================================
 
-### Reverse splits
+### Reverse dividends and splits
+
+# Retrieve historical market data
+yfdata2 = unadjust(yfdata, symbol=None, date='Date')
 
-# Ensure the 'Stock Splits' column is filled with 1.0 where no split occurred
-yfdata2['Stock Splits'] = yfdata2['Stock Splits'].replace(0, 1)
+# CumMult undoes the dividend adjustments after each date: the reverse
+# cumulative product of 1 / DivMult, with DivMult = 1 - Dividends_{t+1} / Close_t
+yfdata2['CumMult'] = yfdata2['div_factor']
+yfdata2['Unadj Close'] = yfdata2['Close'] * yfdata2['CumMult']
 
-# Calculate the cumulative product of stock splits in reverse order
-yfdata2['Reverse Cumulative Splits'] = yfdata2['Stock Splits'][::-1].cumprod()[::-1]
+# The split factor counts only the splits after each date; on the ex-date
+# itself the close is already on the post-split basis
+yfdata2['Reverse Cumulative Splits'] = yfdata2['split_factor']
 
-# Calculate the unadjusted close price
-yfdata2['Unadjusted Close'] = yfdata2['Close'] * yfdata2['Reverse Cumulative Splits']
+# Unadjusted close, with both dividends and splits undone, as Compustat's prccd
+yfdata2['Unadjusted Close'] = yfdata2['raw_close']
 
 # =============================================================================
 # CRSP Data
@@ -139,7 +115,7 @@ yfdata2['Unadjusted Close'] = yfdata2['Close'] * yfdata2['Reverse Cumulative Spl
 filepath = os.getcwd()
 
 # Import CRSP data
-crspdata = pd.read_csv(f'{filepath}\\AAPL.csv')
+crspdata = pd.read_csv(os.path.join(filepath, 'AAPL.csv'))
 
 # Convert 'datadate' to datetime format
 crspdata['datadate'] = pd.to_datetime(crspdata['datadate'], format='%Y%m%d')
@@ -187,7 +163,6 @@ smallest_max_date = min(max_date_yf, max_date_crsp)
 
 # Subset both DataFrames to only include data between these dates
 yfdata3 = yfdata2.loc[largest_min_date:smallest_max_date]
-yfdata_alt = yfdata_alt.loc[largest_min_date:smallest_max_date]
 crspdata3 = crspdata[(crspdata['datadate'] >= largest_min_date) & (crspdata['datadate'] <= smallest_max_date)]
 
 # Create a new DataFrame from yfdata3 with the required columns
@@ -26,7 +26,7 @@ yfdata['Return'] = yfdata['Adj Close'].pct_change() * 100
 filepath = os.getcwd()
 
 # Import CRSP data
-crspdata = pd.read_csv(f'{filepath}\\AAPL.csv')
+crspdata = pd.read_csv(os.path.join(filepath, 'AAPL.csv'))
 
 # Keep only the necessary columns
 crspdata = crspdata[['datadate', 'GVKEY', 'prccd', 'ajexdi', 'trfd']]